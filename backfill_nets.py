@@ -0,0 +1,168 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from columnar import ChunkWriter, read_chunks
+from stream_join import checked_sorted, external_sort, input_sorted
+
+
+#####################################################################################################
+# Backfilling of the geocoded location file.  A spell geocoded only to a coarse level (Loc_name),    #
+# often an old address with information missing, takes the location of the business's next spell   #
+# that was geocoded precisely enough.  The file is streamed in batches of whole DunsNumber groups.  #
+#####################################################################################################
+
+
+# Geocoder match levels in Loc_name, most precise first.  Anything not listed ranks below all of them
+PRECISION = ['US_RoofTop', 'US_Streets', 'US_StreetName', 'US_ZIP4', 'US_Zipcode', 'US_CityState']
+
+# Columns taken from the spell a bad spell is backfilled from
+LOCATION_COLS = ['Address', 'City', 'State', 'ZIP', 'CITYCODE', 'FipsCounty', 'Loc_name']
+
+
+def precision_rank(loc_name, precision=PRECISION):
+    """Rank of each Loc_name, from len(precision) for the most precise level down to 0 for unknown levels"""
+    ranks = {name: len(precision) - i for i, name in enumerate(precision)}
+    return pd.Series(loc_name).map(ranks).fillna(0).to_numpy(dtype='int64')
+
+
+def next_good(duns, good):
+    """Position of the first row at or after each row with good set and the same DunsNumber, or -1
+
+    :param duns: DunsNumber per row, with each business's rows together
+    :param good: boolean array
+    """
+    n = len(duns)
+    position = np.where(good, np.arange(n), n)
+    position = np.minimum.accumulate(position[::-1])[::-1]
+
+    found = position < n
+    found[found] = duns[position[found]] == duns[found]
+    return np.where(found, position, -1)
+
+
+def backfill(df, min_level='US_StreetName', precision=PRECISION, columns=LOCATION_COLS):
+    """Backfill a batch of normalized locations holding whole DunsNumber groups
+
+    A spell is bad if its Loc_name is less precise than min_level.  Bad spells take the location columns of the next
+    good spell of the same business, by FirstYear.  Bad spells with no later good spell are left as they are.
+
+    :param df: DataFrame indexed by BEH_ID with DunsNumber, FirstYear, Loc_name and location columns
+    :param min_level: least precise Loc_name that counts as good
+    :param precision: Loc_name levels, most precise first
+    :param columns: columns to take from the good spell, those missing from df are ignored
+
+    :return: df sorted by (DunsNumber, FirstYear), with a Backfilled column flagging the rows that were changed
+    """
+    df = df.sort_values(['DunsNumber', 'FirstYear'], kind='mergesort')
+    good = precision_rank(df['Loc_name'], precision) >= precision_rank([min_level], precision)[0]
+    source = next_good(df['DunsNumber'].to_numpy(), good)
+
+    fill = np.flatnonzero(~good & (source >= 0))
+    for col in [x for x in columns if x in df.columns]:
+        values = df[col].to_numpy(copy=True)
+        values[fill] = values[source[fill]]
+        df[col] = values
+
+    df['Backfilled'] = np.zeros(len(df), dtype='int8')
+    df.iloc[fill, df.columns.get_loc('Backfilled')] = 1
+    return df
+
+
+def group_batches(chunks):
+    """Re-cut chunks sorted by DunsNumber so that no DunsNumber is split between batches
+
+    The rows of the last DunsNumber of every chunk are held back and put in front of the next one.
+    """
+    carry = None
+    for chunk in chunks:
+        chunk = chunk if carry is None else pd.concat([carry, chunk])
+        duns = chunk['DunsNumber'].to_numpy()
+        if len(duns) == 0:
+            continue
+
+        cut = np.searchsorted(duns, duns[-1], side='left')
+        carry = chunk.iloc[cut:]
+        if cut:
+            yield chunk.iloc[:cut]
+
+    if carry is not None and len(carry):
+        yield carry
+
+
+def read_locations(filepath, chunksize=10**6, assume_sorted=None, marker_dir=None):
+    """Yield chunks of a location file indexed by BEH_ID, sorted by DunsNumber if the file isn't already
+
+    Whether it is comes from assume_sorted, from the marker an earlier run left in marker_dir, or from reading its
+    DunsNumber column, see stream_join.input_sorted.
+    """
+    def read(columns=None):
+        for chunk in read_chunks(filepath, columns=columns, chunksize=chunksize):
+            yield chunk.set_index('BEH_ID') if 'BEH_ID' in chunk.columns else chunk
+
+    keys = (chunk.set_index('DunsNumber') for chunk in read(['DunsNumber']))
+    if input_sorted(keys, filepath, assume_sorted, marker_dir):
+        for chunk in checked_sorted(read(), filepath, key='DunsNumber', marker_dir=marker_dir):
+            yield chunk
+    else:
+        print('{} is not sorted by DunsNumber, sorting it first'.format(filepath))
+        by_duns = (chunk.reset_index().set_index('DunsNumber') for chunk in read())
+        for chunk in external_sort(by_duns):
+            yield chunk.reset_index().set_index('BEH_ID')
+
+
+def backfill_locations(read_path, write_path, min_level='US_StreetName', precision=PRECISION, chunksize=10**6,
+                       assume_sorted=None):
+    """Backfill a geocoded location file in one pass, holding about one chunk in memory
+
+    :param read_path: geocoded location file, CSV or Parquet, with BEH_ID, DunsNumber, FirstYear and Loc_name
+    :param write_path: path to write the backfilled file to, CSV or Parquet
+    :param min_level: least precise Loc_name that counts as good, see backfill
+    :param precision: Loc_name levels, most precise first
+    :param chunksize: rows read at a time
+    :param assume_sorted: True if read_path is known to be sorted by DunsNumber, see read_locations
+
+    :return: number of spells backfilled
+    """
+    n_filled = 0
+    with ChunkWriter(write_path, index=True, float_format='%.f') as writer:
+        # Markers of whether read_path is sorted go next to the output
+        out_dir = os.path.dirname(os.path.abspath(str(write_path)))
+        for batch in group_batches(read_locations(read_path, chunksize, assume_sorted, out_dir)):
+            filled = backfill(batch, min_level, precision)
+            n_filled += int(filled['Backfilled'].sum())
+            writer.write(filled)
+            print('.')
+
+    return n_filled
+
+
+def main():
+    import argparse
+    from pathlib import Path
+    from tkinter import filedialog, Tk
+
+    parser = argparse.ArgumentParser(description='Backfill coarse geocodes in the NETS location file')
+    parser.add_argument('--min-level', default='US_StreetName', choices=PRECISION,
+                        help='Least precise Loc_name that is not backfilled')
+    parser.add_argument('--chunksize', type=int, default=10**6, help='Rows read at a time')
+    parser.add_argument('--sorted', action='store_true', help='The location file is sorted by DunsNumber, skip checking')
+    args = parser.parse_args()
+
+    root = Tk()
+    root.withdraw()
+    data_dir = Path(filedialog.askdirectory(initial=os.getcwd(),
+                                            title='Select the root data folder'))
+    geocoded = data_dir / 'interim' / 'NETS2014_Locations_geocoded.csv'
+    backfilled = data_dir / 'interim' / 'NETS2014_Locations_backfilled.csv'
+
+    n_filled = backfill_locations(geocoded, backfilled, min_level=args.min_level, chunksize=args.chunksize,
+                                  assume_sorted=args.sorted or None)
+    print('Backfilled {} spells'.format(n_filled))
+
+if __name__ == "__main__":
+    time1 = time.time()
+    main()
+    print(time.time() - time1)
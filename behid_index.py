@@ -0,0 +1,115 @@
+import os
+from pathlib import Path
+
+import numpy as np
+
+from columnar import read_chunks
+
+
+#####################################################################################################
+# BEH_IDs and a persistent (DunsNumber, Year) -> BEH_ID index.  A BEH_ID is                          #
+# BEH_LOC * 10**9 + 10**10 + DunsNumber, as made in create_locations.  The index is a few sorted     #
+# .npy arrays, memory-mapped when opened, so any stage can resolve BEH_IDs with searchsorted         #
+# instead of loading the location file into pandas.                                                 #
+#####################################################################################################
+
+
+DUNS_LIMIT = 10**9
+YEAR_LIMIT = 10**4
+INDEX_FILES = ('key', 'lastyear', 'behid')
+
+
+def encode_behid(duns, beh_loc):
+    """BEH_ID of each (DunsNumber, BEH_LOC) pair"""
+    return np.asarray(beh_loc, dtype='int64') * DUNS_LIMIT + 10**10 + np.asarray(duns, dtype='int64')
+
+
+def decode_behid(behid):
+    """Split BEH_IDs back into (DunsNumber, BEH_LOC) arrays"""
+    beh_loc, duns = np.divmod(np.asarray(behid, dtype='int64') - 10**10, DUNS_LIMIT)
+    return duns, beh_loc
+
+
+def spell_key(duns, year):
+    """Sort key of (DunsNumber, Year) pairs, DunsNumber first"""
+    return np.asarray(duns, dtype='int64') * YEAR_LIMIT + np.asarray(year, dtype='int64')
+
+
+class BehidIndex:
+    """Spells sorted by (DunsNumber, FirstYear), with their LastYear and BEH_ID
+
+    A (DunsNumber, Year) lookup finds the last spell of that business starting in or before Year, and answers its
+    BEH_ID if the spell is still running in Year.
+    """
+
+    def __init__(self, key, lastyear, behid):
+        """
+        Keyword Arguments:
+            key: spell_key(DunsNumber, FirstYear) of every spell, sorted
+            lastyear: LastYear of every spell
+            behid: BEH_ID of every spell
+        """
+        self.key = key
+        self.lastyear = lastyear
+        self.behid = behid
+
+    def __len__(self):
+        return len(self.key)
+
+    @classmethod
+    def build(cls, duns, firstyear, lastyear, behid, index_dir=None):
+        """Sort spells into an index, written to index_dir if given
+
+        Keyword Arguments:
+            duns, firstyear, lastyear, behid: One element per spell
+            index_dir: Optional folder to save the index in, see open()
+        """
+        key = spell_key(duns, firstyear)
+        order = np.argsort(key, kind='stable')
+        index = cls(key[order], np.asarray(lastyear, dtype='int64')[order], np.asarray(behid, dtype='int64')[order])
+
+        if index_dir is not None:
+            os.makedirs(index_dir, exist_ok=True)
+            for name in INDEX_FILES:
+                np.save(Path(index_dir) / '{}.npy'.format(name), getattr(index, name))
+        return index
+
+    @classmethod
+    def from_file(cls, loc_path, index_dir=None, chunksize=10**6):
+        """Build the index from a location file (CSV or Parquet) with BEH_ID, DunsNumber, FirstYear and LastYear"""
+        columns = {x: [] for x in ['DunsNumber', 'FirstYear', 'LastYear', 'BEH_ID']}
+        for chunk in read_chunks(loc_path, columns=list(columns), chunksize=chunksize):
+            for col in columns:
+                columns[col].append(chunk[col].to_numpy(dtype='int64'))
+
+        return cls.build(*[np.concatenate(x) if x else np.zeros(0, dtype='int64') for x in columns.values()],
+                         index_dir=index_dir)
+
+    @classmethod
+    def open(cls, index_dir, mode='r'):
+        """Open an index saved by build(), memory-mapping its arrays"""
+        return cls(*[np.load(Path(index_dir) / '{}.npy'.format(name), mmap_mode=mode) for name in INDEX_FILES])
+
+    def positions(self, duns, year):
+        """Position of the spell covering each (DunsNumber, Year), -1 where there is none"""
+        duns = np.asarray(duns, dtype='int64')
+        year = np.asarray(year, dtype='int64')
+        if len(self.key) == 0:
+            return np.full(duns.shape, -1, dtype='int64')
+
+        position = np.searchsorted(self.key, spell_key(duns, year), side='right') - 1
+        candidate = np.maximum(position, 0)
+        found = (position >= 0) & (self.key[candidate] // YEAR_LIMIT == duns) & (self.lastyear[candidate] >= year)
+        return np.where(found, position, -1)
+
+    def lookup(self, duns, year, missing=0):
+        """BEH_ID of each (DunsNumber, Year) pair, missing where the business had no spell that year"""
+        position = self.positions(duns, year)
+        if len(self.key) == 0:
+            return np.full(position.shape, missing, dtype='int64')
+        return np.where(position >= 0, self.behid[np.maximum(position, 0)], missing)
+
+    def get(self, duns, year):
+        """BEH_ID of a single (DunsNumber, Year), or None"""
+        position = self.positions([duns], [year])[0]
+        return int(self.behid[position]) if position >= 0 else None
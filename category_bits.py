@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+
+#####################################################################################################
+# Bit-packed storage for the multi-label category flags.  Every category column is given a fixed   #
+# bit, so a BEH_ID's aux, aux hierarchy and main flags fit in a few uint64 words instead of hundreds #
+# of int64 columns, and questions like "any of these aux" become bitwise ANDs.                       #
+#####################################################################################################
+
+
+CONFIG_FILES = ['aux_no_hier_vars.txt', 'aux_hier_vars.txt', 'main_no_hier_vars.txt', 'main_hier_vars.txt']
+
+
+class CategorySchema:
+    """Mapping between category columns and bit positions, column i lives in bit i % 64 of word i // 64"""
+
+    def __init__(self, columns):
+        """
+        Keyword Arguments:
+            columns: Ordered list of category column names.  The order is the storage format, only ever append to it
+        """
+        if len(set(columns)) != len(columns):
+            raise ValueError('Category schema contains duplicate columns')
+
+        self.columns = list(columns)
+        self.bits = {col: i for i, col in enumerate(self.columns)}
+        self.n_words = max(1, -(-len(self.columns) // 64))
+        self.word_names = ['cat_bits_{}'.format(i) for i in range(self.n_words)]
+
+    @classmethod
+    def from_files(cls, filepaths):
+        """Build a schema from text files listing one column per line, in file order"""
+        columns = []
+        for filepath in filepaths:
+            with open(filepath, 'r') as f:
+                columns += [line.strip() for line in f.readlines() if line.strip()]
+        return cls(columns)
+
+    @classmethod
+    def from_config(cls, config_path, filenames=CONFIG_FILES):
+        """Build the schema from the aux/main variable lists in the config folder"""
+        return cls.from_files([Path(config_path) / x for x in filenames])
+
+    def pack(self, df):
+        """Pack the schema's columns of df (0/1 or bool) into an (n_rows, n_words) uint64 array"""
+        missing = [x for x in self.columns if x not in df.columns]
+        if missing:
+            raise ValueError('Columns of the category schema missing, can\'t pack: {}'.format(missing))
+        flags = np.zeros((len(df), self.n_words * 64), dtype=bool)
+        flags[:, :len(self.columns)] = df[self.columns].to_numpy() != 0
+
+        return np.packbits(flags, axis=1, bitorder='little').view('<u8')
+
+    def unpack(self, words, columns=None, index=None):
+        """Expand packed words back into a DataFrame of uint8 dummies
+
+        Keyword Arguments:
+            words: (n_rows, n_words) uint64 array from pack()
+            columns: Subset of columns to expand, all of them by default
+            index: Optional index for the DataFrame
+        """
+        columns = self.columns if columns is None else list(columns)
+        flags = np.unpackbits(np.ascontiguousarray(words, dtype='<u8').view('uint8'), axis=1, bitorder='little')
+        positions = [self.bits[x] for x in columns]
+
+        return pd.DataFrame(flags[:, positions], index=index, columns=columns)
+
+    def mask(self, columns):
+        """A (n_words,) uint64 mask with the bits of columns set"""
+        mask = np.zeros(self.n_words, dtype='uint64')
+        for col in columns:
+            word, bit = divmod(self.bits[col], 64)
+            mask[word] |= np.uint64(1) << np.uint64(bit)
+        return mask
+
+    def any_of(self, words, columns):
+        """Boolean array of the rows with at least one of columns set"""
+        return (words & self.mask(columns)).any(axis=1)
+
+    def all_of(self, words, columns):
+        """Boolean array of the rows with all of columns set"""
+        mask = self.mask(columns)
+        return ((words & mask) == mask).all(axis=1)
+
+    def to_frame(self, df):
+        """Writer side: replace the schema's columns of df with its packed cat_bits_ words"""
+        packed = pd.DataFrame(self.pack(df), index=df.index, columns=self.word_names)
+        others = [x for x in df.columns if x not in self.bits]
+        return pd.concat([df[others], packed], axis=1)
+
+    def from_frame(self, df, columns=None):
+        """Reader side: replace the cat_bits_ words of df with the requested category columns"""
+        words = df[self.word_names].to_numpy(dtype='uint64')
+        others = [x for x in df.columns if x not in self.word_names]
+        return pd.concat([df[others], self.unpack(words, columns, df.index)], axis=1)
+
+
+def is_packed(columns, schema):
+    """True if columns, such as the header of a file, hold the cat_bits_ words of schema"""
+    return all(x in columns for x in schema.word_names)
+
+
+def unpacked_columns(columns, schema):
+    """The columns of a packed file once unpacked by from_frame, its cat_bits_ words standing for schema's columns"""
+    return [x for x in columns if x not in schema.word_names] + schema.columns
+
+
+def packed_columns(columns, schema):
+    """The columns to read off a packed file to unpack columns from it: the cat_bits_ words for the schema's columns"""
+    return [x for x in columns if x not in schema.bits] + schema.word_names
+
+
+def save_bits(filepath, index, words, schema):
+    """Write packed words and their index (such as BEH_ID) to a .npz file, recording the schema's columns"""
+    np.savez(filepath, index=np.asarray(index), words=words, columns=np.array(schema.columns))
+
+
+def load_bits(filepath, schema):
+    """Read a file written by save_bits, checking that it was written with a compatible schema
+
+    Returns:
+        (index, words)
+    """
+    with np.load(filepath, allow_pickle=False) as data:
+        columns = data['columns'].tolist()
+        if columns != schema.columns[:len(columns)]:
+            raise ValueError('{} was written with a different category schema'.format(filepath))
+
+        index = data['index']
+        words = data['words']
+
+    if words.shape[1] < schema.n_words:
+        # Schema has grown since the file was written: the new columns are all 0
+        words = np.pad(words, ((0, 0), (0, schema.n_words - words.shape[1])))
+
+    return index, words
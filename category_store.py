@@ -0,0 +1,294 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from columnar import ChunkWriter
+
+
+#####################################################################################################
+# On-disk store of classification outputs, one uint8 file per category column plus the BEH_ID index, #
+# with a fingerprint of the config entry each column was computed from.  A rerun after a config    #
+# change only recomputes the columns whose fingerprint changed and the main/hierarchy columns that   #
+# depend on them.                                                                                    #
+#####################################################################################################
+
+
+def category_fingerprint(local_config):
+    """Hash of a category's config entry (sic_*, name, emp, sales, conditional), independent of key order"""
+    text = json.dumps(local_config, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def config_fingerprints(all_config):
+    """Fingerprint of every category of a loaded JSON config"""
+    return {name: category_fingerprint(local_config) for name, local_config in all_config.items()}
+
+
+def derived_fingerprints(fingerprints, main_cats, hier_list):
+    """Fingerprints of the main, hierarchy and main hierarchy columns, from the fingerprints of the aux columns
+
+    A derived column's fingerprint is a hash of the fingerprints of the columns it depends on, so it only changes
+    when one of those does.  A row's hierarchy category is its first aux category in hier_list, so hierarchy column
+    {code}h depends on code and every code before it, and NOT on all of them.  Main category {main} depends on its aux
+    categories and main hierarchy {main}h on their hierarchy columns.
+
+    Keyword Arguments:
+        fingerprints: Fingerprints of the aux columns, including any not classified from the config
+        main_cats: Main category config, {main code: [aux codes]}
+        hier_list: Aux codes in hierarchy priority order
+    """
+    def combine(kind, columns, source):
+        return category_fingerprint({kind: [source[x] for x in columns]})
+
+    derived = {}
+    for i, code in enumerate(hier_list):
+        derived[code + 'h'] = combine('hierarchy', hier_list[:i + 1], fingerprints)
+    derived['NOT'] = combine('not', hier_list, fingerprints)
+    for main, subs in main_cats.items():
+        derived[main] = combine('main', subs, fingerprints)
+        derived[main + 'h'] = combine('main_hierarchy', [x + 'h' for x in subs], derived)
+    return derived
+
+
+def derive_columns(aux, main_cats, hier_list):
+    """Main, hierarchy, NOT and main hierarchy flags of a DataFrame of aux flags, as phase_3.reclassify sets them
+
+    NOT is set for rows without any hierarchy category.  (phase_3.reclassify tests for that after adding the NOT
+    column itself, which leaves it 0 everywhere.)
+    """
+    flags = aux[hier_list].to_numpy() == 1
+    classified = np.flatnonzero(flags.any(axis=1))
+    hierarchy = np.zeros(flags.shape, dtype='uint8')
+    hierarchy[classified, flags[classified].argmax(axis=1)] = 1
+
+    derived = pd.DataFrame(hierarchy, index=aux.index, columns=[x + 'h' for x in hier_list])
+    derived['NOT'] = (~flags.any(axis=1)).astype('uint8')
+    for main, subs in main_cats.items():
+        derived[main] = (aux[subs].to_numpy() != 0).any(axis=1).astype('uint8')
+        derived[main + 'h'] = derived[[x + 'h' for x in subs]].to_numpy().any(axis=1).astype('uint8')
+    return derived
+
+
+def refresh_derived(store, main_cats, hier_list, chunksize=10**6):
+    """Recompute the derived columns of store whose inputs changed, see derived_fingerprints
+
+    Every aux code in main_cats and hier_list has to be in the store, including those that don't come from the
+    classifier config.
+
+    Returns:
+        List of the recomputed columns
+    """
+    aux_codes = sorted(set(hier_list) | set(x for subs in main_cats.values() for x in subs))
+    missing = [x for x in aux_codes if x not in store.fingerprints]
+    if missing:
+        raise KeyError('Aux categories missing from the category store, load them with load_columns: {}'.format(
+            ', '.join(missing)))
+
+    expected = derived_fingerprints(store.fingerprints, main_cats, hier_list)
+    changed = store.changed(expected)
+    if not changed:
+        return []
+
+    with store.writer({x: expected[x] for x in changed}) as writer:
+        for start in range(0, store.n_rows, chunksize):
+            aux = store.frame(aux_codes, start, start + chunksize)
+            writer.write(derive_columns(aux, main_cats, hier_list)[changed])
+    return changed
+
+
+def column_fingerprint(values, block_size=10**7):
+    """Hash of the contents of a stored column, for columns loaded from a file rather than classified"""
+    digest = hashlib.blake2b(digest_size=16)
+    for start in range(0, len(values), block_size):
+        digest.update(np.ascontiguousarray(values[start:start + block_size]).tobytes())
+    return digest.hexdigest()
+
+
+def load_columns(store, chunks, columns):
+    """Load columns that aren't classified from the config, such as the TDLINX aux categories, into store
+
+    Rows are matched on BEH_ID, so chunks can be in any order.  Stored rows missing from them get 0.  Each column's
+    fingerprint is a hash of its contents, so the derived columns depending on it are only recomputed by
+    refresh_derived when the loaded values actually changed.
+
+    Keyword Arguments:
+        store: CategoryStore holding an index
+        chunks: Iterable of DataFrames of 0/1 flags indexed by BEH_ID, with the columns
+        columns: Names of the columns to load
+
+    Returns:
+        Number of stored rows that were found in chunks
+    """
+    index = store.index()
+    order = np.argsort(index, kind='stable')
+    sorted_ids = index[order]
+    tmp_paths = {x: store.store_dir / '{}.u1.tmp'.format(x) for x in columns}
+    arrays = {x: np.memmap(str(path), dtype='uint8', mode='w+', shape=(store.n_rows,)) for x, path in tmp_paths.items()}
+
+    n_found = 0
+    for chunk in chunks:
+        ids = chunk.index.to_numpy(dtype='int64')
+        position = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        found = sorted_ids[position] == ids
+        rows = order[position[found]]
+        for column, values in arrays.items():
+            values[rows] = chunk[column].to_numpy()[found] != 0
+        n_found += int(found.sum())
+
+    fingerprints = {}
+    for column, values in arrays.items():
+        values.flush()
+        fingerprints[column] = column_fingerprint(values)
+    del arrays
+
+    for column, path in tmp_paths.items():
+        os.replace(str(path), str(store.path(column)))
+    store.fingerprints.update(fingerprints)
+    store.save_meta()
+    return n_found
+
+
+def export_columns(store, write_path, columns, chunksize=10**6):
+    """Write stored columns to a CSV or Parquet file indexed by BEH_ID, as classify_nets.classify_chunks writes them
+
+    Keyword Arguments:
+        store: CategoryStore to export
+        write_path: File to write, Parquet if it ends in .parquet
+        columns: Stored columns to write, in order
+        chunksize: Rows written at a time
+    """
+    with ChunkWriter(write_path, index=True) as writer:
+        for start in range(0, store.n_rows, chunksize):
+            writer.write(store.frame(columns, start, start + chunksize).astype('int64'))
+
+
+class CategoryStore:
+    """Directory holding index.i8 (BEH_IDs in row order), one {column}.u1 file of 0/1 flags per column and meta.json
+
+    Columns are read back memory-mapped.  Writes go to temporary files that only replace the stored ones, and only
+    then update meta.json, once a StoreWriter is committed, so an interrupted run leaves the store as it was.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = Path(store_dir)
+        os.makedirs(str(self.store_dir), exist_ok=True)
+        self.meta_path = self.store_dir / 'meta.json'
+        if self.meta_path.exists():
+            with open(self.meta_path, 'r') as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = {'n_rows': None, 'fingerprints': {}}
+
+    @property
+    def n_rows(self):
+        return self.meta['n_rows']
+
+    @property
+    def fingerprints(self):
+        return self.meta['fingerprints']
+
+    @property
+    def source(self):
+        """Fingerprint of the inputs the stored rows were classified from, as given to set_source"""
+        return self.meta.get('source')
+
+    def set_source(self, source):
+        self.meta['source'] = source
+        self.save_meta()
+
+    def path(self, column):
+        return self.store_dir / '{}.u1'.format(column)
+
+    def has_index(self):
+        return self.n_rows is not None and (self.store_dir / 'index.i8').exists()
+
+    def index(self):
+        """Memory-mapped BEH_IDs of the stored rows"""
+        return np.memmap(str(self.store_dir / 'index.i8'), dtype='int64', mode='r', shape=(self.n_rows,))
+
+    def column(self, column):
+        """Memory-mapped flags of a stored column"""
+        if column not in self.fingerprints:
+            raise KeyError('{} is not in the category store'.format(column))
+        return np.memmap(str(self.path(column)), dtype='uint8', mode='r', shape=(self.n_rows,))
+
+    def changed(self, fingerprints):
+        """Columns of fingerprints that are missing from the store or were computed from a different config entry"""
+        return [x for x, fingerprint in fingerprints.items() if self.fingerprints.get(x) != fingerprint]
+
+    def frame(self, columns, start=0, stop=None):
+        """DataFrame of stored columns for rows start:stop, indexed by BEH_ID"""
+        index = pd.Index(self.index()[start:stop], name='BEH_ID')
+        return pd.DataFrame({x: self.column(x)[start:stop] for x in columns}, index=index)
+
+    def writer(self, fingerprints, index=False):
+        """StoreWriter for the columns of fingerprints, also (re)writing the index if index is True"""
+        return StoreWriter(self, fingerprints, index)
+
+    def save_meta(self):
+        tmp_path = self.meta_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f, indent=1, sort_keys=True)
+        os.replace(str(tmp_path), str(self.meta_path))
+
+
+class StoreWriter:
+    """Appends chunks of columns to a CategoryStore, see CategoryStore.writer"""
+
+    def __init__(self, store, fingerprints, index=False):
+        self.store = store
+        self.fingerprints = dict(fingerprints)
+        self.n_rows = 0
+        self.files = {x: open(self.tmp_path(x), 'wb') for x in self.fingerprints}
+        self.index = open(self.tmp_path('index'), 'wb') if index else None
+
+    def tmp_path(self, column):
+        suffix = '.i8' if column == 'index' else '.u1'
+        return self.store.store_dir / '{}{}.tmp'.format(column, suffix)
+
+    def write(self, chunk):
+        """Append a DataFrame of 0/1 flags indexed by BEH_ID.  Without a new index it has to line up with the stored one"""
+        if self.index is not None:
+            self.index.write(chunk.index.to_numpy(dtype='int64').tobytes())
+        elif not np.array_equal(self.store.index()[self.n_rows:self.n_rows + len(chunk)], chunk.index):
+            raise ValueError('Rows differ from the ones in the category store, rebuild it in full')
+
+        for column, f in self.files.items():
+            f.write(chunk[column].to_numpy(dtype='uint8').tobytes())
+        self.n_rows += len(chunk)
+
+    def commit(self):
+        """Replace the stored columns with the written ones and record their fingerprints"""
+        for f in list(self.files.values()) + ([self.index] if self.index is not None else []):
+            f.close()
+        if self.index is None and self.n_rows != self.store.n_rows:
+            raise ValueError('Wrote {} rows to a category store of {}'.format(self.n_rows, self.store.n_rows))
+
+        if self.index is not None:
+            # New rows invalidate every stored column, not just the ones written here
+            self.store.meta = {'n_rows': None, 'fingerprints': {}}
+            self.store.save_meta()
+            os.replace(str(self.tmp_path('index')), str(self.store.store_dir / 'index.i8'))
+            self.store.meta['n_rows'] = self.n_rows
+        for column in self.files:
+            os.replace(str(self.tmp_path(column)), str(self.store.path(column)))
+        self.store.fingerprints.update(self.fingerprints)
+        self.store.save_meta()
+
+    def abort(self):
+        for f in list(self.files.values()) + ([self.index] if self.index is not None else []):
+            f.close()
+            os.remove(f.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
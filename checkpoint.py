@@ -0,0 +1,181 @@
+import json
+import os
+
+from columnar import ChunkWriter, is_parquet, read_chunks, read_line_chunks
+
+
+#####################################################################################################
+# Checkpoints for the chunk by chunk rewrites.  After every chunk is written a manifest next to the  #
+# output records how far each input was read (byte offsets) and how large each output was.  Resuming #
+# cuts the outputs back to those sizes and seeks the inputs to those offsets, so an interrupted run   #
+# carries on from its last committed chunk without reading anything before it again.                 #
+#####################################################################################################
+
+
+def fingerprint(filepath):
+    """Size and modification time of a file, enough to tell it was rewritten without reading it"""
+    stat = os.stat(filepath)
+    return [str(filepath), stat.st_size, stat.st_mtime_ns]
+
+
+def sync(filepath):
+    """Flush a written file to disk"""
+    with open(filepath, 'ab') as f:
+        os.fsync(f.fileno())
+
+
+def seek_key(filepath, key, column='DunsNumber', sep='\t', encoding='Windows-1252'):
+    """Byte offset of the first line whose column is greater than key, in a text file sorted on column
+
+    Found by bisecting on byte offsets, reading a few dozen lines whatever the size of the file.  Lines whose key can't
+    be read, such as ones with too few fields, are treated as coming before key.
+    """
+    with open(filepath, 'rb') as f:
+        position = f.readline().decode(encoding).rstrip('\r\n').split(sep).index(column)
+        lo = f.tell()
+        hi = os.fstat(f.fileno()).st_size
+
+        # Invariant: every line starting before lo has a key <= key, and the first line starting at or after hi
+        # has a key > key (or there is none)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            f.seek(mid - 1)
+            f.readline()
+            line_start = f.tell()
+            line = f.readline()
+            if line_start >= hi or not line:
+                hi = mid
+                continue
+            try:
+                line_key = int(line.decode(encoding).split(sep)[position].strip())
+            except (ValueError, IndexError):
+                line_key = key
+            if line_key <= key:
+                lo = line_start + len(line)
+            else:
+                hi = mid
+        return lo
+
+
+class Checkpoint:
+    """Manifest of the chunks of a rewrite that are done, kept at {write_path}.checkpoint.json while the run lasts
+
+    Each committed chunk records the byte offset reached in every input, the size of every output opened through
+    writer() and any extra state.  The manifest is replaced atomically once the outputs are flushed to disk, so it
+    never points past what was written, and deleted once the run finishes.  Checkpointing is opt-in: only CSV and text
+    files can be cut and sought, and reading them by byte offsets means splitting rows on line ends, so fields can't
+    hold quoted newlines.  With a Parquet input or output the run can't be checkpointed.
+    """
+
+    def __init__(self, write_path, inputs, params=None, resume=False, checkpointed=False):
+        """
+        Keyword Arguments:
+            write_path: The main output, the manifest is named after it
+            inputs: Files read, in the order of the offsets passed to commit()
+            params: Settings the outputs depend on, such as the columns read.  Resuming with different ones fails
+            resume: Carry on from the last committed chunk of an existing manifest, rather than starting over.  The
+                resumed run is checkpointed
+            checkpointed: Keep a manifest, so the run can be resumed if it's interrupted
+        """
+        self.path = '{}.checkpoint.json'.format(write_path)
+        self.inputs = [str(x) for x in inputs]
+        resumable = not any(is_parquet(x) for x in self.inputs + [str(write_path)])
+        self.enabled = resumable and (checkpointed or resume)
+        self.outputs = []
+        self.manifest = {'inputs': [fingerprint(x) for x in self.inputs],
+                         'params': json.loads(json.dumps(params or {}, sort_keys=True, default=str)),
+                         'chunks': []}
+
+        if (resume or checkpointed) and not resumable:
+            raise ValueError('Only CSV outputs of CSV or text inputs can be checkpointed')
+        if resume and os.path.exists(self.path):
+            self.load()
+            return
+        if resume:
+            print('No checkpoint at {}, starting from the beginning'.format(self.path))
+        # Replaces the manifest of any earlier run straight away, it would point into outputs about to be rewritten
+        if self.enabled:
+            self.save()
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+    def load(self):
+        with open(self.path, 'r') as f:
+            manifest = json.load(f)
+        if manifest['inputs'] != self.manifest['inputs']:
+            raise ValueError('Inputs changed since the checkpoint at {} was written, start over'.format(self.path))
+        if manifest['params'] != self.manifest['params']:
+            raise ValueError('Settings differ from the checkpoint at {}, start over'.format(self.path))
+
+        for output, size in self.sizes(manifest).items():
+            if (os.path.getsize(output) if os.path.exists(output) else 0) < size:
+                raise ValueError('{} is shorter than its checkpoint, start over'.format(output))
+        self.manifest = manifest
+
+    @staticmethod
+    def sizes(manifest):
+        return manifest['chunks'][-1]['sizes'] if manifest['chunks'] else {}
+
+    @property
+    def n_chunks(self):
+        """Chunks committed so far"""
+        return len(self.manifest['chunks'])
+
+    @property
+    def offsets(self):
+        """Offset to carry on reading each input from, None to read it from the beginning"""
+        if not self.manifest['chunks']:
+            return [None] * len(self.inputs)
+        return self.manifest['chunks'][-1]['offsets']
+
+    @property
+    def state(self):
+        """Extra state of the last committed chunk"""
+        return self.manifest['chunks'][-1]['state'] if self.manifest['chunks'] else {}
+
+    def writer(self, filepath, **kwargs):
+        """ChunkWriter for an output, cut back to its committed size when resuming"""
+        self.outputs.append(str(filepath))
+        return ChunkWriter(filepath, resume_size=self.sizes(self.manifest).get(str(filepath)), **kwargs)
+
+    def commit(self, offsets, **state):
+        """Record a chunk whose output is all written, offsets being where the next chunk starts in each input"""
+        if not self.enabled:
+            return
+
+        sizes = {}
+        for output in self.outputs:
+            if os.path.exists(output):
+                sync(output)
+                sizes[output] = os.path.getsize(output)
+        self.manifest['chunks'].append({'offsets': list(offsets), 'sizes': sizes, 'state': state})
+        self.save()
+
+    def finish(self):
+        """Delete the manifest of the finished rewrite.  Resuming it afterwards starts over"""
+        if self.enabled and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def chunks(self, filepath, columns=None, chunksize=10**6, **csv_kwargs):
+        """Chunks of the single input filepath, from the checkpoint on
+
+        Each chunk is committed when the next one is asked for, by which time the loop body has written it, and the
+        run is finished once the input is exhausted.  Without checkpointing this is read_chunks.
+        """
+        if not self.enabled:
+            for chunk in read_chunks(filepath, columns=columns, chunksize=chunksize, **csv_kwargs):
+                yield chunk
+            return
+
+        for chunk, offset in read_line_chunks(filepath, columns, chunksize, start=self.offsets[0], **csv_kwargs):
+            yield chunk
+            self.commit([offset])
+        self.finish()
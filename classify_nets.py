@@ -1,6 +1,18 @@
 import numpy as np
 import json
+import multiprocessing
+import os
 import pandas as pd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from category_store import CategoryStore, config_fingerprints, export_columns, load_columns, refresh_derived
+from checkpoint import fingerprint
+from columnar import RawTextReader, read_chunks
+from name_match import LiteralPrefilter, NameVocabulary, contains
+from spell_values import aggregate_spells, year_columns
+from stream_join import aligned_chunks, prefetch, sorted_chunks
 
 
 def chunks(l, n):
@@ -9,37 +21,117 @@ def chunks(l, n):
         yield l[i:i + n]
 
 
+def spell_years(firstyear, lastyear):
+    """Year of every row of the long panel, along with the number of years each spell covers
+
+    The years of all spells are one arange, shifted by each spell's FirstYear minus its position in the panel.
+    """
+    firstyear = np.asarray(firstyear, dtype='int64')
+    years_active = np.asarray(lastyear, dtype='int64') - firstyear + 1
+    offsets = np.cumsum(years_active) - years_active
+    year = np.arange(years_active.sum(), dtype='int64') + np.repeat(firstyear - offsets, years_active)
+
+    return year, years_active
+
+
 def normal_to_long(df_normal, long_cols):
     """ Transforms a normalized dataframe into a long one, subsets to "long_cols"
 
     Requires a DF with FirstYear, LastYear, and BEHID
     """
-    df_normal['YearsActive'] = df_normal['LastYear'] - df_normal['FirstYear'] + 1
-    firstyear = df_normal['FirstYear'].tolist()
-    lastyear = df_normal['LastYear'].tolist()
-    year_nested = [range(x, y+1) for x,y in zip(firstyear, lastyear)]
-    year = pd.Series([item for sublist in year_nested for item in sublist])
+    year, years_active = spell_years(df_normal['FirstYear'], df_normal['LastYear'])
+    positions = np.repeat(np.arange(len(df_normal)), years_active)
 
-    long_index = df_normal.index.repeat(df_normal.YearsActive.tolist())
-    long = df_normal[long_cols].reindex(long_index)
-    long_MultiIndex = pd.MultiIndex.from_arrays([long.index.values, year.values])
-    long.index = long_MultiIndex
+    long = df_normal[long_cols].iloc[positions]
+    long.index = pd.MultiIndex.from_arrays([df_normal.index.to_numpy()[positions], year])
 
     return long
 
-def make_BEHID_wide(df_loc):
-    """From the location file, creates a wide version of the BEH_LOC"""
-    long_BEHID = normal_to_long(df_loc, 'DunsNumber')
-    long_BEHID = long_BEHID.reset_index(level=0, drop=False) \
-        .set_index('DunsNumber', append=True) \
-        .swaplevel() \
-        .rename(columns={'level_0': 'BEH_ID'})
 
-    # correction for first/lastyear mistake in earlier iterations
-    long_BEHID = long_BEHID.loc[~long_BEHID.index.duplicated()]
+def iter_normal_to_long(df_normal, long_cols, batch_size=10**6):
+    """ Same as normal_to_long, but yields the long panel in pieces of about batch_size rows
+
+    Spells are never split, so a piece only goes over batch_size when a single spell is longer than it.
+    """
+    years_active = (df_normal['LastYear'] - df_normal['FirstYear'] + 1).to_numpy()
+    ends = np.cumsum(years_active)
+
+    start = 0
+    while start < len(df_normal):
+        done = ends[start - 1] if start else 0
+        stop = max(np.searchsorted(ends, done + batch_size, side='right'), start + 1)
+        yield normal_to_long(df_normal.iloc[start:stop], long_cols)
+        start = stop
+
+def behid_grid(df_loc, years=range(1990, 2015), filepath=None, batch_size=10**6):
+    """ From the location file, creates the DunsNumber x Year grid of BEH_IDs as an int64 array
+
+    Spells are scattered straight into a preallocated array, 0 where a business has no spell.  Where spells overlap
+    the first in df_loc wins, as a correction for first/lastyear mistakes in earlier iterations.  With filepath the
+    grid is a memory-mapped .npy file, with the DunsNumber of each row saved next to it (see open_behid_grid).
+
+    Keyword Arguments:
+        df_loc: DataFrame with BEH_ID, DunsNumber, FirstYear and LastYear as index or columns
+        years: Consecutive years making up the columns of the grid
+        filepath: Optional .npy file to build the grid in
+        batch_size: Spells scattered at a time
+
+    Returns:
+        (duns, grid): Sorted DunsNumbers, and the grid with one row per DunsNumber
+    """
+    df_loc = df_loc.reset_index()
+    duns = np.unique(df_loc['DunsNumber'].to_numpy(dtype='int64'))
+    shape = (len(duns), len(years))
+    if filepath is None:
+        grid = np.zeros(shape, dtype='int64')
+    else:
+        np.save(duns_path(filepath), duns)
+        # A new memory-mapped file starts out zeroed
+        grid = np.lib.format.open_memmap(str(filepath), mode='w+', dtype='int64', shape=shape)
+
+    for start in range(0, len(df_loc), batch_size):
+        spells = df_loc.iloc[start:start + batch_size]
+        year, years_active = spell_years(spells['FirstYear'], spells['LastYear'])
+        row = np.repeat(np.searchsorted(duns, spells['DunsNumber'].to_numpy(dtype='int64')), years_active)
+        behid = np.repeat(spells['BEH_ID'].to_numpy(dtype='int64'), years_active)
+
+        in_years = (year >= years[0]) & (year <= years[-1])
+        cell = row[in_years] * len(years) + year[in_years] - years[0]
+        # First spell per cell within the batch, then only fill cells earlier batches left empty
+        cell, first = np.unique(cell, return_index=True)
+        flat = grid.reshape(-1)
+        flat[cell] = np.where(flat[cell] == 0, behid[in_years][first], flat[cell])
+
+    if filepath is not None:
+        grid.flush()
+    return duns, grid
+
+
+def duns_path(filepath):
+    """File holding the DunsNumber of each row of the grid at filepath"""
+    filepath = Path(filepath)
+    return filepath.with_name(filepath.stem + '_duns.npy')
+
+
+def open_behid_grid(filepath, mode='r'):
+    """Open a grid written by behid_grid without reading it into memory
+
+    Returns:
+        (duns, grid): grid is memory-mapped, slice rows with np.searchsorted(duns, ...)
+    """
+    return np.load(duns_path(filepath)), np.load(str(filepath), mmap_mode=mode)
 
-    wide_BEHID = long_BEHID.unstack()
 
+def make_BEHID_wide(df_loc):
+    """From the location file, creates a wide version of the BEH_LOC"""
+    duns, grid = behid_grid(df_loc)
+    wide_BEHID = pd.DataFrame(grid, index=pd.Index(duns, name='DunsNumber'),
+                              columns=pd.MultiIndex.from_product([['BEH_ID'], range(1990, 2015)]))
+
+    # Only the years some spell covers, missing as NaN.  Years without gaps stay int64, as they did from unstack
+    wide_BEHID = wide_BEHID.loc[:, (grid != 0).any(axis=0)]
+    for col in wide_BEHID.columns[(wide_BEHID == 0).any()]:
+        wide_BEHID[col] = wide_BEHID[col].where(wide_BEHID[col] != 0)
     return wide_BEHID
 
 class Classifier:
@@ -118,8 +210,8 @@ class Classifier:
 
             if name_only:
                 return (
-                self.df['TradeName'].str.contains('|'.join(local_config['name'])) | self.df['Company'].str.contains(
-                    '|'.join(local_config['name'])))
+                contains(self.df['TradeName'], '|'.join(local_config['name'])) |
+                contains(self.df['Company'], '|'.join(local_config['name'])))
 
             else:
                 match = pd.Series([False for x in range(len(self.df))], index=self.df.index)
@@ -129,11 +221,11 @@ class Classifier:
                 sic_exclusive = sic_exclusive_bool()
 
                 tradename = self.df[sic_range_2_bool() & ~self.df['TradeName'].isnull()]
-                tradename_bool = tradename['TradeName'].str.contains('|'.join(local_config['name']))
+                tradename_bool = contains(tradename['TradeName'], '|'.join(local_config['name']))
                 match = tradename_bool.combine_first(match)
 
                 company = self.df[(sic_range_bool() | sic_exclusive_bool()) & self.df['TradeName'].isnull()]
-                company_bool = company['Company'].str.contains('|'.join(local_config['name']))
+                company_bool = contains(company['Company'], '|'.join(local_config['name']))
                 match = company_bool.combine_first(match)
 
                 return match
@@ -211,92 +303,425 @@ class Classifier:
             final.loc[sic_exclusive_bool() & emp_bool()] = 1
             return final
 
-if __name__ == "__main__":
-    import os
-    from pathlib import Path
-    from tkinter import filedialog, Tk
 
-    root = Tk()
-    root.withdraw()
-    data_dir = Path(filedialog.askdirectory(initial=os.getcwd(),
-                                            title='Select the root data folder'))
+def rule_mask(values, rule, kind):
+    """Evaluate an emp/sales rule string from the JSON config against a numeric array
 
-    sic = data_dir / 'raw' / 'NETS2014_SIC.txt'
-    sic_cols = ['DunsNumber'] + ['SIC' + str(x)[-2:] for x in range(1990, 2015)]
+    Mirrors emp_bool/sales_bool in Classifier.is_class_all exactly, including how comma separated ranges are expanded.
+    -----------
+    Keyword Arguments:
+    values: numpy array of Emp or Sales values
+    rule: The rule string, such as 'g25', 'l2000000' or '5,25'
+    kind: Either 'emp' or 'sales'
+    """
+    if rule[0] == 'g':
+        return values > int(rule[1:]) if kind == 'emp' else values >= int(rule[1:])
+    elif rule[0] == 'l':
+        return values < int(rule[1:])
+    elif kind == 'emp':
+        emp_range = list(range(*[int(x) for x in rule.split(',')]))
+        emp_range[1] += 1
+        return np.isin(values, emp_range)
+    else:
+        return np.isin(values, list(range(*[int(x) for x in rule.split(',')])))
+
+
+class SicIndex:
+    """Lookup structure answering every SIC range and exclusive list in the config at once
+
+    Every range bound and exclusive code is turned into a breakpoint, which splits the SIC line into segments that no
+    predicate can tell apart.  A table then records which predicates hold on each segment, so a chunk only needs one
+    searchsorted over BEH_SIC, after which each predicate is a single gather instead of two comparisons per range.
+    SIC codes are assumed to be integers, as they are throughout NETS.
+    """
 
-    emp = data_dir / 'raw' / 'NETS2014_Emp.txt'
-    emp_cols = ['DunsNumber'] + ['Emp' + str(x)[-2:] for x in range(1990, 2015)]
+    def __init__(self, predicates):
+        """
+        Keyword Arguments:
+        predicates: Iterable of keys such as ('sic_range', ((lo, hi), ...)) or ('sic_in', (code, ...))
+        """
+        predicates = list(dict.fromkeys(predicates))
+        self.columns = {key: j for j, key in enumerate(predicates)}
 
-    sales = data_dir / 'raw' / 'NETS2014_Sales.txt'
-    sales_cols = ['DunsNumber'] + ['Sales' + str(x)[-2:] for x in range(1990, 2015)]
+        intervals = [self.to_intervals(kind, values) for kind, values in predicates]
+        bounds = {bound for pairs in intervals for lo, hi in pairs for bound in (lo, hi + 1)}
+        self.edges = np.array(sorted(bounds), dtype='int64')
 
-    company = data_dir / 'raw' / 'NETS2014_Company.txt'
-    company_cols = ['DunsNumber', 'Company', 'TradeName']
+        # The extra last row is all False: values below the first edge land on segment -1, which indexes it
+        self.table = np.zeros((len(self.edges) + 1, len(predicates)), dtype=bool)
+        for j, pairs in enumerate(intervals):
+            for lo, hi in pairs:
+                self.table[np.searchsorted(self.edges, lo):np.searchsorted(self.edges, hi + 1), j] = True
 
-    # this will be changed eventually
-    loc = data_dir / 'interim' / 'NETS2014_Locations.txt'
-    loc_cols = ['BEH_ID', 'DunsNumber', 'FirstYear', 'LastYear']
-
-    behid_wide = data_dir / 'interim' / 'NETS2014_BEHID_wide.csv'
-
-
-    # cols = ['BEH_ID', 'Company', 'TradeName', 'BEH_SIC', 'Sales', 'Emp']
-    # dtypes = {'BEH_ID': 'int64', 'Company': 'object', 'TradeName': 'object', 'BEH_SIC': 'int64', 'Sales': 'float64',
-    #           'Emp': 'float64'}
-
-    # prolly wanna specify dtypes later
-    df_sic = pd.read_table(sic, usecols=sic_cols, index_col='BEH_ID', chunksize=10**3)
-    df_emp = pd.read_table(emp, usecols=emp_cols, index_col='BEH_ID', chunksize=10**3)
-    df_sales = pd.read_table(sales, usecols=sales_cols, index_col='BEH_ID', chunksize=10**3)
-    df_company = pd.read_table(company, usecols=company_cols, index_col='BEH_ID', chunksize=10**3)
-
-    # read loc_wide if it exists, create it if not
-    try:
-        df_behid_wide = pd.read_csv(behid_wide, index_col='BEH_ID', chunksize=10**6)
-        print('Found wide BEHID file')
-
-    except FileNotFoundError:
-        print('Reading Location File')
-        df_loc = pd.read_csv(loc, usecols=loc_cols, index_col=['DunsNumber', 'FirstYear'], sep=',')
-        print('Creating index generator')
-        duns_chunks = chunks(df_loc.index.unique(level='DunsNumber').tolist(), 10**6)
-        # duns_chunks = chunks(sorted(list(set(df_loc.index.get_level_values(0)))), 10**6)
-        print('Writing wide BEHID file')
-        first = True
-        for duns_chunk in duns_chunks:
-            loc_chunk = df_loc.reindex(duns_chunk, level=0) \
-                .reset_index(drop=False) \
-                .set_index('BEH_ID')
-
-            chunk_behid_wide = make_BEHID_wide(loc_chunk)
-            if first:
-                chunk_behid_wide.to_csv(behid_wide)
-                first = False
+    @staticmethod
+    def to_intervals(kind, values):
+        """Express a predicate as inclusive (lo, hi) intervals"""
+        if kind == 'sic_range':
+            return values
+        return [(code, code) for code in values]
+
+    def segments(self, sic):
+        """Segment number of every SIC value; NaN sorts past the last edge, where no predicate holds"""
+        return np.searchsorted(self.edges, sic, side='right') - 1
+
+    def mask(self, key, segments):
+        """Boolean mask of the rows whose segment satisfies the predicate key"""
+        return self.table[segments, self.columns[key]]
+
+
+class ChunkPredicates:
+    """Per-chunk memo of every predicate used by a CompiledClassifier
+
+    Each predicate is keyed by its definition rather than by the category using it, so a SIC range list, exclusive list
+    or emp/sales rule shared by several categories is only evaluated once per chunk.
+    """
+
+    def __init__(self, df, sic_index):
+        self.index = df.index
+        self.sic_index = sic_index
+        self.sic_segments = sic_index.segments(df['BEH_SIC'].to_numpy())
+        self.emp = df['Emp'].to_numpy(dtype='float64') if 'Emp' in df else None
+        self.sales = df['Sales'].to_numpy(dtype='float64') if 'Sales' in df else None
+        # Same blank TradeName handling as Classifier.__init__, without mutating the caller's frame
+        tradename = df['TradeName'].mask(df['TradeName'].str.strip() == "")
+        self.tradename_null = tradename.isnull().to_numpy()
+        self.names = {'TradeName': tradename, 'Company': df['Company']}
+        self.memo = {}
+
+    def _cached(self, key, func):
+        if key not in self.memo:
+            self.memo[key] = func()
+        return self.memo[key]
+
+    def sic_in(self, codes):
+        key = ('sic_in', codes)
+        return self._cached(key, lambda: self.sic_index.mask(key, self.sic_segments))
+
+    def sic_range(self, ranges):
+        key = ('sic_range', ranges)
+        return self._cached(key, lambda: self.sic_index.mask(key, self.sic_segments))
+
+    def emp_rule(self, rule):
+        return self._cached(('emp', rule), lambda: rule_mask(self.emp, rule, 'emp'))
+
+    def sales_rule(self, rule):
+        return self._cached(('sales', rule), lambda: rule_mask(self.sales, rule, 'sales'))
+
+    def sales_null(self):
+        return self._cached(('sales_null',), lambda: np.isnan(self.sales))
+
+    def vocabulary(self, column):
+        """Distinct values of the TradeName or Company column, factorized once per chunk"""
+        return self._cached(('vocabulary', column), lambda: NameVocabulary(self.names[column]))
+
+    def name(self, column, pattern, where, prefilter=None):
+        """Return where & (column matches pattern), running the regex once per distinct string selected by where"""
+        if not where.any():
+            return np.zeros(len(where), dtype=bool)
+        return self.vocabulary(column).match(pattern, where, prefilter)
+
+
+class CategoryPlan:
+    """Compiled form of a single config entry: frozen predicate definitions plus its conditional code"""
+
+    def __init__(self, name, local_config):
+        self.name = name
+        self.condit_code = local_config['conditional']
+        self.sic_exclusive = tuple(local_config.get('sic_exclusive', ()))
+        self.sic_exclusive_2 = tuple(local_config.get('sic_exclusive_2', ()))
+        self.sic_range = tuple(local_config.get('sic_range', ()))
+        self.sic_range_2 = tuple(local_config.get('sic_range_2', ()))
+        self.emp = local_config.get('emp')
+        self.sales = local_config.get('sales')
+        self.pattern = '|'.join(local_config.get('name', []))
+        self.prefilter = LiteralPrefilter(local_config['name']) if 'name' in local_config else None
+
+    def sic_keys(self):
+        """Keys of all the SIC predicates this category can ask for"""
+        return [('sic_in', self.sic_exclusive), ('sic_in', self.sic_exclusive_2),
+                ('sic_range', self.sic_range), ('sic_range', self.sic_range_2)]
+
+    def evaluate(self, preds):
+        """Evaluate this category against a ChunkPredicates, following the codes in Classifier.is_class_all"""
+        code = self.condit_code
+
+        def name_only(where):
+            return preds.name('TradeName', self.pattern, where, self.prefilter) | \
+                preds.name('Company', self.pattern, where, self.prefilter)
+
+        if code == 2:
+            exclusive = preds.sic_in(self.sic_exclusive)
+            return exclusive | name_only(preds.sic_range(self.sic_range) & ~exclusive)
+        elif code == 3:
+            return preds.sic_range(self.sic_range)
+        elif code == 4:
+            return preds.sic_in(self.sic_exclusive) | preds.sic_range(self.sic_range)
+        elif code == 5:
+            return preds.sic_range(self.sic_range) & preds.emp_rule(self.emp)
+        elif code == 6:
+            return preds.sic_range(self.sic_range) & (preds.sales_rule(self.sales) | preds.emp_rule(self.emp))
+        elif code == 7:
+            in_range = preds.sic_range(self.sic_range)
+            return in_range | name_only(preds.sic_range(self.sic_range_2) & ~in_range)
+        elif code == 8:
+            return preds.sic_in(self.sic_exclusive)
+        elif code == 9:
+            exclusive = preds.sic_in(self.sic_exclusive)
+            return exclusive | name_only(~exclusive)
+        elif code == 10:
+            return preds.sic_range(self.sic_range) & preds.emp_rule(self.emp) & \
+                (preds.sales_rule(self.sales) | preds.sales_null())
+        elif code == 11:
+            exclusive = preds.sic_in(self.sic_exclusive)
+            candidates = (preds.sic_range(self.sic_range) | preds.sic_in(self.sic_exclusive_2)) & ~exclusive
+            return exclusive | name_only(candidates)
+        elif code == 12:
+            tradename = preds.sic_range(self.sic_range_2) & ~preds.tradename_null
+            company = (preds.sic_range(self.sic_range) | preds.sic_in(self.sic_exclusive)) & preds.tradename_null
+            return preds.name('TradeName', self.pattern, tradename, self.prefilter) | \
+                preds.name('Company', self.pattern, company, self.prefilter)
+        elif code == 13:
+            return preds.sic_in(self.sic_exclusive) & preds.emp_rule(self.emp)
+        else:
+            return np.zeros(len(preds.index), dtype=bool)
+
+
+class CompiledClassifier:
+    """
+    Classifies chunks against every category in json_config in a single pass.  The config is read and compiled once;
+    classify() then evaluates each distinct predicate once per chunk and returns the full category matrix, matching
+    what Classifier.is_class_all produces category by category.
+    """
+
+    def __init__(self, config_file, categories=None):
+        """Read and compile the JSON config file.  categories is an optional subset of the config's categories to
+        classify"""
+        self.config_file = config_file
+        with open(config_file) as f:
+            self.all_config = json.load(f)
+
+        self.cat_names = [x for x in self.all_config if categories is None or x in categories]
+        self.plans = [CategoryPlan(name, self.make_range(self.all_config[name])) for name in self.cat_names]
+        self.sic_index = SicIndex(key for plan in self.plans for key in plan.sic_keys())
+
+    @staticmethod
+    def make_range(local_config):
+        """Same conversion as Classifier.make_range, for a single config entry"""
+        local_config = dict(local_config)
+        for key in ['sic_range', 'sic_range_2']:
+            if key in local_config:
+                local_config[key] = tuple(zip(local_config[key][0::2], local_config[key][1::2]))
+        return local_config
+
+    def classify(self, df):
+        """Return a DataFrame of 0/1 flags with one column per category, indexed like df"""
+        preds = ChunkPredicates(df, self.sic_index)
+        matrix = np.zeros((len(df), len(self.plans)), dtype='int64')
+        for j, plan in enumerate(self.plans):
+            matrix[:, j] = plan.evaluate(preds)
+
+        return pd.DataFrame(matrix, index=df.index, columns=self.cat_names)
+
+# Each pool worker compiles the config once, in _init_worker, instead of receiving it with every chunk
+_worker_classifier = None
+
+
+def _init_worker(config_file):
+    global _worker_classifier
+    _worker_classifier = CompiledClassifier(config_file)
+
+
+def _classify_to_csv(chunk, header):
+    """Classify a chunk in a worker and format it there too, so the writer only has to write text"""
+    return _worker_classifier.classify(chunk).to_csv(header=header)
+
+
+def classify_chunks(chunks, config_file, write_path, workers=1, max_pending=None):
+    """Classify an iterable of DataFrame chunks and write the category matrix to write_path, in input order
+
+    With workers > 1 chunks are handed to a process pool and at most max_pending of them (default 2 * workers) are in
+    flight at once.  Serial and parallel runs format every chunk through the same to_csv call, so the output is
+    byte-identical either way.
+    -----------
+    Keyword Arguments:
+    chunks: Iterable of DataFrames ready for classification, such as a read_csv(..., chunksize=n) reader
+    config_file: Full file path to the JSON config file
+    write_path: Path of the CSV to write
+    workers: Number of processes to classify with
+    max_pending: Bound on submitted but unwritten chunks
+    """
+    global _worker_classifier
+    max_pending = max_pending or 2 * workers
+
+    with open(write_path, 'w', newline='') as f:
+        if workers == 1:
+            _init_worker(config_file)
+            for i, chunk in enumerate(chunks):
+                f.write(_classify_to_csv(chunk, i == 0))
                 print('.')
-            else:
-                chunk_behid_wide.to_csv(behid_wide, mode='a', header=False)
+            _worker_classifier = None
+            return
+
+        # By now the prefetch threads and pyarrow's thread pool are running, and forking them can leave a worker
+        # holding a lock no thread will release.  Workers start from a clean process instead
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(method), initializer=_init_worker,
+                                 initargs=(config_file,)) as pool:
+            pending = deque()
+            for i, chunk in enumerate(chunks):
+                pending.append(pool.submit(_classify_to_csv, chunk, i == 0))
+                if len(pending) >= max_pending:
+                    f.write(pending.popleft().result())
+                    print('.')
+            while pending:
+                f.write(pending.popleft().result())
                 print('.')
 
-        #now re-read it in chunks
-        df_behid_wide = pd.read_csv(behid_wide, index_col='BEH_ID', chunksize=10**6)
+def classifier_inputs(sic_path, emp_path, sales_path, company_path, loc_path, chunksize=10**6, sep='\t',
+                      years=range(1990, 2015), assume_sorted=None):
+    """Stream the raw SIC, Emp, Sales and Company files joined with the location spells, one frame per batch
+
+    All five files are read on their own prefetch threads in chunks of chunksize rows and aligned on DunsNumber as
+    they stream (see stream_join), sorting any that aren't sorted by DunsNumber on disk first.  Whether they are is
+    found on each file's prefetch thread, or taken from assume_sorted or the markers of earlier runs.  Yearly values
+    are reduced over each spell with spell_values.aggregate_spells.
+    -----------
+    Keyword Arguments:
+    sic_path, emp_path, sales_path, company_path: Raw NETS files, delimited by sep
+    loc_path: Normalized location file (CSV or Parquet) with BEH_ID, DunsNumber, FirstYear and LastYear
+    chunksize: Rows read from each file at a time
+    sep: Delimiter of the raw files
+    years: Years of the yearly columns
+    assume_sorted: True if all five files are known to be sorted by DunsNumber, see stream_join.sorted_chunks
+
+    Yields:
+        DataFrames indexed by BEH_ID with Company, TradeName, BEH_SIC, Emp and Sales, ready for Classifier
+    """
+    raw_files = [(sic_path, year_columns('SIC', years)), (emp_path, year_columns('Emp', years)),
+                 (sales_path, year_columns('Sales', years)), (company_path, ['Company', 'TradeName'])]
+    tmp_dir = os.path.dirname(os.path.abspath(str(loc_path)))
+
+    streams = []
+    for path, cols in raw_files:
+        reader = RawTextReader(path, ['DunsNumber'] + cols, sep=sep, chunksize=chunksize, index_col='DunsNumber')
+        keys = RawTextReader(path, ['DunsNumber'], sep=sep, chunksize=chunksize, index_col='DunsNumber')
+        streams.append(prefetch(sorted_chunks(reader, keys, tmp_dir, path, assume_sorted)))
+
+    def read_spells(columns):
+        for chunk in read_chunks(loc_path, columns=columns, chunksize=chunksize):
+            yield chunk.set_index('DunsNumber')
+
+    spells = sorted_chunks(read_spells(['BEH_ID', 'DunsNumber', 'FirstYear', 'LastYear']),
+                           read_spells(['DunsNumber']), tmp_dir, loc_path, assume_sorted)
+    streams.insert(0, prefetch(spells))
+
+    for spell_chunk, sic, emp, sales, company in aligned_chunks(*streams):
+        if len(spell_chunk) == 0:
+            continue
+        spell_chunk = spell_chunk.reset_index().set_index('BEH_ID')
+        duns = spell_chunk['DunsNumber']
+
+        values = aggregate_spells(spell_chunk, pd.concat([sic, emp, sales], axis=1), years=np.asarray(years))
+        names = company.reindex(columns=['Company', 'TradeName']).reindex(duns)
+        names.index = spell_chunk.index
+        yield pd.concat([names, values], axis=1)
+
+
+def merged_aux_chunks(filepath, codes, chunksize=10**6):
+    """Aux category flags of a merged file (recvd_net_vars), as DataFrames indexed by BEH_ID with code column names"""
+    names = {'adr_net_{}_c_2014'.format(x.lower()): x for x in codes}
+    for chunk in read_chunks(filepath, columns=['adr_net_behid_u_2014'] + list(names), chunksize=chunksize):
+        yield chunk.set_index('adr_net_behid_u_2014').rename(columns=names)
+
+
+def update_categories(chunks, config_file, store_dir, main_cats=None, hier_list=None, full=False, merged_path=None,
+                      write_path=None, source=None):
+    """Classify into a CategoryStore, recomputing only the categories whose config entry changed since the last run
+
+    Each category's entry is fingerprinted (category_store.category_fingerprint), so editing one category's SIC codes
+    or names only reruns that category.  With main_cats and hier_list the derived main and hierarchy columns that
+    depend on a changed category are recomputed too.  Those also depend on aux categories that aren't in the config,
+    such as the TDLINX ones, which are loaded from merged_path.  The config's categories are then exported to
+    write_path, the same file classify_chunks writes.
+    -----------
+    Keyword Arguments:
+    chunks: Iterable of DataFrames ready for classification, the same rows in the same order as when the store was built
+    config_file: Full file path to the JSON config file
+    store_dir: Folder of the CategoryStore, created if it doesn't exist
+    main_cats: Optional main category config, {main code: [aux codes]}
+    hier_list: Optional aux codes in hierarchy priority order
+    full: Reclassify every category and rewrite the stored rows, needed when the input rows change
+    merged_path: Optional merged file (recvd_net_vars) holding the aux categories of main_cats and hier_list that
+        aren't in the config
+    write_path: Optional CSV or Parquet file to export the config's categories to
+    source: Optional fingerprint of the input files, such as checkpoint.fingerprint of each.  The store is rebuilt in
+        full when it differs from the one it was built from
+
+    Returns:
+        List of the recomputed columns
+    """
+    with open(config_file) as f:
+        fingerprints = config_fingerprints(json.load(f))
+
+    store = CategoryStore(store_dir)
+    full = full or not store.has_index() or (source is not None and store.source != source)
+    changed = list(fingerprints) if full else store.changed(fingerprints)
+
+    if changed:
+        classifier = CompiledClassifier(config_file, categories=changed)
+        with store.writer({x: fingerprints[x] for x in changed}, index=full) as writer:
+            for chunk in chunks:
+                writer.write(classifier.classify(chunk))
+                print('.')
+        if full and source is not None:
+            store.set_source(source)
 
-    first = True  # switch to numbered chunks later
-    for chunk in zip(df_sic):
-        classy = Classifier(r"C:\Users\jc4673\Documents\NETS\config\json_config_2018_08_03.json", chunk)
+    if main_cats is not None and hier_list is not None:
+        aux_codes = set(hier_list) | set(x for subs in main_cats.values() for x in subs)
+        external = sorted(aux_codes - set(fingerprints))
+        if external and merged_path is not None:
+            load_columns(store, merged_aux_chunks(merged_path, external), external)
+        changed += refresh_derived(store, main_cats, hier_list)
 
-        cat_names = [x for x in classy.all_config]
-        df_final = pd.DataFrame(0, index=chunk.index, columns=cat_names)
+    if write_path is not None:
+        export_columns(store, write_path, list(fingerprints))
+    return changed
 
-        for name in cat_names:
-            df_final[name] = classy.is_class_all(name)
 
-        if first:
-            df_final.to_csv(r"C:\Users\jc4673\Documents\Data\NETS2014_Categories_FINAL_fix.csv")
-        else:
-            with open(r"C:\Users\jc4673\Documents\Data\NETS2014_Categories_FINAL_fix.csv", 'a') as f:
-                df_final.to_csv(f, header=False)
+if __name__ == "__main__":
+    import argparse
+    from tkinter import filedialog, Tk
 
+    parser = argparse.ArgumentParser(description='Classify NETS businesses into categories')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of classification processes')
+    parser.add_argument('--chunksize', type=int, default=10**6, help='Rows read from each input file at a time')
+    parser.add_argument('--sorted', action='store_true', help='Input files are sorted by DunsNumber, skip checking')
+    parser.add_argument('--store', default=None,
+                        help='CategoryStore folder, only the categories whose config entry changed are reclassified')
+    args = parser.parse_args()
 
+    root = Tk()
+    root.withdraw()
+    data_dir = Path(filedialog.askdirectory(initial=os.getcwd(),
+                                            title='Select the root data folder'))
 
+    sic = data_dir / 'raw' / 'NETS2014_SIC.txt'
+    emp = data_dir / 'raw' / 'NETS2014_Emp.txt'
+    sales = data_dir / 'raw' / 'NETS2014_Sales.txt'
+    company = data_dir / 'raw' / 'NETS2014_Company.txt'
 
+    # this will be changed eventually
+    loc = data_dir / 'interim' / 'NETS2014_Locations.txt'
 
+    # Company, TradeName, BEH_SIC, Emp and Sales per BEH_ID, all four raw files and the spells read together.  The
+    # spells come straight from the location file, no BEH_ID grid is needed
+    df_inputs = classifier_inputs(sic, emp, sales, company, loc, chunksize=args.chunksize,
+                                  assume_sorted=args.sorted or None)
+
+    config_file = r"C:\Users\jc4673\Documents\NETS\config\json_config_2018_08_03.json"
+    write_path = r"C:\Users\jc4673\Documents\Data\NETS2014_Categories_FINAL_fix.csv"
+    if args.store is not None:
+        update_categories(df_inputs, config_file, args.store, write_path=write_path,
+                          source=[fingerprint(x) for x in (sic, emp, sales, company, loc)])
+    else:
+        classify_chunks(df_inputs, config_file, write_path, workers=args.workers)
@@ -1,57 +1,213 @@
+import os
 import time
 import pandas as pd
 import numpy as np
 import re
 
+from behid_index import encode_behid
+from checkpoint import Checkpoint, seek_key
+from columnar import ChunkWriter, RawTextReader
+from schema import apply_schema
+from stream_join import aligned_chunks, prefetch, sorted_chunks
+
+
+class ErrorReport:
+
+    """Collects the problems Checker finds across all chunks into files next to the output, instead of stopping at
+    the first one.
+
+    {prefix}_errors.csv has one row per problem (check, DunsNumber, BEH_ID, detail).  The normalized and long rows of
+    businesses failing the year sums go to {prefix}_bad_normal.csv and {prefix}_bad_long.csv as before.
+    """
+
+    def __init__(self, write_path, checkpoint=None):
+        """
+        :param write_path: path of the file being checked, the report files are named after it
+        :param checkpoint: optional Checkpoint of the run, which the report files are then part of
+        """
+        errors, bad_normal, bad_long = self.paths(write_path)
+        open_writer = checkpoint.writer if checkpoint is not None else ChunkWriter
+        self.errors = open_writer(errors)
+        self.bad_normal = open_writer(bad_normal, index=True)
+        self.bad_long = open_writer(bad_long, index=True)
+        self.count = checkpoint.state.get('problems', 0) if checkpoint is not None else 0
+
+    @staticmethod
+    def paths(write_path):
+        """The errors, bad normal rows and bad long rows files of the report on write_path.  Each is only written once
+        there is something to put in it"""
+        prefix = os.path.splitext(str(write_path))[0]
+        return ['{}_{}.csv'.format(prefix, x) for x in ('errors', 'bad_normal', 'bad_long')]
+
+    def add(self, check, duns, beh_id, detail):
+        """Record one problem per element of the arrays duns, beh_id and detail"""
+        if len(duns):
+            self.errors.write(pd.DataFrame({'check': check, 'DunsNumber': duns, 'BEH_ID': beh_id, 'detail': detail}))
+            self.count += len(duns)
+
+    def close(self):
+        for writer in (self.errors, self.bad_normal, self.bad_long):
+            writer.close()
+
 
 class Checker:
 
     """Class to provide checks to Data Frames at various stages of wrangling.
 
+    Checks are reductions over the whole chunk.  With mode='sample' only a fixed fraction of businesses, chosen by a
+    hash of their DunsNumber so every run checks the same ones, is checked, and mode='off' skips checking.  Problems
+    are recorded in an ErrorReport if one is given, otherwise the first one raises a ValueError, after writing the
+    rows failing the year sums next to error_path as before.
     """
 
-    def __init__(self, df_normal, df_long, error_folder):
+    modes = ('full', 'sample', 'off')
+
+    def __init__(self, df_normal, df_long, report=None, mode='full', fraction=0.1, error_path=None):
+        """
+        :param df_normal: normalized chunk, indexed by BEH_ID with DunsNumber, FirstYear and LastYear columns
+        :param df_long: the same chunk in long format, indexed by (DunsNumber, Year)
+        :param report: optional ErrorReport to record problems in
+        :param mode: 'full', 'sample' or 'off'
+        :param fraction: fraction of businesses checked when mode is 'sample'
+        :param error_path: path of the file being checked, used when there is no report to name the
+            {prefix}_bad_normal.csv and {prefix}_bad_long.csv files
+        """
+        if mode not in self.modes:
+            raise ValueError('Check mode must be one of {}'.format(', '.join(self.modes)))
+
         self.df_normal = df_normal
         self.df_long = df_long
-        self.error_folder = error_folder
+        self.report = report
+        self.error_path = error_path
+        self.mode = mode
+        if mode == 'sample':
+            sampled = self.sample(df_normal['DunsNumber'].to_numpy(), fraction)
+            self.df_normal = df_normal[sampled]
+
+    @staticmethod
+    def sample(duns, fraction):
+        """Boolean array selecting a fraction of duns, the same businesses whatever chunk they're in"""
+        return pd.util.hash_array(np.asarray(duns, dtype='int64')) % 10**6 < fraction * 10**6
+
+    def fail(self, check, rows, detail, message):
+        """Record the normalized rows that failed check, or raise message if there is no report"""
+        if self.report is None:
+            raise ValueError(message)
+        self.report.add(check, rows['DunsNumber'].to_numpy(), rows.index.to_numpy(), detail)
+
     def check_index(self):
         """Check that index is unique."""
-        if not self.df_normal.index.is_unique:
-            raise ValueError('Created BEH_ID index is not unique')
+        duplicated = self.df_normal.index.duplicated(keep=False)
+        if duplicated.any():
+            self.fail('index', self.df_normal[duplicated], 'duplicate BEH_ID', 'Created BEH_ID index is not unique')
 
     def check_first_last(self):
         """Check that FirstYear <= LastYear for all records"""
         year_mismatch = self.df_normal[self.df_normal.FirstYear > self.df_normal.LastYear]
         if not year_mismatch.empty:
-            raise ValueError('The following BEH_ID(s) contain FirstYear > LastYear:\n {}'.format(
-                '\n'.join([str(x) for x in year_mismatch.index.values])))
+            self.fail('first_last', year_mismatch, 'FirstYear > LastYear',
+                      '{} BEH_ID(s) contain FirstYear > LastYear, the first is {}'.format(
+                          len(year_mismatch), year_mismatch.index[0]))
 
     def check_sums(self):
         """Check that the sum of all years for a DunsNumber = the First FirstYear - the final LastYear"""
-        # DunsNumber in the index makes this check much easier
-        self.df_normal.set_index('DunsNumber', append=True, inplace=True)
+        years = self.df_normal[['FirstYear', 'LastYear']]
+        by_duns = years.assign(Years=years.LastYear - years.FirstYear + 1).groupby(self.df_normal['DunsNumber'],
+                                                                                    sort=False)
 
         # Sum of Year intervals = FirstYear - LastYear
-        years_active_first_last = self.df_normal.LastYear.groupby(level=1).apply(lambda x: x.iloc[-1]) - \
-            self.df_normal.FirstYear.groupby(level=1).apply(lambda x: x.iloc[0]) + 1
-        beh_id_year_diff = (self.df_normal.LastYear - self.df_normal.FirstYear + 1).groupby(level=1).sum()
-
-        # Reset index as it was before
-        self.df_normal.reset_index(level=1, drop=False, inplace=True)
-
-        if not years_active_first_last.equals(beh_id_year_diff):
-            bad_duns = beh_id_year_diff[beh_id_year_diff != years_active_first_last].index.values
-            self.df_normal[self.df_normal['DunsNumber'].isin(bad_duns)].to_csv(r'{}_bad_normal.csv'.format(self.error_folder[:-4]))
-            self.df_long.reindex(bad_duns, level=0).to_csv(r'{}_bad_long.csv'.format(self.error_folder[:-4]))
-            raise ValueError("Some FirstYears are greater than LastYears")
+        years_active_first_last = by_duns.LastYear.last() - by_duns.FirstYear.first() + 1
+        beh_id_year_diff = by_duns.Years.sum()
+
+        bad = beh_id_year_diff != years_active_first_last
+        if bad.any():
+            bad_duns = beh_id_year_diff.index[bad]
+            bad_normal = self.df_normal[self.df_normal['DunsNumber'].isin(bad_duns)]
+            bad_long = self.df_long.reindex(bad_duns, level=0)
+            if self.report is not None:
+                self.report.bad_normal.write(bad_normal)
+                self.report.bad_long.write(bad_long)
+            elif self.error_path is not None:
+                _, normal_path, long_path = ErrorReport.paths(self.error_path)
+                bad_normal.to_csv(normal_path)
+                bad_long.to_csv(long_path)
+
+            detail = ('spells sum to ' + beh_id_year_diff[bad].astype(str) + ' years, active for ' +
+                      years_active_first_last[bad].astype(str))
+            self.fail('sums', bad_normal, bad_normal['DunsNumber'].map(detail).to_numpy(),
+                      'Some FirstYears are greater than LastYears')
 
     def check_all(self):
         """Perform all checks sequentially"""
+        if self.mode == 'off':
+            return
         self.check_index()
         self.check_first_last()
         self.check_sums()
 
 
+def factorize_rows(columns):
+    """Integer code per row such that two rows get the same code exactly when all their values are equal
+
+    Nulls compare equal to each other, as in drop_duplicates.
+    """
+    row_codes = np.zeros(len(columns[0]), dtype='int64')
+    for col in columns:
+        codes, uniques = pd.factorize(col)
+        # Recompress after every column so the combined codes can't overflow
+        row_codes, _ = pd.factorize(row_codes * (len(uniques) + 1) + (codes + 1))
+    return row_codes
+
+
+def find_spells(duns, year, columns):
+    """Find the location spells in sorted long location data
+
+    A business's spells start at the first year each distinct location row appears (a return to an earlier location
+    is not a new spell).  If its locations changed, a spell lasts until the year before the next one starts and the
+    last runs to the business's final year.  Businesses that don't count as changed (the mean number of distinct
+    non-null values per column is not above 1) have every spell run to the final year.
+
+    :param duns: DunsNumber per row, sorted
+    :param year: Year per row, sorted within each DunsNumber
+    :param columns: List of location columns (arrays or Series)
+
+    :return (keep, last_year, beh_loc): Positions of the rows starting a spell, and each spell's LastYear and BEH_LOC
+    """
+    n = len(duns)
+    if n == 0:
+        return np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64')
+
+    # Group boundaries of each DunsNumber
+    starts = np.flatnonzero(np.r_[True, duns[1:] != duns[:-1]])
+    group = np.cumsum(np.r_[True, duns[1:] != duns[:-1]]) - 1
+    group_last_year = year[np.r_[starts[1:] - 1, n - 1]]
+
+    # Mean count of distinct non-null values per column > 1 means the location changed
+    distinct = np.zeros(len(starts), dtype='int64')
+    for col in columns:
+        codes, uniques = pd.factorize(col)
+        pairs = np.unique(group[codes >= 0] * (len(uniques) + 1) + codes[codes >= 0])
+        distinct += np.bincount(pairs // (len(uniques) + 1), minlength=len(starts))
+    change = distinct / len(columns) > 1
+
+    # First appearance of each distinct location row within its DunsNumber
+    row_codes = factorize_rows(columns)
+    _, first = np.unique(group * (row_codes.max() + 1) + row_codes, return_index=True)
+    keep = np.sort(first)
+
+    spell_group = group[keep]
+    is_last = np.r_[spell_group[1:] != spell_group[:-1], True]
+    next_first = np.r_[year[keep][1:] - 1, 0]
+    last_year = np.where(change[spell_group] & ~is_last, next_first, group_last_year[spell_group])
+
+    # Spells are counted down to 0 within each DunsNumber
+    spell_starts = np.flatnonzero(np.r_[True, spell_group[1:] != spell_group[:-1]])
+    spell_counts = np.diff(np.r_[spell_starts, len(keep)])
+    beh_loc = np.repeat(spell_starts + spell_counts, spell_counts) - np.arange(len(keep)) - 1
+
+    return keep, last_year, beh_loc
+
+
 class Cleaner:
 
     """Class containing all functions for cleaning and helper functions
@@ -83,60 +239,72 @@ class Cleaner:
         return final_columns
 
 
-    def normalize_df(self, loc_df):
+    def wide_to_long(self, wide_df, stubs):
+        """Reshape wide address data, such as 'Address99' ... 'Address14' columns, to one row per DunsNumber and year
+
+        Replaces pd.wide_to_long followed by sort_index/dropna.  Year suffixes are mapped with make_fullyear, each
+        stub's columns are taken as one (businesses x years) block and flattened, and years where every stub is null
+        are left out as the long arrays are built.  Years a stub has no column for are null.
+
+        :param wide_df: DataFrame indexed by DunsNumber, with columns named stub + 2 digit year
+        :param stubs: list of stub names, which become the columns of the result
+
+        :return DataFrame with a sorted int64 MultiIndex (DunsNumber, Year)
+        """
+        position = {}
+        for i, (col, full_col) in enumerate(zip(wide_df.columns, self.make_fullyear(wide_df.columns))):
+            if col != full_col:
+                position[(full_col[:-4], int(full_col[-4:]))] = i
+        years = np.array(sorted({year for stub, year in position if stub in stubs}), dtype='int64')
+
+        # Sort businesses first so the flattened (DunsNumber, Year) pairs come out sorted
+        duns = wide_df.index.to_numpy().astype('int64')
+        order = np.argsort(duns, kind='stable')
+        duns = duns[order]
+
+        blocks = []
+        not_null = np.zeros((len(duns), len(years)), dtype=bool)
+        for stub in stubs:
+            found = [j for j, year in enumerate(years) if (stub, year) in position]
+            block = wide_df.iloc[order, [position[(stub, years[j])] for j in found]].to_numpy()
+            if len(found) < len(years):
+                dtype = np.result_type(block.dtype, 'float64') if found and block.dtype.kind in 'iuf' else object
+                block, present = np.full((len(duns), len(years)), np.nan, dtype=dtype), block
+                block[:, found] = present
+            not_null |= pd.notna(block)
+            blocks.append(block)
+
+        keep = np.flatnonzero(not_null.ravel())
+        index = pd.MultiIndex.from_arrays([np.repeat(duns, len(years))[keep], np.tile(years, len(duns))[keep]],
+                                          names=[wide_df.index.name, 'Year'])
+        return apply_schema(pd.DataFrame({stub: block.ravel()[keep] for stub, block in zip(stubs, blocks)}, index=index))
+
+    def normalize_df(self, loc_df, beh_loc=False):
         """" Changes database from long form to normalized form, only including updates and removing redundant data
 
-        :param loc_df: Location DataFrame in the long format.  Should have MultiIndex (DunsNumber, Year)
-        :param sic_df: Sic DataFrame in the long format.  Should have MultiIndex (DunsNumber, Year)
+        Works directly on the sorted (DunsNumber, Year) arrays, see find_spells, and gives the same result as the
+        groupby/drop_duplicates/join version it replaced.
+
+        :param loc_df: Location DataFrame in the long format.  Should have MultiIndex (DunsNumber, Year), sorted
+        :param beh_loc: Also return BEH_LOC, counting a business's spells down to 0 for the most recent one
 
-        :return Normalized Data Frame
+        :return Normalized Data Frame, indexed by (DunsNumber, FirstYear) with LastYear and the location columns
         """
+        duns = loc_df.index.get_level_values(0).to_numpy()
+        year = loc_df.index.get_level_values(1).to_numpy()
+        keep, last_year, spell_loc = find_spells(duns, year, [loc_df[col] for col in loc_df.columns])
+
+        normal = loc_df.iloc[keep]
+        normal.index = pd.MultiIndex.from_arrays([duns[keep], year[keep]], names=['DunsNumber', 'FirstYear'])
+        normal.insert(0, 'LastYear', last_year.astype('int64'))
+        if beh_loc:
+            normal['BEH_LOC'] = spell_loc
 
-        # Generate loc_df of FirstYear and LastYear
-        loc_df.reset_index(inplace=True, drop=False)
-        grouped = loc_df[['DunsNumber', 'Year']].groupby('DunsNumber')
-        firstyear = grouped.first().rename(columns={'Year': 'FirstYear'})
-        lastyear = grouped.last().rename(columns={'Year': 'LastYear'})
-        misc = pd.concat([firstyear, lastyear], axis=1)
-        misc.set_index('FirstYear', append=True, inplace=True)
-        loc_df.set_index(['DunsNumber', 'Year'], inplace=True)
-
-        # Identify whether location changed at all for any given business
-        change = (loc_df.groupby(level=0).nunique().sum(axis=1) /
-                  loc_df.shape[1] > 1).rename('Change').to_frame()
-
-        loc_df = change.join(loc_df)
-
-        # Drop duplicates, add DunsNumber as column to ensure no deletion between different businesses with identical rows
-        loc_df['DunsNumber'] = loc_df.index.get_level_values(level=0)
-        loc_df = loc_df.drop_duplicates()
-        del loc_df['DunsNumber']
-        loc_df.index.names = ['DunsNumber', 'FirstYear']  # formatting
-
-        # Join FirstYear and LastYear in from misc, and fill values forward
-        joined = misc.join(loc_df, how='outer')
-        joined['LastYear'] = joined['LastYear'].groupby(level=0).ffill()
-        multi = joined[joined['Change'] == True]  # loc_df with only businesses that had changes
-
-        # Diagonal shift to fix years for multi businesses
-        #shift_year = lambda joined: joined.index.get_level_values('FirstYear').to_series().shift(-1) - 1
-        #lastyear = multi.groupby(level=0).apply(shift_year).combine_first(multi['LastYear']).rename('Lastyear')
-
-        multi.reset_index(drop=False, inplace=True)
-        lastyear = (multi[['DunsNumber', 'FirstYear']].groupby('DunsNumber').shift(-1) - 1).FirstYear.combine_first(
-            multi['LastYear']).rename('Lastyear')
-        multi['LastYear'] = lastyear
-        multi.set_index(['DunsNumber', 'FirstYear'], inplace=True)
-
-        # Join multi fixes into the original loc_df and remove the Change column
-        joined = multi.combine_first(joined)
-        #joined.loc[multi.index] = multi
-        joined['LastYear'] = joined['LastYear'].astype('int64')
-        del joined['Change']
-
-        return joined
-
-    def create_locations(self, location_filename_1, location_filename_2, write_path, sep='\t', chunksize=1*(10**5)):
+        return normal
+
+    def create_locations(self, location_filename_1, location_filename_2, write_path, sep='\t', chunksize=1*(10**5),
+                         check='full', check_fraction=0.1, resume=False, assume_sorted=None,
+                         checkpointed=False):
         """ Creates a normalized location file for NETS data
 
         This file will be indexed by the BEH_ID, which is a combination of the DunsNumber and the BEH_LOC.  Other than
@@ -144,9 +312,16 @@ class Cleaner:
 
         :param location_filename_1: First chronological filename for addresses
         :param location_filename_2: Second chronological filename for addresses.
-        :param write_path: path to write finished location file too
+        :param write_path: path to write finished location file too, written as Parquet if it ends in .parquet
         :param sep:  delimiter for reading.  Ex: ',' '\t'
         :param chunksize: size to write in.  Default is 10**5, may need to be adjusted based on the machine's memory
+        :param check: how to check each chunk, 'full', 'sample' or 'off'.  Problems go to an error report, see ErrorReport
+        :param check_fraction: fraction of businesses checked when check is 'sample'
+        :param resume: carry on an interrupted run from its last checkpointed chunk, see Checkpoint.  The output and
+            error report are cut back to that chunk and the address files read on from the DunsNumber it ended at
+        :param checkpointed: checkpoint every chunk once written, so an interrupted run can be resumed
+        :param assume_sorted: True if both address files are known to be sorted by DunsNumber, which is otherwise
+            taken from the markers of earlier runs or found by reading their DunsNumber column, see stream_join
 
         :return: Normalized location of type pandas.DataFrame object
         """
@@ -162,14 +337,22 @@ class Cleaner:
         # Define columns to read for SIC file
         sic_cols = ['DunsNumber'] + ['SIC' + str(x)[-2:] for x in range(1990, 2015)]
 
+        # With checkpointed or resume every chunk is checkpointed once written.  An input sorted by DunsNumber is
+        # resumed from the offset of the first DunsNumber after the last written one, see seek_key
+        checkpoint = Checkpoint(write_path, [location_filename_1, location_filename_2], resume=resume,
+                                checkpointed=checkpointed,
+                                params={'sep': sep, 'check': check, 'check_fraction': check_fraction})
+        last_key = checkpoint.state.get('last_key')
+        start_1, start_2 = checkpoint.offsets
+
         # Need to do more error checking later on to try and break this
         try:
             # Lines with wrong amount of delimiters create errors and will be skipped.  In the 2014 iteration there
-            # was only one such line.
-            df_99 = pd.read_csv(location_filename_1, index_col=['DunsNumber'], chunksize=chunksize, usecols=usecols_1,
-                                sep=sep, encoding='Windows-1252', error_bad_lines=False)
-            df_14 = pd.read_csv(location_filename_2, index_col=['DunsNumber'], chunksize=chunksize, usecols=usecols_2,
-                                sep=sep, encoding='Windows-1252', error_bad_lines=False)
+            # was only one such line.  Strings come back already stripped of their padding.
+            df_99 = RawTextReader(location_filename_1, usecols_1, sep=sep, chunksize=chunksize, index_col='DunsNumber',
+                                  start=start_1)
+            df_14 = RawTextReader(location_filename_2, usecols_2, sep=sep, chunksize=chunksize, index_col='DunsNumber',
+                                  start=start_2)
 
         except IOError as e:
             # File does not exist
@@ -178,63 +361,80 @@ class Cleaner:
             # Index DunsNumber isn't found
             print("ValueError: Index DunsNumber not present")
 
-        first = True  # Determine if this is our first chunk for writing headers
-        for (chunk_99, chunk_14) in zip(df_99, df_14):
-            # Implementing full year changes for column names before melting, and joining into one DF
-            chunk_99.columns = self.make_fullyear(chunk_99.columns)
-            chunk_14.columns = self.make_fullyear(chunk_14.columns)
-
+        # The two files are joined on DunsNumber as they stream, so they needn't share row order or skipped lines.
+        # Each is read on its own thread, which finds out whether it's sorted by DunsNumber (see sorted_chunks) and
+        # sorts it on disk first if not.  Markers of what it found go next to the output.  Only sorted files get an
+        # offset in the checkpoint, so a file resumed from one needn't be checked again, while the others are read
+        # from the beginning
+        out_dir = os.path.dirname(os.path.abspath(write_path))
+        streams = []
+        sorted_streams = []
+        for reader, filename, start in [(df_99, location_filename_1, start_1), (df_14, location_filename_2, start_2)]:
+            keys = RawTextReader(filename, ['DunsNumber'], sep=sep, chunksize=10 * chunksize, index_col='DunsNumber')
+            sorted_streams.append(sorted_chunks(reader, keys, out_dir, filename if start is None else None,
+                                                True if start is not None else assume_sorted))
+            stream = prefetch(sorted_streams[-1])
+            if last_key is not None and start is None:
+                stream = (x[x.index > last_key] for x in stream)
+            streams.append(stream)
+
+        # CSV, or Parquet if write_path ends in .parquet
+        writer = checkpoint.writer(write_path, index=True, float_format='%.f')
+        report = ErrorReport(write_path, checkpoint)
+        for (chunk_99, chunk_14) in aligned_chunks(*streams):
             chunk_loc = pd.concat([chunk_99, chunk_14], axis=1)
             # make citycode lowercase for formatting
             chunk_loc.columns = [col.upper() if 'CityCode' in col else col for col in chunk_loc.columns]
 
-            # Lots of empty space, strip all str columns
-            chunk_loc.loc[:, chunk_loc.select_dtypes('object').columns] =  \
-                chunk_loc.loc[:, chunk_loc.select_dtypes('object').columns].apply(lambda x: x.str.strip())
-
-            # reset index and melt to long format
-            chunk_loc.reset_index(inplace=True)
+            # reshape to long format, with full years, and normalize
             melt_cols = ['Address', 'City', 'State', 'ZIP', 'CITYCODE', 'FipsCounty']
-            chunk_loc_long = pd.wide_to_long(chunk_loc, melt_cols, i='DunsNumber', j='Year') \
-                .sort_index() \
-                .dropna(how='all')
-
-            # change year dtype to int and normalize
-            idx = chunk_loc_long.index
-            chunk_loc_long.index = chunk_loc_long.index.set_levels([idx.levels[0], idx.levels[1].astype('int64')])
-            normal = self.normalize_df(chunk_loc_long)
+            chunk_loc_long = self.wide_to_long(chunk_loc, melt_cols)
+            normal = self.normalize_df(chunk_loc_long, beh_loc=True)
             #fill empty strings with NaN
             normal.replace('', np.nan, inplace=True)
 
-            # change all possible dtypes to int
-            for col in normal.columns:
-                try:
-                    normal[col] = normal[col].astype(int)
-                except ValueError:
-                    continue
-
-            # Create BEH_ID and BEH_LOC
+            # Create BEH_ID from BEH_LOC
             normal.reset_index(drop=False, inplace=True)
-            normal['BEH_LOC'] = normal.groupby('DunsNumber').cumcount(ascending=False)
-            normal['BEH_ID'] = normal['BEH_LOC'] * (10 ** 9) + 10 ** 10 + normal['DunsNumber']
+            normal['BEH_ID'] = encode_behid(normal['DunsNumber'], normal['BEH_LOC'])
             normal.set_index('BEH_ID', inplace=True)
 
-            # Check this chunk
-            Checker(normal, chunk_loc_long, write_path).check_all()
-            if first:
-                normal.to_csv(write_path, float_format='%.f')
-                first = False
-                print('.')
+            # registered dtypes, see schema
+            apply_schema(normal)
 
-            else:
-                normal.to_csv(write_path, mode='a', header=False, float_format='%.f')
-                print('.')
+            # Check this chunk
+            Checker(normal, chunk_loc_long, report, mode=check, fraction=check_fraction).check_all()
+            writer.write(normal)
+
+            # Chunks hold every row of their DunsNumbers, so the inputs carry on after the last one
+            if checkpoint.enabled:
+                last_key = int(max(x.index[-1] for x in (chunk_99, chunk_14) if len(x)))
+                offsets = [seek_key(x, last_key, sep=sep) if y.is_sorted else None
+                           for x, y in zip([location_filename_1, location_filename_2], sorted_streams)]
+                checkpoint.commit(offsets, last_key=last_key, problems=report.count)
+            print('.')
+
+        writer.close()
+        report.close()
+        checkpoint.finish()
+        print('Skipped {} and {} bad lines'.format(df_99.skipped, df_14.skipped))
+        if report.count:
+            print('{} problems found, see {}'.format(report.count, report.errors.filepath))
 
 def main():
-    import os
+    import argparse
     from pathlib import Path
     from tkinter import filedialog, Tk
 
+    parser = argparse.ArgumentParser(description='Create the normalized NETS location file')
+    parser.add_argument('--check', choices=Checker.modes, default='full', help='How much of each chunk to check')
+    parser.add_argument('--check-fraction', type=float, default=0.1,
+                        help='Fraction of businesses checked with --check sample')
+    parser.add_argument('--resume', action='store_true', help='Carry on from the last checkpointed chunk')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='Checkpoint every chunk, so an interrupted run can be resumed')
+    parser.add_argument('--sorted', action='store_true', help='Address files are sorted by DunsNumber, skip checking')
+    args = parser.parse_args()
+
     root = Tk()
     root.withdraw()
     data_dir = Path(filedialog.askdirectory(initial=os.getcwd(),
@@ -245,7 +445,8 @@ def main():
 
     clean = Cleaner()
 
-    clean.create_locations(add99, add00, net_loc)
+    clean.create_locations(add99, add00, net_loc, check=args.check, check_fraction=args.check_fraction,
+                           resume=args.resume, assume_sorted=args.sorted or None, checkpointed=args.checkpoint)
 
 if __name__ == "__main__":
     time1 = time.time()
@@ -0,0 +1,411 @@
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from schema import apply_schema, read_dtypes
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pv
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = pv = ds = pq = None
+
+
+#####################################################################################################
+# Chunked readers and writers shared by the pipeline stages.  Paths ending in .parquet use a Parquet #
+# backend (requires pyarrow) with an explicit schema and row-group sized writes, and reads get       #
+# column projection and predicate pushdown.  Everything else goes through CSV exactly as before.     #
+#####################################################################################################
+
+
+def is_parquet(filepath):
+    """True if filepath should be read/written with the Parquet backend"""
+    return Path(filepath).suffix.lower() in ('.parquet', '.pq')
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError('pyarrow is required to read or write Parquet files')
+
+
+def read_header(filepath, sep=','):
+    """List of column names of a CSV or Parquet file, without reading any data"""
+    if is_parquet(filepath):
+        require_pyarrow()
+        return [x for x in pq.read_schema(filepath).names if not x.startswith('__index_level_')]
+
+    with open(filepath, 'r') as f:
+        return f.readline().strip().split(sep)
+
+
+def to_expression(filters):
+    """Turn filters such as [('adr_net_piz_c_2014', '==', 1), ...] (ANDed together) into a dataset expression"""
+    return pq.filters_to_expression(filters) if filters else None
+
+
+def apply_filters(df, filters):
+    """Apply the same filters as to_expression to a DataFrame, for the CSV backend"""
+    ops = {'==': '__eq__', '!=': '__ne__', '<': '__lt__', '<=': '__le__', '>': '__gt__', '>=': '__ge__'}
+    for col, op, value in filters or []:
+        if op == 'in':
+            df = df[df[col].isin(value)]
+        elif op == 'not in':
+            df = df[~df[col].isin(value)]
+        else:
+            df = df[getattr(df[col], ops[op])(value)]
+    return df
+
+
+def read_chunks(filepath, columns=None, filters=None, chunksize=10**6, **csv_kwargs):
+    """Yield DataFrame chunks of a CSV or Parquet file
+
+    Keyword Arguments:
+        filepath: File to read
+        columns: Columns to read.  For Parquet only these column chunks are read off disk
+        filters: List of (column, op, value) tuples that rows must all satisfy.  For Parquet these are pushed down
+            so row groups whose statistics rule them out are skipped
+        chunksize: Rows per chunk
+        csv_kwargs: Passed on to pd.read_csv for CSV files.  Columns known to the schema registry are parsed with
+            their registered dtypes unless dtype is given here
+    """
+    if is_parquet(filepath):
+        require_pyarrow()
+        dataset = ds.dataset(str(filepath), format='parquet')
+        for batch in dataset.to_batches(columns=columns, filter=to_expression(filters), batch_size=chunksize):
+            yield apply_schema(batch.to_pandas())
+    else:
+        csv_kwargs.setdefault('dtype', read_dtypes(columns or read_header(filepath, csv_kwargs.get('sep', ','))))
+        for chunk in pd.read_csv(filepath, usecols=columns, chunksize=chunksize, **csv_kwargs):
+            yield apply_filters(apply_schema(chunk), filters)
+
+
+def read_line_chunks(filepath, columns=None, chunksize=10**6, start=None, sep=',', **csv_kwargs):
+    """Yield (chunk, offset) pairs of a CSV file, offset being the byte offset in the file just past the chunk
+
+    Chunks hold the same rows as read_chunks gives.  Passing a previous offset as start carries on from there without
+    reading anything before it, which is how an interrupted rewrite resumes, see checkpoint.Checkpoint.  Rows are
+    split on line ends, so fields can't hold quoted newlines.
+
+    Keyword Arguments:
+        filepath: CSV file to read
+        columns: Columns to read
+        chunksize: Rows per chunk
+        start: Byte offset of the first line to read, as yielded earlier.  None starts after the header
+        sep: Field delimiter
+        csv_kwargs: Passed on to pd.read_csv, as for read_chunks
+    """
+    csv_kwargs.setdefault('dtype', read_dtypes(columns or read_header(filepath, sep)))
+    with open(filepath, 'rb') as f:
+        header = f.readline()
+        if start is not None:
+            f.seek(start)
+        while True:
+            lines = list(islice(f, chunksize))
+            if not lines:
+                return
+            chunk = pd.read_csv(io.BytesIO(header + b''.join(lines)), usecols=columns, sep=sep, **csv_kwargs)
+            yield apply_schema(chunk), f.tell()
+
+
+def wide_dictionaries(schema):
+    """schema with every dictionary (categorical) column indexed by int32
+
+    pandas sizes the index of a categorical by its number of categories, so a schema taken from the first chunk could
+    reject a later chunk with more of them.
+    """
+    fields = [pa.field(x.name, pa.dictionary(pa.int32(), x.type.value_type), x.nullable, x.metadata)
+              if pa.types.is_dictionary(x.type) else x for x in schema]
+    return pa.schema(fields, metadata=schema.metadata)
+
+
+class ChunkWriter:
+    """Write a file chunk by chunk, replacing the 'first chunk gets the header, then append' pattern
+
+    For Parquet each chunk becomes row groups of at most row_group_size rows, all written with one schema.  The schema
+    is the one passed in, or otherwise taken from the first chunk with categoricals given int32 indices, and later
+    chunks are cast to it so that a column that happens to be all null in one chunk can't change type.
+    """
+
+    def __init__(self, filepath, schema=None, index=False, row_group_size=10**6, compression='snappy', resume_size=None,
+                 **csv_kwargs):
+        """
+        Keyword Arguments:
+            filepath: File to write, replaced if it exists unless resume_size is given
+            schema: Optional pyarrow.Schema for Parquet output
+            index: Whether to write the DataFrame index
+            row_group_size: Maximum rows per Parquet row group
+            compression: Parquet compression codec
+            resume_size: Bytes of a partly written CSV file to keep, header included, and append to.  Anything
+                written after them is cut off
+            csv_kwargs: Passed on to DataFrame.to_csv for CSV output, such as float_format or encoding
+        """
+        self.filepath = filepath
+        self.schema = schema
+        self.index = index
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.csv_kwargs = csv_kwargs
+        self.writer = None
+        self.first = True
+
+        if is_parquet(filepath):
+            require_pyarrow()
+            if resume_size:
+                raise ValueError('Parquet files can only be written from the start')
+
+        if resume_size:
+            with open(filepath, 'r+b') as f:
+                f.truncate(resume_size)
+            self.first = False
+        elif os.path.exists(filepath):
+            os.remove(filepath)
+
+    def write(self, df):
+        if is_parquet(self.filepath):
+            # Stored with the registry's compact types
+            table = pa.Table.from_pandas(apply_schema(df.copy(deep=False)), schema=self.schema,
+                                         preserve_index=self.index)
+            if self.writer is None:
+                self.schema = wide_dictionaries(table.schema)
+                table = table.cast(self.schema)
+                self.writer = pq.ParquetWriter(str(self.filepath), self.schema, compression=self.compression)
+            self.writer.write_table(table, row_group_size=self.row_group_size)
+        else:
+            with open(self.filepath, 'w' if self.first else 'a', newline='\n',
+                      encoding=self.csv_kwargs.get('encoding')) as f:
+                df.to_csv(f, index=self.index, header=self.first, **self.csv_kwargs)
+        self.first = False
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def select_columns(filepath_in, filepath_out, columns, row_group_size=10**6):
+    """Write only columns of a Parquet file to a new Parquet file
+
+    Only the selected column chunks are read, one row group at a time, and nothing is parsed or converted to pandas.
+    """
+    require_pyarrow()
+    parquet_in = pq.ParquetFile(str(filepath_in))
+    schema = pa.schema([parquet_in.schema_arrow.field(x) for x in columns])
+
+    with pq.ParquetWriter(str(filepath_out), schema) as writer:
+        for i in range(parquet_in.num_row_groups):
+            writer.write_table(parquet_in.read_row_group(i, columns=columns), row_group_size=row_group_size)
+
+
+def pad_short_lines(block, n_fields, sep):
+    """block with the missing trailing fields of its short lines added as empty ones, the way pandas reads them
+
+    Blank lines are left alone, as both parsers skip them.
+    """
+    data = np.frombuffer(block, dtype='uint8')
+    if len(data) and data[-1] != ord('\n'):
+        data = np.append(data, np.uint8(ord('\n')))
+
+    ends = np.flatnonzero(data == ord('\n'))
+    starts = np.r_[0, ends[:-1] + 1]
+    ends_content = ends - ((ends > starts) & (data[ends - 1] == ord('\r')))
+    separators = np.flatnonzero(data == ord(sep))
+    n_separators = np.searchsorted(separators, ends_content) - np.searchsorted(separators, starts)
+
+    missing = np.where(ends_content > starts, np.clip(n_fields - 1 - n_separators, 0, None), 0)
+    return np.insert(data, np.repeat(ends_content, missing), np.uint8(ord(sep))).tobytes()
+
+
+def drop_long_lines(block, n_fields, sep):
+    """block without its lines of more than n_fields fields, and how many of them there were"""
+    data = np.frombuffer(block, dtype='uint8')
+    ends = np.flatnonzero(data == ord('\n'))
+    if len(data) and data[-1] != ord('\n'):
+        ends = np.r_[ends, len(data) - 1]
+    starts = np.r_[0, ends[:-1] + 1]
+    separators = np.flatnonzero(data == ord(sep))
+    long = np.searchsorted(separators, ends) - np.searchsorted(separators, starts) > n_fields - 1
+    if not long.any():
+        return block, 0
+
+    # +1 where each long line starts and -1 after its newline, so the running sum is 1 inside them
+    bounds = np.zeros(len(data) + 1, dtype='int8')
+    bounds[starts[long]] = 1
+    bounds[ends[long] + 1] = -1
+    return data[np.cumsum(bounds[:-1]) == 0].tobytes(), int(long.sum())
+
+
+class RawTextReader:
+    """Chunked reader for the raw NETS delimited text files
+
+    With pyarrow the file is cut into ranges of whole lines, each parsed and transcoded by pyarrow.csv.read_csv on
+    multiple threads while the previous one is handed to pandas.  Only usecols are ever materialized, and string
+    fields are stripped of whitespace before anything reaches pandas.  Without it this falls back to the pandas parser
+    followed by str.strip.  Either way lines with too many fields are skipped, as error_bad_lines=False used to do, and
+    counted in self.skipped, while lines with too few get empty trailing fields.  Fields can't hold quoted newlines.
+
+    Columns known to the schema registry get their registered dtypes.  Others are inferred the way pandas infers
+    them: a column becomes numeric only if every non-empty value parses as a number, otherwise it stays as (stripped)
+    strings.
+    """
+
+    def __init__(self, filepath, usecols, sep='\t', encoding='Windows-1252', chunksize=10**5, index_col=None,
+                 block_size=1 << 24, start=None, threads=None):
+        """
+        Keyword Arguments:
+            filepath: File to read
+            usecols: Columns to keep
+            sep: Field delimiter
+            encoding: Encoding of the file, transcoded to UTF-8 while parsing
+            chunksize: Rows per yielded chunk
+            index_col: Optional column to use as the index
+            block_size: Bytes pyarrow parses per thread
+            start: Optional byte offset of the first line to read, the header is still taken from the top of the file
+            threads: Blocks parsed at once, os.cpu_count() by default.  Each range read is threads blocks long
+        """
+        self.filepath = filepath
+        self.usecols = list(usecols)
+        self.sep = sep
+        self.encoding = encoding
+        self.chunksize = chunksize
+        self.index_col = index_col
+        self.block_size = block_size
+        self.start = start
+        self.range_size = block_size * (threads or os.cpu_count() or 1)
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        if self.start is not None and self.start >= os.path.getsize(self.filepath):
+            return iter(())
+        return self._iter_arrow() if pv is not None else self._iter_pandas()
+
+    def header(self):
+        """Column names from the first line of the file"""
+        with open(self.filepath, 'rb') as f:
+            return f.readline().decode(self.encoding).rstrip('\r\n').split(self.sep)
+
+    def _ranges(self):
+        """Yield consecutive ranges of whole lines, from start or the line after the header"""
+        with open(self.filepath, 'rb') as f:
+            f.readline()
+            if self.start is not None:
+                f.seek(self.start)
+            while True:
+                block = f.read(self.range_size)
+                if not block:
+                    return
+                yield block + f.readline()
+
+    def _parse(self, block, column_names):
+        """Table of the usecols of a range of lines, with short lines padded and long ones skipped"""
+        counts = {'short': 0, 'long': 0}
+        counts_lock = threading.Lock()
+
+        def invalid_row(row):
+            with counts_lock:
+                counts['short' if row.actual_columns < row.expected_columns else 'long'] += 1
+            return 'skip'
+
+        def read(data):
+            return pv.read_csv(
+                pa.BufferReader(data),
+                read_options=pv.ReadOptions(use_threads=True, block_size=self.block_size, encoding=self.encoding,
+                                            column_names=column_names),
+                parse_options=pv.ParseOptions(delimiter=self.sep, invalid_row_handler=invalid_row),
+                convert_options=pv.ConvertOptions(include_columns=self.usecols, strings_can_be_null=True,
+                                                  column_types={x: pa.string() for x in self.usecols}))
+
+        table = read(block)
+        if counts['short']:
+            counts['long'] = 0
+            table = read(pad_short_lines(block, len(column_names), self.sep))
+        with self.lock:
+            self.skipped += counts['long']
+        return table
+
+    def _iter_arrow(self):
+        column_names = self.header()
+        with ThreadPoolExecutor(1) as pool:
+            # The next range is parsed while the current one is converted and consumed
+            ranges = self._ranges()
+            block = next(ranges, None)
+            parsed = pool.submit(self._parse, block, column_names) if block is not None else None
+
+            pending = []
+            n_pending = 0
+            while parsed is not None:
+                table = parsed.result()
+                block = next(ranges, None)
+                parsed = pool.submit(self._parse, block, column_names) if block is not None else None
+
+                pending += table.to_batches()
+                n_pending += table.num_rows
+                while n_pending >= self.chunksize:
+                    table = pa.Table.from_batches(pending, schema=table.schema)
+                    yield self._to_pandas(table.slice(0, self.chunksize))
+                    rest = table.slice(self.chunksize)
+                    pending = rest.to_batches()
+                    n_pending = rest.num_rows
+
+            if n_pending:
+                yield self._to_pandas(pa.Table.from_batches(pending))
+
+    def _to_pandas(self, table):
+        columns = {}
+        for name in table.column_names:
+            stripped = pc.utf8_trim_whitespace(table[name])
+            try:
+                columns[name] = pd.to_numeric(stripped.to_pandas())
+            except (ValueError, TypeError):
+                columns[name] = stripped.to_pandas()
+
+        df = pd.DataFrame(columns)
+        return apply_schema(df.set_index(self.index_col) if self.index_col is not None else df)
+
+    def _iter_pandas(self):
+        # The C parser can't be trusted to skip lines with too many fields: at some chunk boundaries it cuts them short
+        # and keeps them.  So they are dropped from each range of lines before it is parsed
+        column_names = self.header()
+        pending = []
+        n_pending = 0
+        for block in self._ranges():
+            block, n_long = drop_long_lines(block, len(column_names), self.sep)
+            self.skipped += n_long
+            chunk = pd.read_csv(io.BytesIO(block), header=None, names=column_names, usecols=self.usecols, sep=self.sep,
+                                encoding=self.encoding, dtype=str)
+            pending.append(chunk)
+            n_pending += len(chunk)
+            while n_pending >= self.chunksize:
+                chunk = pd.concat(pending, ignore_index=True)
+                yield self._strip(chunk.iloc[:self.chunksize])
+                pending = [chunk.iloc[self.chunksize:]]
+                n_pending = len(pending[0])
+
+        if n_pending:
+            yield self._strip(pd.concat(pending, ignore_index=True))
+
+    def _strip(self, chunk):
+        columns = {}
+        for name in self.usecols:
+            stripped = chunk[name].str.strip()
+            try:
+                columns[name] = pd.to_numeric(stripped)
+            except (ValueError, TypeError):
+                columns[name] = stripped
+        df = pd.DataFrame(columns).reset_index(drop=True)
+        return apply_schema(df.set_index(self.index_col) if self.index_col is not None else df)
@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# The pipeline modules are imported from the root of the repo, as when the patch scripts are run from there with -m
+root = str(Path(__file__).resolve().parent)
+if root not in sys.path:
+    sys.path.insert(0, root)
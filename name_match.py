@@ -0,0 +1,182 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+WORD = re.compile(r'\w+')
+
+
+def required_tokens(seq, left=False, right=False):
+    """Words a name must contain as whole tokens for the parsed regex sequence seq to match, or None if unknown
+
+    A literal run of word characters only counts if it is bounded on both sides, by \\b, ^/$ or a non-word literal,
+    because then any match has to put it in the name as a complete WORD token.  Groups and alternations are followed;
+    an alternation requires one token out of its branches.  Returns a frozenset meaning "at least one of these".
+    -----------
+    Keyword Arguments:
+    seq: A sequence from sre_parse.parse()
+    left, right: Whether the context just outside seq is a word boundary
+    """
+    boundary_at = (sre_parse.AT_BOUNDARY, sre_parse.AT_BEGINNING, sre_parse.AT_BEGINNING_STRING,
+                   sre_parse.AT_END, sre_parse.AT_END_STRING)
+    zero_width = (sre_parse.ASSERT, sre_parse.ASSERT_NOT)
+    items = list(seq)
+
+    def is_word(item):
+        return item[0] == sre_parse.LITERAL and WORD.match(chr(item[1])) is not None
+
+    def is_boundary(item):
+        if item[0] == sre_parse.AT:
+            return item[1] in boundary_at
+        return item[0] == sre_parse.LITERAL and not is_word(item)
+
+    def neighbour(i, step, edge):
+        i += step
+        while 0 <= i < len(items) and items[i][0] in zero_width:
+            i += step
+        return edge if not 0 <= i < len(items) else is_boundary(items[i])
+
+    requirements = []
+    i = 0
+    while i < len(items):
+        op, av = items[i]
+        if is_word(items[i]):
+            start = i
+            while i < len(items) and is_word(items[i]):
+                i += 1
+            if neighbour(start, -1, left) and neighbour(i - 1, 1, right):
+                requirements.append(frozenset([''.join(chr(x[1]) for x in items[start:i])]))
+            continue
+
+        if op == sre_parse.SUBPATTERN and not av[1] & sre_parse.SRE_FLAG_IGNORECASE:
+            found = required_tokens(av[-1], neighbour(i, -1, left), neighbour(i, 1, right))
+            if found:
+                requirements.append(found)
+        elif op == sre_parse.BRANCH:
+            branches = [required_tokens(x, neighbour(i, -1, left), neighbour(i, 1, right)) for x in av[1]]
+            if all(branches):
+                requirements.append(frozenset().union(*branches))
+        i += 1
+
+    if not requirements:
+        return None
+    # The most selective requirement: fewest alternatives, then longest words
+    return min(requirements, key=lambda x: (len(x), -min(len(y) for y in x)))
+
+
+def required_substring(seq):
+    """Longest run of literal characters that every match of the parsed sequence seq has to contain, or None"""
+    best = ''
+    run = ''
+    for op, av in seq:
+        if op == sre_parse.LITERAL:
+            run += chr(av)
+            best = max(best, run, key=len)
+        elif op not in (sre_parse.ASSERT, sre_parse.ASSERT_NOT, sre_parse.AT):
+            run = ''
+    return best or None
+
+
+class LiteralPrefilter:
+    """
+    Inverted index from required literal words to the patterns of a category's name list.  A name is only tested
+    against the patterns whose words it contains, plus the patterns no word could be extracted from, instead of
+    against the whole '|'.join() alternation.  Patterns without a whole required word are gated on a required
+    substring instead, and only patterns with neither are tried on every name.  search() gives the same answer as
+    re.search on the alternation.
+    """
+
+    def __init__(self, patterns):
+        """
+        Keyword Arguments:
+        patterns: The category's list of name regexes
+        """
+        self.pattern = '|'.join(patterns)
+        self.compiled = [re.compile(x) for x in patterns]
+        self.index = {}
+        self.substrings = []
+        self.fallback = []
+
+        for i, pattern in enumerate(patterns):
+            parsed = sre_parse.parse(pattern)
+            if parsed.state.flags & sre_parse.SRE_FLAG_IGNORECASE:
+                self.fallback.append(i)
+                continue
+
+            tokens = required_tokens(parsed)
+            substring = required_substring(parsed)
+            if tokens is not None:
+                for token in tokens:
+                    self.index.setdefault(token, []).append(i)
+            elif substring is not None:
+                self.substrings.append((i, substring))
+            else:
+                self.fallback.append(i)
+
+    def candidates(self, name):
+        """Indices of the patterns that could possibly match name"""
+        found = set(self.fallback)
+        found.update(i for i, substring in self.substrings if substring in name)
+        for token in set(WORD.findall(name)):
+            found.update(self.index.get(token, ()))
+        return found
+
+    def search(self, name):
+        """True if any pattern matches name"""
+        return any(self.compiled[i].search(name) is not None for i in self.candidates(name))
+
+
+class NameVocabulary:
+    """
+    Distinct values of a Company or TradeName column, with the codes that map every row back to its value.  Name
+    regexes are run once per distinct string and broadcast back to the rows, so chain names that repeat hundreds of
+    thousands of times only get searched once.
+    """
+
+    def __init__(self, strings):
+        """Factorize the column.  Nulls get code -1 and never match.
+        -----------
+        Keyword Arguments:
+        strings: pandas Series of names
+        """
+        codes, uniques = pd.factorize(strings)
+        self.codes = codes
+        self.uniques = np.asarray(uniques, dtype=object)
+
+    def needed(self, where=None):
+        """Codes of the distinct strings appearing in the rows selected by the boolean mask where"""
+        codes = self.codes if where is None else self.codes[where]
+        return np.unique(codes[codes >= 0])
+
+    def match(self, pattern, where=None, prefilter=None):
+        """Boolean array of the rows matching pattern, the same test as Series.str.contains with nulls as False
+        -----------
+        Keyword Arguments:
+        pattern: Regular expression, such as the '|'.join() of a category's name list
+        where: Optional boolean mask.  Only these rows are considered, all others come back False
+        prefilter: Optional LiteralPrefilter built from the same pattern list, used in place of the joined regex
+        """
+        needed = self.needed(where)
+        needed = needed[np.array([isinstance(x, str) for x in self.uniques[needed]], dtype=bool)]
+
+        # One extra slot so that code -1 (null) broadcasts to False
+        hits = np.zeros(len(self.uniques) + 1, dtype=bool)
+
+        search = prefilter.search if prefilter is not None else lambda x, regex=re.compile(pattern): \
+            regex.search(x) is not None
+        hits[needed] = [search(x) for x in self.uniques[needed]]
+
+        match = hits[self.codes]
+        if where is not None:
+            match &= where
+        return match
+
+
+def contains(strings, pattern):
+    """Deduplicated drop-in for strings.str.contains(pattern), returning a boolean Series with nulls as False"""
+    return pd.Series(NameVocabulary(strings).match(pattern), index=strings.index)
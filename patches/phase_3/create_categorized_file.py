@@ -1,32 +1,32 @@
-import pandas as pd
+from checkpoint import Checkpoint
 
-def create_categorized_file(data_filename_in, data_filename_out, hierarchy_cols):
-    df = pd.read_csv(data_filename_in, chunksize=10**6)
 
-    first = True
-    i = 1
-    for chunk in df:
+def create_categorized_file(data_filename_in, data_filename_out, hierarchy_cols, resume=False, checkpointed=False):
+    checkpoint = Checkpoint(data_filename_out, [data_filename_in], params={'hierarchy_cols': hierarchy_cols},
+                            resume=resume, checkpointed=checkpointed)
+    df = checkpoint.chunks(data_filename_in, chunksize=10**6)
 
-        cat_bool = chunk[hierarchy_cols].any(axis=1)
-        chunk_cat = chunk[cat_bool]
+    with checkpoint.writer(data_filename_out, encoding='utf-8') as writer:
+        for i, chunk in enumerate(df, checkpoint.n_chunks + 1):
 
-        if first:
-            with open(data_filename_out, "w", newline="\n") as f:
-                chunk_cat.to_csv(f, index=False, encoding='utf-8')
-            first = False
-            print(i)
-            i += 1
-        else:
-            with open(data_filename_out, "a", newline="\n") as f:
-                chunk_cat.to_csv(f, index=False, header=False, encoding='utf-8')
+            cat_bool = chunk[hierarchy_cols].any(axis=1)
+            chunk_cat = chunk[cat_bool]
+
+            writer.write(chunk_cat)
             print(i)
-            i += 1
 
 
 if __name__ == "__main__":
+    import argparse
     from pathlib import Path
 
-    data_path = Path.cwd().parent / 'data'
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resume', action='store_true', help='Carry on from the last checkpointed chunk')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='Checkpoint every chunk, so an interrupted run can be resumed.  Rows must not span lines')
+    args = parser.parse_args()
+
+    data_path = Path(__file__).resolve().parents[1] / 'data'
 
     data_filename_in = \
         r"C:\Users\jc4673\Documents\Columbia\NETS\nets_clean\patches\data\data_out\recvd_net_vars_v8_20190311.csv"
@@ -36,4 +36,5 @@ if __name__ == "__main__":
     with open(config_filepath / 'aux_hier_vars.txt', 'r') as f:
         aux_hier = [line.strip() for line in f.readlines()]
 
-    create_categorized_file(data_filename_in, data_filename_out, aux_hier)
+    create_categorized_file(data_filename_in, data_filename_out, aux_hier, resume=args.resume,
+                            checkpointed=args.checkpoint)
@@ -1,8 +1,13 @@
+import numpy as np
 import pandas as pd
 import json
 import re
 from pathlib import Path
 
+from category_bits import CategorySchema, is_packed, packed_columns, unpacked_columns
+from checkpoint import Checkpoint
+from columnar import read_header
+
 
 #############################################################################
 # Code to implement the fix if mains should be a combination of auxiliaries.#
@@ -55,20 +60,12 @@ def get_code(var_name_long):
     return var_name_long[8:11]
 
 
-def get_hierarchy(row, hier_list):
-    """Get the hierarchy list"""
-    # only run this on cols with a category in the first place to speed it up
-    for col in hier_list:
-        if row[col] == 1:
-            # extract the 3 digit code from the total variable name
-            code = get_code(col)
-            return "adr_net_{}h_c_2014".format(code)
-
-
-def get_good_columns(filepath, main_cats, main_cats_hier):
-    """Get all columns for reading except main categories and hierarchy"""
-    with open(filepath, 'r') as f:
-        cols = f.readline().strip().split(',')
+def get_good_columns(filepath, main_cats, main_cats_hier, bits=None):
+    """Get all columns for reading except main categories and hierarchy.  A file packed with the CategorySchema bits
+    counts as having the category columns its cat_bits_ words stand for"""
+    cols = read_header(filepath)
+    if bits is not None and is_packed(cols, bits):
+        cols = unpacked_columns(cols, bits)
 
     # exclude hierarchy categories
     search = re.compile("_.{3}h_c_")
@@ -83,55 +80,55 @@ def get_good_columns(filepath, main_cats, main_cats_hier):
 
 
 def set_hierarchy(chunk, hier_list):
-    """Creates one-hot encoded hierarchy vars based on non-hierarchy vars in chunk"""
-    # Only get hierarchies for classified businesses
-    des_mask = chunk[hier_list].any(axis=1)
-    des = chunk[des_mask]
-
-    hierarchy = des.apply(get_hierarchy, axis=1, hier_list=hier_list) \
-        .reindex(chunk.index)
-    hierarchy_dummies = pd.get_dummies(hierarchy)
-
-    # Add unrepresented codes if present
-    if len(hierarchy_dummies.columns) != len(hier_list):
-        missing_codes = \
-            [get_code(x) for x in hier_list if not
-                any(get_code(x) == get_code(y) for y in hierarchy_dummies.columns)]
-        missing_vars = ["adr_net_{}h_c_2014".format(x) for x in missing_codes]
-        for var in missing_vars:
-            hierarchy_dummies[var] = 0
+    """Creates one-hot encoded hierarchy vars based on non-hierarchy vars in chunk
+
+    hier_list is in priority order, so a row's hierarchy category is its first category equal to 1.  That is an argmax
+    over the flag matrix, which is scattered straight into the fixed set of hierarchy columns.
+    """
+    flags = chunk[hier_list].to_numpy() == 1
+    classified = np.flatnonzero(flags.any(axis=1))
+
+    hierarchy = np.zeros(flags.shape, dtype='uint8')
+    hierarchy[classified, flags[classified].argmax(axis=1)] = 1
 
     # Sort column names for consistency
-    hierarchy_dummies = hierarchy_dummies.reindex(sorted(hierarchy_dummies.columns), axis=1)
+    hier_cols = ["adr_net_{}h_c_2014".format(get_code(x)) for x in hier_list]
+    order = np.argsort(hier_cols)
+    hierarchy_dummies = pd.DataFrame(hierarchy[:, order], index=chunk.index, columns=[hier_cols[i] for i in order])
 
     return hierarchy_dummies
 
 
-def set_main_cats(category_dummies, main_cats):
-    """Add main categories to hierarchy dummies and return"""
-    sub_cats = set([y for _, x in main_cats.items() for y in x])
-    sub_mask = category_dummies[sub_cats].any(axis=1)
-    sub = category_dummies[sub_mask]
+def membership_matrix(main_cats):
+    """Build the aux x main 0/1 membership matrix from a main category config
 
-    for main_cat, sub_cats in main_cats.items():
-        sub[main_cat] = sub[sub_cats].any(axis=1).astype(int)
+    Returns the aux columns (rows of the matrix), the sorted main columns (columns of the matrix) and the matrix
+    """
+    sub_cats = sorted(set([y for _, x in main_cats.items() for y in x]))
+    main_cols = sorted(main_cats.keys())
+    position = {x: i for i, x in enumerate(sub_cats)}
 
-    cat_main = sub.reindex(category_dummies.index) \
-        .fillna(0) \
-        .astype(int)
+    membership = np.zeros((len(sub_cats), len(main_cols)), dtype='float32')
+    for j, main_cat in enumerate(main_cols):
+        membership[[position[x] for x in main_cats[main_cat]], j] = 1
 
-    return cat_main[sorted(main_cats.keys())]
+    return sub_cats, main_cols, membership
 
 
-def write_file(df, writefile, first):
-    """Write df to file.  Only write column names if first=True"""
-    if first:
-        with open(writefile, "w", newline="\n", encoding='utf-8') as f:
-            df.to_csv(f, index=False)
+def set_main_cats(category_dummies, main_cats):
+    """Add main categories to hierarchy dummies and return
 
-    else:
-        with open(writefile, "a", newline="\n", encoding='utf-8') as f:
-            df.to_csv(f, index=False, header=False)
+    Works for both the hierarchy and the non-hierarchy configs: a main category is set when any of its aux categories
+    is, which is the product of the row x aux flags with the aux x main membership matrix. A missing dummy is no
+    category. The membership matrix stays dense: it is only aux x main, so a sparse one saves nothing, and the dense
+    float32 product beats one over the nonzero flags alone at a 1% fill.
+    """
+    sub_cats, main_cols, membership = membership_matrix(main_cats)
+    flags = (category_dummies[sub_cats].fillna(0).to_numpy() != 0).astype('float32')
+
+    cat_main = pd.DataFrame((flags @ membership > 0).astype(int), index=category_dummies.index, columns=main_cols)
+
+    return cat_main
 
 
 def get_non_rundle_columns(net_columns):
@@ -165,32 +162,47 @@ def reclassify(df, hier_list, main_cats, main_cats_hier):
     return reclassified_df
 
 
-def main(data_path, write_path, main_cats_path, hier_list_path, chunksize=10**6):
-    """Implement the total fix:  Read, transform, write."""
+def main(data_path, write_path, main_cats_path, hier_list_path, chunksize=10**6, resume=False, bits=None,
+         checkpointed=False):
+    """Implement the total fix:  Read, transform, write.
+
+    With CSV files and checkpointed=True every chunk is checkpointed, and resume=True carries on an interrupted run
+    from its last chunk.
+    Given a CategorySchema as bits, the category columns are written packed into its cat_bits_ words, and an input
+    packed with it is unpacked as it's read.
+    """
     main_cats_hier = load_main_cat_config(main_cats_path, hierarchies=True)
     main_cats = load_main_cat_config(main_cats_path, hierarchies=False)
     hier_list = load_hierarchy_list(hier_list_path)
 
-    good_cols = get_good_columns(data_path, main_cats, main_cats_hier)
-    df = pd.read_csv(data_path, usecols=good_cols, chunksize=chunksize)
-
-    first = True
-    i = 1
-    for chunk in df:
-        print(i)
-        final_chunk = reclassify(chunk, hier_list, main_cats, main_cats_hier)
-        write_file(final_chunk, write_path, first)
-        first = False
-        i += 1
+    good_cols = get_good_columns(data_path, main_cats, main_cats_hier, bits)
+    packed = bits is not None and is_packed(read_header(data_path), bits)
+    checkpoint = Checkpoint(write_path, [data_path], resume=resume, checkpointed=checkpointed,
+                            params={'columns': good_cols, 'main_cats': main_cats, 'hier_list': hier_list,
+                                    'bits': bits.columns if bits is not None else None})
+    df = checkpoint.chunks(data_path, columns=packed_columns(good_cols, bits) if packed else good_cols,
+                           chunksize=chunksize)
+
+    # CSV or Parquet, based on the extensions of data_path and write_path
+    with checkpoint.writer(write_path, encoding='utf-8') as writer:
+        for i, chunk in enumerate(df, checkpoint.n_chunks + 1):
+            print(i)
+            if packed:
+                chunk = bits.from_frame(chunk, [x for x in good_cols if x in bits.bits])[good_cols]
+            final_chunk = reclassify(chunk, hier_list, main_cats, main_cats_hier)
+            if bits is not None:
+                final_chunk = bits.to_frame(final_chunk)
+            writer.write(final_chunk)
 
 
 if __name__ == "__main__":
+    import argparse
     from pathlib import Path
     import time
     from tkinter import filedialog
     from tkinter import *
 
-    root = Path.cwd().parent.parent
+    root = Path(__file__).resolve().parents[2]
     tk = Tk()
     data_path = filedialog.askdirectory(initialdir=root,
                                              title="Select file",
@@ -204,6 +216,15 @@ if __name__ == "__main__":
     main_cats_path = root.parent.parent / 'config' / 'main_categories.json'
     hier_list_path = root.parent.parent / 'config' /'hierarchy_list.txt'
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resume', action='store_true', help='Carry on from the last checkpointed chunk')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='Checkpoint every chunk, so an interrupted run can be resumed.  Rows must not span lines')
+    parser.add_argument('--bits', action='store_true', help='Write the category columns bit-packed, see category_bits')
+    args = parser.parse_args()
+
+    bits = CategorySchema.from_config(root.parent.parent / 'config') if args.bits else None
     time1 = time.time()
-    main(data_path, write_path, main_cats_path, hier_list_path)
+    main(data_path, write_path, main_cats_path, hier_list_path, resume=args.resume, bits=bits,
+         checkpointed=args.checkpoint)
     print(time.time() - time1)
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import phase_3
+
+# Initialize setup outputs, from random flags rather than the data file test_phase_3 reads
+main_cats = None
+main_cats_hier = None
+hier_list = None
+df_input = None
+
+
+def setup_module():
+    config_filepath = Path(__file__).resolve().parents[2] / 'config'
+    main_cats_filepath = config_filepath / 'main_categories.json'
+
+    global main_cats
+    main_cats = phase_3.load_main_cat_config(main_cats_filepath, hierarchies=False)
+
+    global main_cats_hier
+    main_cats_hier = phase_3.load_main_cat_config(main_cats_filepath, hierarchies=True)
+
+    global hier_list
+    hier_list = phase_3.load_hierarchy_list(config_filepath / 'hierarchy_list.txt')
+
+    # Sparse aux flags, most rows in no category at all, on a shuffled index
+    global df_input
+    rng = np.random.default_rng(0)
+    flags = (rng.random((2000, len(hier_list))) < 0.005).astype(int)
+    df_input = pd.DataFrame(flags, columns=hier_list, index=rng.permutation(10**6)[:2000])
+    df_input['adr_net_behid_u_2014'] = np.arange(2000) + 10**10
+    df_input['z10_cen_uid_u_2010'] = rng.integers(0, 10**5, 2000)
+
+
+def test_set_hierarchy():
+    hierarchy = phase_3.set_hierarchy(df_input, hier_list)
+
+    assert hierarchy.index.equals(df_input.index)
+    assert hierarchy.columns.tolist() == sorted("adr_net_{}h_c_2014".format(phase_3.get_code(x)) for x in hier_list)
+
+    # A row's hierarchy category is its first category in hier_list order
+    for i, (_, row) in enumerate(df_input[hier_list].iterrows()):
+        first = [x for x in hier_list if row[x] == 1][:1]
+        expected = ["adr_net_{}h_c_2014".format(phase_3.get_code(x)) for x in first]
+        assert hierarchy.columns[hierarchy.iloc[i].to_numpy() == 1].tolist() == expected
+
+
+def test_set_main_cats():
+    main = phase_3.set_main_cats(df_input, main_cats)
+
+    assert main.columns.tolist() == sorted(main_cats)
+    for main_cat, sub_cats in main_cats.items():
+        assert (main[main_cat].to_numpy() == df_input[sub_cats].any(axis=1).astype(int).to_numpy()).all()
+
+
+def test_set_main_cats_missing_dummy():
+    # A blank dummy, as read from a net_vars file, doesn't set its main categories
+    df = df_input[hier_list].astype('float64')
+    df[:] = 0
+    sub_cat = main_cats[sorted(main_cats)[0]][0]
+    df[sub_cat] = np.nan
+    main = phase_3.set_main_cats(df, main_cats)
+
+    assert (main.to_numpy() == 0).all()
+
+
+def test_set_main_cats_hier():
+    hierarchy = phase_3.set_hierarchy(df_input, hier_list)
+    main = phase_3.set_main_cats(hierarchy, main_cats_hier)
+
+    assert main.columns.tolist() == sorted(main_cats_hier)
+    # Each row has at most one hierarchy category, and so belongs to as many main hierarchy categories as it's in
+    for main_cat, sub_cats in main_cats_hier.items():
+        assert (main[main_cat].to_numpy() == hierarchy[sub_cats].any(axis=1).astype(int).to_numpy()).all()
+
+
+def test_reclassify():
+    df_output = phase_3.reclassify(df_input, hier_list, main_cats, main_cats_hier)
+
+    assert df_output.index.equals(df_input.index)
+    assert len(set(df_output.columns)) == len(df_output.columns)
+    # NOT is cleared wherever the hierarchy columns, NOT included, have a flag, which is every row
+    assert (df_output['adr_net_not_c_2014'] == 0).all()
+    assert (df_output['z10_cen_uid_u_2010'] == df_input['z10_cen_uid_u_2010']).all()
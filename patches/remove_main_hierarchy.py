@@ -2,10 +2,13 @@ import os
 import time
 
 import re
-import pandas as pd
 import json
 from pathlib import Path
 
+from category_bits import is_packed, packed_columns, unpacked_columns
+from checkpoint import Checkpoint
+from columnar import is_parquet, read_header, select_columns
+
 
 #####################################################################################################
 # Strips all main category hierarchy values from a csv file where they're present, and re-writes it #
@@ -13,9 +16,9 @@ from pathlib import Path
 #####################################################################################################
 
 
-def get_csv_files(dir_path):
-    """Returns a list of all the csv files in the dir at dir_path"""
-    return [x for x in os.listdir(dir_path) if x.endswith(".csv")]
+def get_csv_files(dir_path, extensions=(".csv",)):
+    """Returns a list of all the csv files (or other extensions) in the dir at dir_path"""
+    return [x for x in os.listdir(dir_path) if x.endswith(extensions)]
 
 
 def get_bad_cols(json_cat):
@@ -32,17 +35,19 @@ def get_bad_cols(json_cat):
 
     return cols_flat
 
-def get_good_cols(filepath, bad_cols):
+def get_good_cols(filepath, bad_cols, bits=None):
     """ Read the first line of a file and filter its columns to return none of the main hierarchy ones
 
     Keyword Arguments:
         filepath: Path to the file we want to alter
+        bits: CategorySchema the file may be packed with, whose category columns then count as in the file
 
     Returns:
         List of columns we want
     """
-    with open(filepath, "r") as f:
-        all_cols = f.readline().strip().split(",")
+    all_cols = read_header(filepath)
+    if bits is not None and is_packed(all_cols, bits):
+        all_cols = unpacked_columns(all_cols, bits)
 
     good_cols = [x for x in all_cols
                  if not any(bad_col in x for bad_col in bad_cols)]
@@ -74,55 +79,72 @@ def get_filename_out(filename_in, extension=".csv"):
     return new_filename
 
 
-def read_rewrite(filepath_in, dirpath_out, bad_cols, chunksize=10**6):
+def read_rewrite(filepath_in, dirpath_out, bad_cols, chunksize=10**6, filepath_out=None, resume=False, bits=None,
+                 checkpointed=False):
     """ Reads the file at filepath and rewrites a new one to the same directory
 
     Keyword Arguments:
         filepath_in: Full path to the input file, type pathlib.Path
         dirpath_out: Path to the directory desired for output file, type pathlib.Path
         bad_cols: The columns we want to get rid of, list format
+        chunksize: Rows per chunk, give wide area-level files (z10, t10) smaller ones
+        filepath_out: Optional exact path to write to instead of a new version in dirpath_out
+        resume: Carry on an interrupted CSV rewrite from its last checkpointed chunk.  The default output name has
+            today's date in it, so give filepath_out to resume a run from another day
+        checkpointed: Checkpoint every chunk of a CSV rewrite, so it can be resumed if interrupted
+        bits: CategorySchema of a file packed by phase_3.  The output is written unpacked, the main hierarchy columns
+            being gone from it, with the category columns after the others
 
     Returns:
         None
     """
 
-    # Set smaller chunks for wider datasets to conserve memory
-    if "z10" in str(filepath_in) or "t10" in str(filepath_in):
-        chunksize = 10**4
-
-    good_cols = get_good_cols(filepath_in, bad_cols)
-    filepath_out = dirpath_out / get_filename_out(filepath_in.name)
-    df = pd.read_csv(filepath_in, usecols=good_cols, chunksize=chunksize)
+    good_cols = get_good_cols(filepath_in, bad_cols, bits)
+    packed = bits is not None and is_packed(read_header(filepath_in), bits)
+    if filepath_out is None:
+        filepath_out = dirpath_out / get_filename_out(filepath_in.name, extension=filepath_in.suffix)
 
-    for i, chunk in enumerate(df):
-        # write directly to the file if its the first chunk
-        if i == 0:
-            with open(filepath_out, "w", newline="\n") as f:
-                chunk.to_csv(f, index=False)
+    # Parquet is columnar: dropping columns only copies the column chunks we keep, nothing gets parsed
+    if is_parquet(filepath_in) and not packed:
+        select_columns(filepath_in, filepath_out, good_cols)
+        return
 
-        # append to it otherwise
-        else:
-            with open(filepath_out, "a", newline="\n") as f:
-                chunk.to_csv(f, index=False, header=False)
+    checkpoint = Checkpoint(filepath_out, [filepath_in], params={'columns': good_cols}, resume=resume,
+                            checkpointed=checkpointed)
+    with checkpoint.writer(filepath_out) as writer:
+        for chunk in checkpoint.chunks(filepath_in, columns=packed_columns(good_cols, bits) if packed else good_cols,
+                                       chunksize=chunksize):
+            if packed:
+                chunk = bits.from_frame(chunk, [x for x in good_cols if x in bits.bits])[good_cols]
+            writer.write(chunk)
 
 
-def main(json_cat):
+def main(json_cat, chunksize=10**6, resume=False, checkpointed=False):
     # Get the paths to the files we want
-    root = Path.cwd()
+    root = Path(__file__).resolve().parent
     data_in = root / "data" / "data_in"
     data_out = root / "data" / "data_out"
 
-    all_csv = get_csv_files(data_in)
+    all_csv = get_csv_files(data_in, extensions=(".csv", ".parquet"))
     bad_cols = get_bad_cols(json_cat)
 
     for csv_file in all_csv:
-        read_rewrite(data_in / csv_file, data_out, bad_cols)
+        read_rewrite(data_in / csv_file, data_out, bad_cols, chunksize=chunksize, resume=resume,
+                     checkpointed=checkpointed)
         print("{} Completed Writing\n".format(csv_file))
 
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunksize', type=int, default=10**6, help='Rows per chunk, smaller for wide files')
+    parser.add_argument('--resume', action='store_true', help='Carry on from the last checkpointed chunk')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='Checkpoint every chunk, so an interrupted run can be resumed.  Rows must not span lines')
+    args = parser.parse_args()
 
     with open(r"C:\Users\jc4673\Documents\Columbia\NETS\nets_clean\patches\supercategories.json", "r") as f:
         super_cat = json.load(f)
 
-    main(super_cat)
+    main(super_cat, chunksize=args.chunksize, resume=args.resume, checkpointed=args.checkpoint)
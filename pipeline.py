@@ -0,0 +1,413 @@
+import ast
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+import category_bits
+import checkpoint
+import classify_nets
+import clean_nets
+from patches import remove_main_hierarchy
+from patches.phase_3 import phase_3, sample_df
+
+
+#####################################################################################################
+# DAG runner for the NETS pipeline.  Each stage's outputs are cached under a key hashing the        #
+# contents of its input and config files, its parameters and the source of its code, so a rerun     #
+# skips every stage whose key is unchanged and restores its outputs from the cache with hardlinks.  #
+# Stages whose upstream stages are done run concurrently.                                           #
+#####################################################################################################
+
+
+def hash_bytes(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class FileHasher:
+    """Content hashes of files and folders, remembered by (size, mtime) in a JSON file so unchanged files of many
+    GB aren't read again on every run"""
+
+    def __init__(self, memo_path, block_size=1 << 24):
+        self.memo_path = Path(memo_path)
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.memo = {}
+        if self.memo_path.exists():
+            with open(self.memo_path, 'r') as f:
+                self.memo = json.load(f)
+
+    def hash_file(self, path):
+        stat = os.stat(path)
+        key = str(Path(path).resolve())
+        with self.lock:
+            known = self.memo.get(key)
+        if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(self.block_size), b''):
+                digest.update(block)
+
+        with self.lock:
+            self.memo[key] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def hash_path(self, path):
+        """Hash of a file, or of a folder's file names and contents"""
+        path = Path(path)
+        if not path.is_dir():
+            return self.hash_file(path)
+        files = sorted(x for x in path.rglob('*') if x.is_file())
+        return hash_bytes(json.dumps([[str(x.relative_to(path)), self.hash_file(x)] for x in files]).encode())
+
+    def save(self):
+        with self.lock:
+            tmp_path = self.memo_path.with_suffix('.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(self.memo, f)
+            os.replace(str(tmp_path), str(self.memo_path))
+
+
+def imported_files(modules):
+    """Source files of modules and of every repo module they import, directly or through each other
+
+    Imports are read from the source rather than from sys.modules, so imports inside functions count too.  Modules
+    installed outside the repo (pandas, pyarrow...) are left out.
+    """
+    root = Path(__file__).resolve().parent
+    pending = [Path(inspect.getsourcefile(x)).resolve() for x in modules]
+    found = set()
+    while pending:
+        path = pending.pop()
+        if path in found:
+            continue
+        found.add(path)
+        with open(str(path), 'r') as f:
+            tree = ast.parse(f.read(), filename=str(path))
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [x.name for x in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                try:
+                    spec = importlib.util.find_spec(name.split('.')[0])
+                except (ImportError, ValueError):
+                    spec = None
+                if spec is not None and spec.origin and spec.origin.endswith('.py'):
+                    origin = Path(spec.origin).resolve()
+                    if root in origin.parents:
+                        pending.append(origin)
+    return sorted(found)
+
+
+def link_or_copy(source, destination):
+    """Hardlink source to destination, replacing it, or copy where hardlinks aren't possible"""
+    destination = Path(destination)
+    os.makedirs(str(destination.parent), exist_ok=True)
+    if destination.exists():
+        os.remove(str(destination))
+    try:
+        os.link(str(source), str(destination))
+    except OSError:
+        shutil.copy2(str(source), str(destination))
+
+
+class Stage:
+    """One step of the pipeline: func(**params) reads inputs and configs and writes outputs"""
+
+    def __init__(self, name, func, inputs=(), outputs=(), configs=(), code=(), params=None, neutral=(), optional=()):
+        """
+        Keyword Arguments:
+            name: Unique name of the stage
+            func: Function running the stage
+            inputs: Files or folders the stage reads.  A stage writing one of them has to run first
+            outputs: Files the stage writes
+            configs: Config files the stage reads
+            code: Modules func calls into, such as clean_nets.  The repo modules they import are followed, and func
+                  itself counts by its own source rather than by the rest of the module it is defined in
+            params: Keyword arguments for func
+            neutral: Names of params the outputs don't depend on, such as workers, left out of the key
+            optional: Files the stage only writes some of the time, such as error reports.  They are cached when
+                      written, and restoring a run that didn't write them removes them
+        """
+        self.name = name
+        self.func = func
+        self.inputs = [Path(x) for x in inputs]
+        self.outputs = [Path(x) for x in outputs]
+        self.optional = [Path(x) for x in optional]
+        self.configs = [Path(x) for x in configs]
+        self.code = imported_files(code)
+        self.params = params or {}
+        self.neutral = set(neutral)
+
+    def key(self, hasher):
+        """Cache key of the stage with its current inputs, configs, code and parameters"""
+        parts = {
+            'name': self.name,
+            'params': json.dumps({k: v for k, v in self.params.items() if k not in self.neutral}, sort_keys=True,
+                                 default=str),
+            'inputs': [hasher.hash_path(x) for x in self.inputs],
+            'configs': [hasher.hash_path(x) for x in self.configs],
+            'func': hash_bytes(inspect.getsource(self.func).encode()),
+            'code': {x.name: hasher.hash_file(x) for x in self.code},
+            'outputs': [x.name for x in self.outputs],
+            'optional': [x.name for x in self.optional],
+        }
+        return hash_bytes(json.dumps(parts, sort_keys=True).encode())
+
+    def run(self):
+        self.func(**self.params)
+
+
+class Pipeline:
+    """Runs stages in dependency order, skipping the ones whose outputs are cached for their current key"""
+
+    def __init__(self, stages, cache_dir, workers=2):
+        """
+        Keyword Arguments:
+            stages: List of Stage
+            cache_dir: Folder of the content-addressed output cache, best on the same drive as the data for hardlinks
+            workers: Stages run at once
+        """
+        self.stages = {x.name: x for x in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError('Stage names have to be unique')
+
+        self.cache_dir = Path(cache_dir)
+        self.workers = workers
+        os.makedirs(str(self.cache_dir / 'objects'), exist_ok=True)
+        self.hasher = FileHasher(self.cache_dir / 'file_hashes.json')
+
+        producers = {}
+        for stage in stages:
+            for output in stage.outputs + stage.optional:
+                producers[output.resolve()] = stage.name
+        self.upstream = {}
+        for stage in stages:
+            self.upstream[stage.name] = sorted({producers[x] for x in producers for y in stage.inputs
+                                                if x == y.resolve() or y.resolve() in x.parents} - {stage.name})
+
+    def required(self, targets):
+        """Names of the targets and every stage they depend on"""
+        needed = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in needed:
+                needed.add(name)
+                pending += self.upstream[name]
+        return needed
+
+    def restore(self, stage, key):
+        """Put the cached outputs of stage for key in place, if they are all cached"""
+        entry = self.cache_dir / 'objects' / key
+        if not (entry / 'complete').exists():
+            return False
+        for i, output in enumerate(stage.outputs):
+            cached = entry / '{}_{}'.format(i, output.name)
+            if not output.exists() or not os.path.samefile(str(cached), str(output)):
+                link_or_copy(cached, output)
+        for i, output in enumerate(stage.optional, len(stage.outputs)):
+            cached = entry / '{}_{}'.format(i, output.name)
+            if cached.exists():
+                if not output.exists() or not os.path.samefile(str(cached), str(output)):
+                    link_or_copy(cached, output)
+            elif output.exists():
+                os.remove(str(output))
+        return True
+
+    def store(self, stage, key):
+        """Add the outputs of a finished stage to the cache under key"""
+        entry = self.cache_dir / 'objects' / key
+        tmp_entry = self.cache_dir / 'objects' / (key + '.tmp')
+        shutil.rmtree(str(tmp_entry), ignore_errors=True)
+        os.makedirs(str(tmp_entry))
+        for i, output in enumerate(stage.outputs):
+            if not output.exists():
+                raise FileNotFoundError('Stage {} did not write {}'.format(stage.name, output))
+            link_or_copy(output, tmp_entry / '{}_{}'.format(i, output.name))
+        for i, output in enumerate(stage.optional, len(stage.outputs)):
+            if output.exists():
+                link_or_copy(output, tmp_entry / '{}_{}'.format(i, output.name))
+        (tmp_entry / 'complete').touch()
+
+        shutil.rmtree(str(entry), ignore_errors=True)
+        os.replace(str(tmp_entry), str(entry))
+
+    def run_stage(self, name, force):
+        stage = self.stages[name]
+        key = stage.key(self.hasher)
+        if not force and self.restore(stage, key):
+            print('{}: unchanged, restored from cache'.format(name))
+            return 'cached'
+
+        print('{}: running'.format(name))
+        time1 = time.time()
+        # Outputs may be hardlinks into the cache, which writing them in place would corrupt
+        for output in stage.outputs + stage.optional:
+            if output.exists():
+                os.remove(str(output))
+        stage.run()
+        self.store(stage, key)
+        print('{}: done in {:.0f}s'.format(name, time.time() - time1))
+        return 'ran'
+
+    def run(self, targets=None, force=()):
+        """Run targets (default all stages) and what they depend on
+
+        Keyword Arguments:
+            targets: Names of the stages wanted
+            force: Names of stages to rerun even if cached
+
+        Returns:
+            dict of stage name to 'ran' or 'cached'
+        """
+        needed = self.required(targets or list(self.stages))
+        results = {}
+        running = {}
+        try:
+            with ThreadPoolExecutor(self.workers) as pool:
+                while len(results) < len(needed):
+                    for name in sorted(needed - set(results) - set(running.values())):
+                        if all(x in results for x in self.upstream[name]):
+                            running[pool.submit(self.run_stage, name, name in force)] = name
+
+                    done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results[running.pop(future)] = future.result()
+        finally:
+            self.hasher.save()
+        return results
+
+
+#####################################################################################################
+# The NETS stages, as in the README workflow.  recvd_net_vars.csv, the categories merged with the   #
+# GIS variables, comes from outside the pipeline and is an input of the phase_3 stage.               #
+#####################################################################################################
+
+
+def run_locations(add99, add00, write_path):
+    clean_nets.Cleaner().create_locations(add99, add00, write_path)
+
+
+def run_classification(sic, emp, sales, company, loc_path, config_file, write_path, workers, chunksize,
+                       store_dir=None):
+    inputs = classify_nets.classifier_inputs(sic, emp, sales, company, loc_path, chunksize=chunksize)
+    if store_dir is None:
+        classify_nets.classify_chunks(inputs, config_file, write_path, workers=workers)
+        return
+
+    # A config change only reclassifies the categories whose entries changed, new inputs rebuild the store
+    source = [checkpoint.fingerprint(x) for x in (sic, emp, sales, company, loc_path)]
+    classify_nets.update_categories(inputs, config_file, store_dir, write_path=write_path, source=source)
+
+
+def category_schema(bits_dir):
+    return category_bits.CategorySchema.from_config(bits_dir) if bits_dir is not None else None
+
+
+def run_phase_3(data_path, write_path, main_cats_path, hier_list_path, bits_dir=None):
+    phase_3.main(data_path, write_path, main_cats_path, hier_list_path, bits=category_schema(bits_dir))
+
+
+def run_remove_main_hierarchy(data_path, write_path, main_cats_path, bits_dir=None):
+    with open(main_cats_path, 'r') as f:
+        bad_cols = remove_main_hierarchy.get_bad_cols(json.load(f))
+    remove_main_hierarchy.read_rewrite(Path(data_path), Path(write_path).parent, bad_cols,
+                                       filepath_out=Path(write_path), bits=category_schema(bits_dir))
+
+
+def run_sample(data_path, write_path, k):
+    sample_df.random_sampler(data_path, write_path, k)
+
+
+def nets_stages(data_dir, config_dir, workers=os.cpu_count(), chunksize=10**6, sample_size=10**5, packed=False,
+                incremental=False):
+    """The NETS pipeline under data_dir (raw/, interim/ and processed/ folders), configured from config_dir
+
+    With packed, phase_3 writes the category columns bit-packed (see category_bits) and remove_main_hierarchy unpacks
+    them again.  With incremental, classification keeps its results in a CategoryStore and a config change only
+    reclassifies the categories whose entries changed, in a single process.
+    """
+    raw = Path(data_dir) / 'raw'
+    interim = Path(data_dir) / 'interim'
+    processed = Path(data_dir) / 'processed'
+    config_dir = Path(config_dir)
+
+    add99 = raw / 'NETS2014_AddressSpecial90to99.txt'
+    add00 = raw / 'NETS2014_AddressSpecial00to14.txt'
+    yearly = [raw / 'NETS2014_SIC.txt', raw / 'NETS2014_Emp.txt', raw / 'NETS2014_Sales.txt',
+              raw / 'NETS2014_Company.txt']
+    locations = interim / 'NETS2014_Locations.csv'
+    categories = interim / 'NETS2014_Categories.csv'
+    category_store = interim / 'NETS2014_Categories_store' if incremental else None
+    net_vars = processed / 'recvd_net_vars.csv'
+    net_vars_phase_3 = processed / 'recvd_net_vars_phase_3.csv'
+    net_vars_final = processed / 'recvd_net_vars_final.csv'
+    sample = processed / 'recvd_net_vars_final_sample.csv'
+
+    config_file = config_dir / 'json_config_2018_08_08.json'
+    main_cats = config_dir / 'main_categories.json'
+    hier_list = config_dir / 'hierarchy_list.txt'
+    bits_dir = config_dir if packed else None
+    bits_configs = [config_dir / x for x in category_bits.CONFIG_FILES] if packed else []
+
+    return [
+        Stage('locations', run_locations, inputs=[add99, add00], outputs=[locations],
+              optional=clean_nets.ErrorReport.paths(locations), code=[clean_nets],
+              params=dict(add99=add99, add00=add00, write_path=locations)),
+        Stage('classification', run_classification, inputs=yearly + [locations], outputs=[categories],
+              configs=[config_file], code=[classify_nets], neutral=['workers', 'store_dir'],
+              params=dict(sic=yearly[0], emp=yearly[1], sales=yearly[2], company=yearly[3], loc_path=locations,
+                          config_file=config_file, write_path=categories, workers=workers, chunksize=chunksize,
+                          store_dir=category_store)),
+        Stage('phase_3', run_phase_3, inputs=[net_vars], outputs=[net_vars_phase_3],
+              configs=[main_cats, hier_list] + bits_configs, code=[phase_3],
+              params=dict(data_path=net_vars, write_path=net_vars_phase_3, main_cats_path=main_cats,
+                          hier_list_path=hier_list, bits_dir=bits_dir)),
+        Stage('remove_main_hierarchy', run_remove_main_hierarchy, inputs=[net_vars_phase_3],
+              outputs=[net_vars_final], configs=[main_cats] + bits_configs, code=[remove_main_hierarchy],
+              params=dict(data_path=net_vars_phase_3, write_path=net_vars_final, main_cats_path=main_cats,
+                          bits_dir=bits_dir)),
+        Stage('sample', run_sample, inputs=[net_vars_final], outputs=[sample], code=[sample_df],
+              params=dict(data_path=net_vars_final, write_path=sample, k=sample_size)),
+    ]
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run the NETS pipeline, skipping stages whose inputs are unchanged')
+    parser.add_argument('data_dir', help='Root data folder, with raw/, interim/ and processed/ folders')
+    parser.add_argument('targets', nargs='*', help='Stages to run along with what they depend on, all by default')
+    parser.add_argument('--config-dir', default=str(Path(__file__).resolve().parent / 'config'))
+    parser.add_argument('--cache-dir', help='Stage output cache, data_dir/cache by default')
+    parser.add_argument('--stages-at-once', type=int, default=2, help='Independent stages run concurrently')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Classification processes')
+    parser.add_argument('--force', nargs='*', default=[], help='Stages to rerun even if unchanged')
+    parser.add_argument('--packed', action='store_true', help='Keep the phase_3 category columns bit-packed')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only reclassify the categories whose config entries changed')
+    args = parser.parse_args()
+
+    stages = nets_stages(args.data_dir, args.config_dir, workers=args.workers, packed=args.packed,
+                         incremental=args.incremental)
+    pipeline = Pipeline(stages, args.cache_dir or Path(args.data_dir) / 'cache', workers=args.stages_at_once)
+    for name, result in pipeline.run(args.targets, force=args.force).items():
+        print('{}: {}'.format(name, result))
+
+if __name__ == "__main__":
+    time1 = time.time()
+    main()
+    print(time.time() - time1)
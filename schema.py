@@ -0,0 +1,131 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+#####################################################################################################
+# Central dtype registry.  Readers ask it for the dtypes of the columns they read and writers cast   #
+# to it, so every stage holds the same compact types instead of whatever inference gives: 64 bit    #
+# dummies, float64 counts and object strings.  Columns it doesn't know are left to inference.        #
+#####################################################################################################
+
+
+# Arrow-backed strings when pyarrow is installed
+STRING = pd.StringDtype('pyarrow') if pa is not None else object
+
+# Exact column names
+COLUMNS = {
+    'DunsNumber': 'uint32',
+    'BEH_ID': 'int64',
+    'BEH_LOC': 'int16',
+    'FirstYear': 'int16',
+    'LastYear': 'int16',
+    'Year': 'int16',
+    'Backfilled': 'int8',
+}
+
+# Column name patterns, such as the yearly raw columns (State99) and the category dummies (adr_net_piz_c_2014)
+PATTERNS = [
+    (re.compile(r'^adr_net_\w+_c_\d{4}$'), 'int8'),
+    (re.compile(r'^(State|CityCode|CITYCODE|FipsCounty)(\d{2}|\d{4})?$'), 'category'),
+    (re.compile(r'^(Address|City|Company|TradeName|Loc_name)(\d{2}|\d{4})?$'), STRING),
+    (re.compile(r'^Emp(\d{2}|\d{4})?$'), 'float32'),
+    # Bit-packed category flags, see category_bits
+    (re.compile(r'^cat_bits_\d+$'), 'uint64'),
+]
+
+# Columns that are always filled in, so they can be parsed straight into a numpy integer dtype
+NEVER_NULL = re.compile(r'^(DunsNumber|BEH_ID|BEH_LOC|FirstYear|LastYear|Year|cat_bits_\d+)$')
+
+# Category dummies, only made int8 if they hold nothing but 0 and 1.  Area-level files can keep counts in them, and
+# blanks.  They are parsed as nullable int32, half the width of the int64 inference gives and wide enough for any count
+FLAGS = re.compile(r'^adr_net_\w+_c_\d{4}$')
+FLAGS_READ = 'Int32'
+
+
+def dtype_of(column):
+    """The registered dtype of column, or None"""
+    if column in COLUMNS:
+        return COLUMNS[column]
+    for pattern, dtype in PATTERNS:
+        if pattern.match(column):
+            return dtype
+    return None
+
+
+def is_integer(dtype):
+    return isinstance(dtype, str) and dtype != 'category' and np.dtype(dtype).kind in 'iu'
+
+
+def read_dtypes(columns):
+    """dtype argument for pd.read_csv covering the registered columns among columns
+
+    Integer columns that are never null are parsed as int64, as pandas wraps values that don't fit a narrower type
+    instead of raising.  cast() narrows them after checking they fit.  uint64 columns are parsed as registered, there
+    is nothing wider.  Category dummies are parsed as FLAGS_READ, which keeps blanks.  Other integer columns that may
+    hold nulls are left out, cast() handles those after reading too.
+    """
+    dtypes = {}
+    for col in columns:
+        dtype = dtype_of(col)
+        if FLAGS.match(col):
+            dtypes[col] = FLAGS_READ
+            continue
+        if dtype is None or (is_integer(dtype) and not NEVER_NULL.match(col)):
+            continue
+        dtypes[col] = 'int64' if is_integer(dtype) and dtype != 'uint64' else dtype
+    return dtypes
+
+
+def fits(values, dtype, column=''):
+    """True if the numbers in values can be stored as the integer dtype without changing any of them
+
+    Flag columns (see FLAGS) also have to hold only 0 and 1.
+    """
+    if values.dtype.kind not in 'iufb':
+        return True
+    present = values[~pd.isna(values)]
+    if len(present) == 0:
+        return True
+    if FLAGS.match(column):
+        return bool(np.isin(present, [0, 1]).all())
+    info = np.iinfo(dtype)
+    return bool((present == np.round(present)).all() and info.min <= present.min() and present.max() <= info.max)
+
+
+def cast(values, dtype, column=''):
+    """Cast a Series or Index to dtype
+
+    Integer dtypes become their nullable counterparts if values has nulls, and values that don't fit the integer dtype
+    (see fits) are returned unchanged rather than wrapped around.  Numeric values only become categorical after being
+    made integers where they all are, so that codes are written as 61 rather than 61.0.
+    """
+    if dtype == 'category':
+        if values.dtype.kind == 'f' and np.all(np.mod(values.dropna(), 1) == 0):
+            values = values.astype('Int64')
+        return values.astype('category')
+    if is_integer(dtype) and not fits(values, dtype, column):
+        return values
+    if is_integer(dtype) and values.isna().any():
+        return values.astype(dtype.capitalize().replace('Uint', 'UInt'))
+    return values.astype(dtype)
+
+
+def apply_schema(df):
+    """Cast the registered columns and index of df to their registered dtypes, in place"""
+    for col in df.columns:
+        dtype = dtype_of(str(col))
+        if dtype is not None and df[col].dtype != dtype:
+            df[col] = cast(df[col], dtype, str(col))
+
+    if df.index.nlevels == 1:
+        dtype = dtype_of(str(df.index.name))
+        if dtype is not None and df.index.dtype != dtype:
+            df.index = cast(df.index, dtype, str(df.index.name))
+    return df
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+
+#####################################################################################################
+# Per-BEH_ID values from the yearly NETS files.  Each spell (a BEH_ID's FirstYear..LastYear) is a     #
+# window over the 25 SICyy/Empyy/Salesyy columns of its DunsNumber, and is reduced to one value,     #
+# such as BEH_SIC, with masked operations over a whole chunk of spells at once.                      #
+#####################################################################################################
+
+
+YEARS = np.arange(1990, 2015)
+
+# Output column and default reduction for each yearly stub
+SPELL_VALUES = {'SIC': ('BEH_SIC', 'mode'), 'Emp': ('Emp', 'last'), 'Sales': ('Sales', 'last')}
+
+
+def year_columns(stub, years=YEARS):
+    """Raw column names of a yearly stub, such as SIC90 ... SIC14"""
+    return [stub + str(x)[-2:] for x in years]
+
+
+def spell_window(firstyear, lastyear, years=YEARS):
+    """(n_spells, n_years) boolean mask of the years each spell covers"""
+    firstyear = np.asarray(firstyear, dtype='int64')[:, None]
+    lastyear = np.asarray(lastyear, dtype='int64')[:, None]
+    return (years >= firstyear) & (years <= lastyear)
+
+
+def spell_mode(values, valid):
+    """Most common valid value of each row, ties going to the value seen in the most recent year"""
+    # counts[i, j]: how many valid years of row i share year j's value
+    counts = ((values[:, :, None] == values[:, None, :]) & valid[:, None, :]).sum(axis=2)
+    score = np.where(valid, counts * values.shape[1] + np.arange(values.shape[1]), -1)
+    best = score.argmax(axis=1)
+    return np.where(valid.any(axis=1), values[np.arange(len(values)), best], np.nan)
+
+
+def spell_last(values, valid):
+    """Valid value of each row in its most recent year"""
+    last = values.shape[1] - 1 - valid[:, ::-1].argmax(axis=1)
+    return np.where(valid.any(axis=1), values[np.arange(len(values)), last], np.nan)
+
+
+def spell_max(values, valid):
+    """Largest valid value of each row"""
+    return np.where(valid.any(axis=1), np.where(valid, values, -np.inf).max(axis=1), np.nan)
+
+
+REDUCTIONS = {'mode': spell_mode, 'last': spell_last, 'max': spell_max}
+
+
+def reduce_spells(values, firstyear, lastyear, how, years=YEARS, batch_size=10**5):
+    """Reduce each row of values (n_spells, n_years) over the years of its spell, ignoring NaN
+
+    Keyword Arguments:
+        values: float array with one row per spell and one column per year
+        firstyear, lastyear: Spell bounds, spells with no valid years in their window get NaN
+        how: 'mode', 'last' or 'max'
+        years: The years of the columns of values
+        batch_size: Rows reduced at a time, as mode compares every pair of years in a row
+    """
+    reduce = REDUCTIONS[how]
+    result = np.empty(len(values), dtype='float64')
+    for start in range(0, len(values), batch_size):
+        stop = start + batch_size
+        block = values[start:stop]
+        valid = spell_window(firstyear[start:stop], lastyear[start:stop], years) & ~np.isnan(block)
+        result[start:stop] = reduce(block, valid)
+    return result
+
+
+def aggregate_spells(spells, wide, how=None, years=YEARS):
+    """Per-BEH_ID values of the yearly columns of wide, such as BEH_SIC, Emp and Sales
+
+    Keyword Arguments:
+        spells: DataFrame indexed by BEH_ID with DunsNumber, FirstYear and LastYear columns
+        wide: DataFrame indexed by DunsNumber with raw yearly columns (SIC90 ... Sales14).  Businesses missing from it
+            get NaN
+        how: Optional dict of stub to reduction overriding SPELL_VALUES, such as {'Emp': 'max'}
+        years: Years of the raw columns
+
+    Returns:
+        DataFrame indexed like spells, with one column for each stub of SPELL_VALUES present in wide
+    """
+    how = dict({stub: reduction for stub, (_, reduction) in SPELL_VALUES.items()}, **(how or {}))
+    rows = wide.index.get_indexer(spells['DunsNumber'])
+    firstyear = spells['FirstYear'].to_numpy()
+    lastyear = spells['LastYear'].to_numpy()
+
+    result = pd.DataFrame(index=spells.index)
+    for stub, (name, _) in SPELL_VALUES.items():
+        columns = year_columns(stub, years)
+        if not any(x in wide.columns for x in columns):
+            continue
+
+        # One extra all-NaN row for businesses missing from wide
+        block = wide.reindex(columns=columns).to_numpy(dtype='float64')
+        block = np.vstack([block, np.full((1, len(columns)), np.nan)])
+        result[name] = reduce_spells(block[rows], firstyear, lastyear, how[stub], years)
+
+    return result
@@ -0,0 +1,286 @@
+import hashlib
+import json
+import os
+import pickle
+import queue
+import tempfile
+import threading
+
+import pandas as pd
+
+
+#####################################################################################################
+# Streaming, key-aligned joins of chunked readers.  Every stream is a sequence of DataFrame chunks   #
+# sorted on their index (DunsNumber).  Rows are released batch by batch once every stream has read  #
+# past their key, so memory stays bounded by a few chunks per stream whatever the file sizes are.   #
+#####################################################################################################
+
+
+class UnsortedInputError(ValueError):
+    pass
+
+
+def check_sorted(chunks):
+    """True if the index of a stream of chunks never decreases, reading the whole stream"""
+    last = None
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        if not chunk.index.is_monotonic_increasing or (last is not None and chunk.index[0] < last):
+            return False
+        last = chunk.index[-1]
+    return True
+
+
+def marker_path(filepath, marker_dir):
+    """Marker of filepath in marker_dir, named after the file and a hash of its full path"""
+    path = os.path.abspath(str(filepath))
+    digest = hashlib.blake2b(path.encode('utf-8'), digest_size=4).hexdigest()
+    return os.path.join(str(marker_dir), '{}.{}.sorted.json'.format(os.path.basename(path), digest))
+
+
+def read_marker(filepath, marker_dir):
+    """Whether filepath is sorted, from the marker an earlier run left in marker_dir, or None if there's no such
+    marker or the file changed since"""
+    try:
+        with open(marker_path(filepath, marker_dir), 'r') as f:
+            marker = json.load(f)
+        stat = os.stat(filepath)
+    except (OSError, ValueError):
+        return None
+    if [marker.get('size'), marker.get('mtime_ns')] != [stat.st_size, stat.st_mtime_ns]:
+        return None
+    return marker.get('sorted')
+
+
+def write_marker(filepath, is_sorted, marker_dir):
+    """Record in marker_dir whether filepath is sorted, so later runs needn't read it to find out"""
+    stat = os.stat(filepath)
+    try:
+        with open(marker_path(filepath, marker_dir), 'w') as f:
+            json.dump({'sorted': bool(is_sorted), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}, f)
+    except OSError:
+        # Read-only folder, the file is checked again next time
+        pass
+
+
+def input_sorted(keys, filepath=None, assume_sorted=None, marker_dir=None):
+    """Whether a stream is sorted on its index, taken from assume_sorted if given, then from the marker of filepath,
+    and only then found by reading keys, the same stream with only its index
+
+    Markers are only read and written with both filepath and marker_dir, the output or cache folder of the run.  They
+    never go next to the input, which may be a read-only raw data folder.
+    """
+    if assume_sorted is not None:
+        return assume_sorted
+    use_marker = filepath is not None and marker_dir is not None
+    is_sorted = read_marker(filepath, marker_dir) if use_marker else None
+    if is_sorted is None:
+        is_sorted = check_sorted(keys)
+        if use_marker:
+            write_marker(filepath, is_sorted, marker_dir)
+    return is_sorted
+
+
+def checked_sorted(chunks, filepath=None, key=None, marker_dir=None):
+    """chunks unchanged, raising UnsortedInputError as soon as they go backwards on key (their index by default)
+
+    filepath, if given, is the file the whole stream is read from.  With marker_dir its marker is updated with what
+    the stream showed.
+    """
+    use_marker = filepath is not None and marker_dir is not None
+    last = None
+    for chunk in chunks:
+        if len(chunk):
+            values = chunk.index if key is None else pd.Index(chunk[key])
+            if not values.is_monotonic_increasing or (last is not None and values[0] < last):
+                if use_marker:
+                    write_marker(filepath, False, marker_dir)
+                raise UnsortedInputError('{} is not sorted on {}, run again without assuming it is'.format(
+                    filepath or 'Input', key or values.name))
+            last = values[-1]
+        yield chunk
+    if use_marker:
+        write_marker(filepath, True, marker_dir)
+
+
+def watermark_batches(streams):
+    """Yield lists with one frame per stream, together covering a range of keys no later batch will see again
+
+    A key is only released once every unfinished stream has read a key greater than it, which keeps rows sharing a
+    key in the same batch even across chunk boundaries.  Raises UnsortedInputError if a stream goes backwards.
+    """
+    iters = [iter(x) for x in streams]
+    buffers = [None] * len(iters)
+    done = [False] * len(iters)
+    last = [None] * len(iters)
+
+    def read(i):
+        chunk = next(iters[i], None)
+        while chunk is not None and len(chunk) == 0:
+            chunk = next(iters[i], None)
+        if chunk is None:
+            done[i] = True
+            return
+        if not chunk.index.is_monotonic_increasing or (last[i] is not None and chunk.index[0] < last[i]):
+            raise UnsortedInputError('Stream {} is not sorted on its index'.format(i))
+        last[i] = chunk.index[-1]
+        buffers[i] = chunk if buffers[i] is None else pd.concat([buffers[i], chunk])
+
+    for i in range(len(iters)):
+        read(i)
+
+    while True:
+        open_streams = [i for i in range(len(iters)) if not done[i]]
+        if not open_streams:
+            if any(x is not None and len(x) for x in buffers):
+                yield buffers
+            return
+
+        watermark = min(last[i] for i in open_streams)
+        batch = []
+        for i, buffer in enumerate(buffers):
+            if buffer is None:
+                batch.append(None)
+                continue
+            cut = buffer.index.searchsorted(watermark, side='left')
+            batch.append(buffer.iloc[:cut])
+            buffers[i] = buffer.iloc[cut:]
+
+        if any(x is not None and len(x) for x in batch):
+            yield batch
+        else:
+            # Nothing below the watermark yet: advance the stream that's holding it back
+            read(min(open_streams, key=lambda i: last[i]))
+
+
+def merge_sorted(streams):
+    """Merge several sorted streams of chunks into one sorted stream"""
+    for batch in watermark_batches(streams):
+        frames = [x for x in batch if x is not None and len(x)]
+        yield pd.concat(frames).sort_index(kind='mergesort')
+
+
+def external_sort(chunks, tmp_dir=None, piece_size=10**4):
+    """Sort a stream of chunks on their index using bounded memory
+
+    Each chunk is sorted and spilled to a run file on disk, in pickled pieces of piece_size rows.  The runs are then
+    merged back, holding only a few pieces per run in memory at once.
+    """
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as run_dir:
+        run_paths = []
+        for i, chunk in enumerate(chunks):
+            run_paths.append(os.path.join(run_dir, 'run_{}.pkl'.format(i)))
+            chunk = chunk.sort_index(kind='mergesort')
+            with open(run_paths[-1], 'wb') as f:
+                for start in range(0, len(chunk), piece_size):
+                    pickle.dump(chunk.iloc[start:start + piece_size], f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        def read_run(run_path):
+            with open(run_path, 'rb') as f:
+                while True:
+                    try:
+                        yield pickle.load(f)
+                    except EOFError:
+                        return
+
+        for merged in merge_sorted([read_run(x) for x in run_paths]):
+            yield merged
+
+
+def aligned_chunks(*streams):
+    """Yield tuples holding one frame per stream, all covering the same range of index keys
+
+    Frames are empty for streams with no rows in that range.  Unlike zip() over chunked readers, this doesn't assume
+    the streams have the same rows in the same order, so a line skipped in only one file can't misalign the rest.
+    """
+    for batch in watermark_batches(streams):
+        yield tuple(x if x is not None else pd.DataFrame() for x in batch)
+
+
+class SortedChunks:
+    """Stream of chunks sorted on their index, see sorted_chunks
+
+    is_sorted is None until the first chunk is asked for, and then whether the input was taken as sorted, so a caller
+    can tell afterwards which inputs were read in their own order.
+    """
+
+    def __init__(self, chunks, keys, tmp_dir=None, filepath=None, assume_sorted=None):
+        self.chunks = chunks
+        self.keys = keys
+        self.tmp_dir = tmp_dir
+        self.filepath = filepath
+        self.assume_sorted = assume_sorted
+        self.is_sorted = None
+
+    def __iter__(self):
+        self.is_sorted = input_sorted(self.keys, self.filepath, self.assume_sorted, self.tmp_dir)
+        if self.is_sorted:
+            for chunk in checked_sorted(self.chunks, self.filepath, marker_dir=self.tmp_dir):
+                yield chunk
+        else:
+            for chunk in external_sort(self.chunks, self.tmp_dir):
+                yield chunk
+
+
+def sorted_chunks(chunks, keys, tmp_dir=None, filepath=None, assume_sorted=None):
+    """chunks unchanged if sorted on their index, otherwise externally sorted
+
+    Whether they are sorted is decided by input_sorted when the first chunk is asked for, so on the reading thread of
+    a prefetched stream rather than before any stream starts.  A stream taken as sorted is still checked as it's read.
+    -----------
+    Keyword Arguments:
+    chunks: Stream of DataFrame chunks
+    keys: The same stream read with only its index, read through only if sortedness isn't otherwise known
+    tmp_dir: Folder for the runs of external_sort and for the marker recording whether filepath is sorted, the output
+        or cache folder of the run rather than the input's
+    filepath: File the whole stream is read from
+    assume_sorted: True or False to skip finding out
+
+    Returns:
+        SortedChunks, whose is_sorted tells afterwards whether the stream was read in its own order
+    """
+    return SortedChunks(chunks, keys, tmp_dir, filepath, assume_sorted)
+
+
+def prefetch(chunks, depth=2):
+    """Read a stream of chunks on its own thread, keeping up to depth chunks ready ahead of the consumer
+
+    Parsing in pyarrow and pandas releases the GIL for much of the work, so several prefetched files are read
+    concurrently.  An exception in the reader is raised again in the consumer.
+    """
+    ready = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    finished = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                ready.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read():
+        try:
+            for chunk in chunks:
+                if not put(chunk):
+                    return
+        except BaseException as e:
+            put(e)
+            return
+        put(finished)
+
+    thread = threading.Thread(target=read, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = ready.get()
+            if item is finished:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import backfill_nets
+
+# Initialize setup outputs
+df_geo = None
+
+
+def make_geocoded(n_duns, seed=0):
+    """Synthetic geocoded spells, each business's oldest spells with the highest BEH_LOC, at random match levels"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for d in range(n_duns):
+        duns = 10**8 + d
+        year = 1990
+        for beh_loc in range(int(rng.integers(1, 6)) - 1, -1, -1):
+            rows.append((beh_loc * 10**9 + 10**10 + duns, duns, year, year + 1, 'A{}_{}'.format(d, beh_loc), 'CITY',
+                         10000 + beh_loc, rng.choice(backfill_nets.PRECISION + ['US_Unknown'])))
+            year += 2
+    return pd.DataFrame(rows, columns=['BEH_ID', 'DunsNumber', 'FirstYear', 'LastYear', 'Address', 'City', 'ZIP',
+                                       'Loc_name']).set_index('BEH_ID')
+
+
+def reference_backfill(df, min_level='US_StreetName'):
+    """Backfill one spell at a time: take the location of the first later spell of the business that is good"""
+    ranks = {x: len(backfill_nets.PRECISION) - i for i, x in enumerate(backfill_nets.PRECISION)}
+    good = df['Loc_name'].map(ranks).fillna(0) >= ranks[min_level]
+    df = df.sort_values(['DunsNumber', 'FirstYear']).copy()
+    df['Backfilled'] = 0
+    columns = ['Address', 'City', 'ZIP', 'Loc_name']
+    for _, group in df.groupby('DunsNumber'):
+        for i, beh_id in enumerate(group.index):
+            later = [x for x in group.index[i + 1:] if good[x]]
+            if not good[beh_id] and later:
+                df.loc[beh_id, columns] = df.loc[later[0], columns].to_numpy()
+                df.loc[beh_id, 'Backfilled'] = 1
+    return df
+
+
+def setup_module():
+    global df_geo
+    df_geo = make_geocoded(500)
+
+
+def test_next_good():
+    duns = np.array([1, 1, 1, 2, 2, 3])
+    good = np.array([False, True, False, False, False, True])
+    assert backfill_nets.next_good(duns, good).tolist() == [1, 1, -1, -1, -1, 5]
+
+
+def test_backfill_matches_reference():
+    filled = backfill_nets.backfill(df_geo.sample(frac=1, random_state=0))
+    reference = reference_backfill(df_geo)
+
+    assert filled.index.equals(reference.index)
+    assert filled.astype(str).equals(reference.astype(str))
+    assert 0 < filled['Backfilled'].sum() < len(filled)
+
+
+def test_group_batches():
+    chunks = [df_geo.iloc[i:i + 37] for i in range(0, len(df_geo), 37)]
+    batches = list(backfill_nets.group_batches(iter(chunks)))
+
+    assert pd.concat(batches).equals(df_geo)
+    duns = [set(x['DunsNumber']) for x in batches]
+    assert sum(len(x) for x in duns) == df_geo['DunsNumber'].nunique()
+
+
+def test_backfill_locations(tmp_path):
+    os.makedirs(str(tmp_path / 'in'))
+    df_geo.to_csv(tmp_path / 'in' / 'geocoded.csv')
+    df_geo.sample(frac=1, random_state=1).to_csv(tmp_path / 'in' / 'shuffled.csv')
+    reference = reference_backfill(df_geo)
+
+    for name in ['geocoded', 'shuffled']:
+        n_filled = backfill_nets.backfill_locations(tmp_path / 'in' / '{}.csv'.format(name),
+                                                    tmp_path / '{}_backfilled.csv'.format(name), chunksize=101)
+        written = pd.read_csv(tmp_path / '{}_backfilled.csv'.format(name), index_col='BEH_ID')
+
+        assert n_filled == reference['Backfilled'].sum()
+        assert written.sort_values(['DunsNumber', 'FirstYear']).astype(str).equals(reference.astype(str))
+
+    # Nothing is written next to the inputs
+    assert sorted(os.listdir(str(tmp_path / 'in'))) == ['geocoded.csv', 'shuffled.csv']
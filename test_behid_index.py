@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+from behid_index import BehidIndex, decode_behid, encode_behid
+
+# Initialize setup outputs
+df_loc = None
+
+
+def make_spells(n_duns, seed=0):
+    """Non-overlapping spells of each business, with gap years between some of them, in shuffled order"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for duns in rng.choice(10**8, n_duns, replace=False):
+        year = rng.integers(1990, 2000)
+        beh_loc = 0
+        while year <= 2014:
+            last = min(year + rng.integers(0, 6), 2014)
+            rows.append((duns, year, last, beh_loc))
+            year = last + 1 + rng.integers(0, 3)
+            beh_loc += 1
+    df = pd.DataFrame(rows, columns=['DunsNumber', 'FirstYear', 'LastYear', 'BEH_LOC'])
+    df['BEH_ID'] = encode_behid(df['DunsNumber'], df['BEH_LOC'])
+    return df.sample(frac=1, random_state=0)
+
+
+def setup_module():
+    global df_loc
+    df_loc = make_spells(300)
+
+
+def brute_force(duns, year):
+    spell = df_loc[(df_loc['DunsNumber'] == duns) & (df_loc['FirstYear'] <= year) & (df_loc['LastYear'] >= year)]
+    return int(spell['BEH_ID'].iloc[0]) if len(spell) else None
+
+
+def test_encode_decode():
+    duns, beh_loc = decode_behid(df_loc['BEH_ID'])
+    assert (duns == df_loc['DunsNumber'].to_numpy()).all()
+    assert (beh_loc == df_loc['BEH_LOC'].to_numpy()).all()
+    assert encode_behid([123], [2])[0] == 2 * 10**9 + 10**10 + 123
+
+
+def test_lookup_matches_brute_force():
+    index = BehidIndex.build(df_loc['DunsNumber'], df_loc['FirstYear'], df_loc['LastYear'], df_loc['BEH_ID'])
+    assert len(index) == len(df_loc)
+
+    # Years before, inside, between and after the spells, and businesses that aren't in the index
+    rng = np.random.default_rng(1)
+    duns = np.r_[rng.choice(df_loc['DunsNumber'].unique(), 2000), rng.integers(10**8, 2 * 10**8, 100)]
+    year = rng.integers(1985, 2020, len(duns))
+
+    expected = [brute_force(x, y) for x, y in zip(duns, year)]
+    assert index.lookup(duns, year, missing=-1).tolist() == [-1 if x is None else x for x in expected]
+    assert [index.get(x, y) for x, y in zip(duns[:50], year[:50])] == expected[:50]
+
+
+def test_saved_index(tmp_path):
+    df_loc.to_csv(tmp_path / 'locations.csv', index=False)
+    built = BehidIndex.from_file(tmp_path / 'locations.csv', index_dir=tmp_path / 'index', chunksize=100)
+    opened = BehidIndex.open(tmp_path / 'index')
+
+    assert isinstance(opened.key, np.memmap)
+    for name in ['key', 'lastyear', 'behid']:
+        assert (getattr(opened, name) == getattr(built, name)).all()
+    first = df_loc.iloc[0]
+    assert opened.get(first['DunsNumber'], first['FirstYear']) == first['BEH_ID']
+
+
+def test_empty_index():
+    index = BehidIndex.build([], [], [], [])
+    assert index.lookup([1, 2], [2000, 2001]).tolist() == [0, 0]
+    assert index.get(1, 2000) is None
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+import category_bits
+from patches import remove_main_hierarchy
+from patches.phase_3 import phase_3
+
+# Initialize setup outputs
+config_path = Path(__file__).resolve().parent / 'config'
+schema = None
+df_flags = None
+
+
+def setup_module():
+    global schema
+    schema = category_bits.CategorySchema.from_config(config_path)
+
+    # Random flags for every column of the schema, with a non-category column either side
+    global df_flags
+    rng = np.random.default_rng(0)
+    df_flags = pd.DataFrame((rng.random((500, len(schema.columns))) < 0.1).astype('uint8'), columns=schema.columns)
+    df_flags.insert(0, 'adr_net_behid_u_2014', np.arange(500, dtype='int64') + 10**10)
+    df_flags['z10_cen_uid_u_2010'] = rng.integers(0, 10**5, 500)
+
+
+def write_net_vars(filepath, n=1000):
+    """Synthetic recvd_net_vars file: BEH_ID, the hierarchy list's aux flags and an area column"""
+    rng = np.random.default_rng(1)
+    hier_list = phase_3.load_hierarchy_list(config_path / 'hierarchy_list.txt')
+    df = pd.DataFrame((rng.random((n, len(hier_list))) < 0.05).astype(int), columns=hier_list)
+    df.insert(0, 'adr_net_behid_u_2014', np.arange(n, dtype='int64') + 10**10)
+    df['z10_cen_uid_u_2010'] = rng.integers(0, 10**5, n)
+    df.to_csv(filepath, index=False)
+
+
+def test_schema():
+    assert schema.n_words == -(-len(schema.columns) // 64)
+    assert len(set(schema.columns)) == len(schema.columns)
+
+
+def test_pack_round_trip():
+    words = schema.pack(df_flags)
+    assert words.shape == (500, schema.n_words)
+    assert (schema.unpack(words).values == df_flags[schema.columns].values).all()
+
+
+def test_frame_round_trip():
+    packed = schema.to_frame(df_flags)
+    assert packed.columns.tolist() == ['adr_net_behid_u_2014', 'z10_cen_uid_u_2010'] + schema.word_names
+
+    unpacked = schema.from_frame(packed)
+    assert (unpacked[df_flags.columns].values == df_flags.values).all()
+
+
+def test_any_all_of():
+    words = schema.pack(df_flags)
+    columns = schema.columns[60:70]
+    assert (schema.any_of(words, columns) == df_flags[columns].any(axis=1)).all()
+    assert (schema.all_of(words, columns[:2]) == df_flags[columns[:2]].all(axis=1)).all()
+
+
+def test_save_load_bits(tmp_path):
+    words = schema.pack(df_flags)
+    category_bits.save_bits(tmp_path / 'bits.npz', df_flags['adr_net_behid_u_2014'], words, schema)
+
+    index, loaded = category_bits.load_bits(tmp_path / 'bits.npz', schema)
+    assert (index == df_flags['adr_net_behid_u_2014'].values).all()
+    assert (loaded == words).all()
+
+
+def test_phase_3_packed(tmp_path):
+    write_net_vars(tmp_path / 'net_vars.csv')
+    main_cats_path = config_path / 'main_categories.json'
+    hier_list_path = config_path / 'hierarchy_list.txt'
+
+    phase_3.main(tmp_path / 'net_vars.csv', tmp_path / 'plain.csv', main_cats_path, hier_list_path, chunksize=300)
+    phase_3.main(tmp_path / 'net_vars.csv', tmp_path / 'packed.csv', main_cats_path, hier_list_path, chunksize=300,
+                 bits=schema)
+    plain = pd.read_csv(tmp_path / 'plain.csv')
+    packed = pd.read_csv(tmp_path / 'packed.csv')
+
+    assert [x for x in packed.columns if x in schema.bits] == []
+    assert (schema.from_frame(packed)[plain.columns].values == plain.values).all()
+
+    # The packed file reads back the same as the plain one in remove_main_hierarchy
+    bad_cols = ['wrah_c_', 'wrah_d_']
+    remove_main_hierarchy.read_rewrite(tmp_path / 'plain.csv', tmp_path, bad_cols,
+                                       filepath_out=tmp_path / 'final_plain.csv')
+    remove_main_hierarchy.read_rewrite(tmp_path / 'packed.csv', tmp_path, bad_cols,
+                                       filepath_out=tmp_path / 'final_packed.csv', bits=schema)
+    final_plain = pd.read_csv(tmp_path / 'final_plain.csv')
+    final_packed = pd.read_csv(tmp_path / 'final_packed.csv')
+
+    assert 'adr_net_wrah_c_2014' not in final_packed.columns
+    assert sorted(final_packed.columns) == sorted(final_plain.columns)
+    assert (final_packed[final_plain.columns].values == final_plain.values).all()
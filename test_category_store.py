@@ -0,0 +1,133 @@
+import json
+
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+import category_store
+import classify_nets
+
+# Initialize setup outputs
+config_path = Path(__file__).resolve().parent / 'config'
+config = None
+main_cats = None
+hier_list = None
+chunks = None
+
+
+def make_chunks(n, chunksize, seed=0):
+    """Classifier input around the configured SIC codes and names, in chunks"""
+    rng = np.random.default_rng(seed)
+    sics = sorted({x for cat in config.values() for key in ('sic_exclusive', 'sic_range') for x in cat.get(key, [])})
+    names = np.array(['PIZZA HUT', 'DAIRY QUEEN', 'KRISPY KREME', 'ACME CORP', 'JOES BAR', None], dtype=object)
+    df = pd.DataFrame({'BEH_SIC': rng.choice(sics, n) + rng.integers(-1, 2, n),
+                       'Company': rng.choice(names, n),
+                       'TradeName': rng.choice(names, n),
+                       'Emp': rng.choice([np.nan, 1, 10, 100, 300], n),
+                       'Sales': rng.choice([np.nan, 100, 5000000], n)},
+                      index=pd.Index(rng.permutation(n).astype('int64') + 10**10, name='BEH_ID'))
+    return [df.iloc[i:i + chunksize] for i in range(0, n, chunksize)]
+
+
+def write_config(filepath, changes=None):
+    """The config with some categories' entries replaced"""
+    with open(filepath, 'w') as f:
+        json.dump(dict(config, **(changes or {})), f)
+
+
+def write_merged(filepath):
+    """Merged file holding the aux categories that aren't classified from the config, such as the TDLINX ones"""
+    rng = np.random.default_rng(1)
+    external = sorted(set(hier_list) - set(config))
+    index = pd.concat(chunks).index
+    df = pd.DataFrame((rng.random((len(index), len(external))) < 0.05).astype(int), index=index,
+                      columns=['adr_net_{}_c_2014'.format(x.lower()) for x in external])
+    df.index.name = 'adr_net_behid_u_2014'
+    df.to_csv(filepath)
+
+
+def mtimes(store_dir):
+    return {x.name: x.stat().st_mtime_ns for x in Path(store_dir).glob('*.u1')}
+
+
+def setup_module():
+    global config
+    with open(config_path / 'json_config_2018_08_08.json', 'r') as f:
+        config = json.load(f)
+
+    # Both as codes, as the store keeps them
+    global main_cats
+    with open(config_path / 'main_categories.json', 'r') as f:
+        main_cats = json.load(f)
+
+    global hier_list
+    with open(config_path / 'hierarchy_list.txt', 'r') as f:
+        hier_list = [x.strip() for x in f if x.strip()]
+
+    global chunks
+    chunks = make_chunks(1200, 500)
+
+
+def test_export_matches_classify_chunks(tmp_path):
+    write_config(tmp_path / 'config.json')
+    changed = classify_nets.update_categories(iter(chunks), tmp_path / 'config.json', tmp_path / 'store',
+                                              write_path=tmp_path / 'exported.csv')
+    classify_nets.classify_chunks(iter(chunks), tmp_path / 'config.json', tmp_path / 'classified.csv')
+
+    assert changed == list(config)
+    with open(tmp_path / 'exported.csv', 'rb') as f1, open(tmp_path / 'classified.csv', 'rb') as f2:
+        assert f1.read() == f2.read()
+
+
+def test_config_change_recomputes_one_category(tmp_path):
+    write_config(tmp_path / 'config.json')
+    write_merged(tmp_path / 'merged.csv')
+    store_dir = tmp_path / 'store'
+
+    def update(rows):
+        return classify_nets.update_categories(rows, tmp_path / 'config.json', store_dir, main_cats=main_cats,
+                                               hier_list=hier_list, merged_path=tmp_path / 'merged.csv',
+                                               write_path=tmp_path / 'exported.csv')
+
+    update(iter(chunks))
+    before = mtimes(store_dir)
+    # Nothing changed, so the inputs aren't even read
+    assert update(iter([])) == []
+
+    pizza = dict(config['PIZ'], sic_exclusive=config['PIZ']['sic_exclusive'][:1])
+    write_config(tmp_path / 'config.json', {'PIZ': pizza})
+    changed = update(iter(chunks))
+
+    # PIZ, the hierarchy columns from PIZ on, NOT, the main categories PIZ is in and the main hierarchy categories
+    # of any of those hierarchy columns
+    after_piz = hier_list[hier_list.index('PIZ'):]
+    mains = [x for x, subs in main_cats.items() if 'PIZ' in subs]
+    mains_hier = [x + 'h' for x, subs in main_cats.items() if set(subs) & set(after_piz)]
+    assert changed[0] == 'PIZ'
+    assert sorted(changed) == sorted(['PIZ', 'NOT'] + [x + 'h' for x in after_piz] + mains + mains_hier)
+    # Nothing else was rewritten but the aux columns loaded from the merged file, which are on every run
+    after = mtimes(store_dir)
+    aux_codes = set(hier_list) | set(x for subs in main_cats.values() for x in subs)
+    assert sorted(x for x in before if before[x] != after[x]) == sorted(
+        x + '.u1' for x in set(changed) | (aux_codes - set(config)))
+
+    # The same as classifying from scratch with the new config
+    classify_nets.classify_chunks(iter(chunks), tmp_path / 'config.json', tmp_path / 'classified.csv')
+    with open(tmp_path / 'exported.csv', 'rb') as f1, open(tmp_path / 'classified.csv', 'rb') as f2:
+        assert f1.read() == f2.read()
+
+    # And the derived columns as derived from the new aux columns
+    store = category_store.CategoryStore(store_dir)
+    derived = category_store.derive_columns(store.frame(sorted(set(hier_list) | set(config))), main_cats, hier_list)
+    assert (store.frame(derived.columns).values == derived.values).all()
+
+
+def test_new_source_rebuilds(tmp_path):
+    write_config(tmp_path / 'config.json')
+    store_dir = tmp_path / 'store'
+    classify_nets.update_categories(iter(chunks), tmp_path / 'config.json', store_dir, source=['a'])
+
+    assert classify_nets.update_categories(iter([]), tmp_path / 'config.json', store_dir, source=['a']) == []
+    changed = classify_nets.update_categories(iter(chunks[::-1]), tmp_path / 'config.json', store_dir, source=['b'])
+    assert changed == list(config)
+    assert category_store.CategoryStore(store_dir).index()[0] == chunks[-1].index[0]
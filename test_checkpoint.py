@@ -0,0 +1,110 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import checkpoint
+
+# Initialize setup outputs
+df_input = None
+
+
+class Killed(Exception):
+    pass
+
+
+def rewrite(read_path, write_path, resume=False, checkpointed=False, kill_after=None, chunksize=50, factor=2):
+    """A chunk by chunk rewrite as the patch scripts do them, killed while writing chunk kill_after (from 0) if given
+
+    The killed chunk is only partly written, like a run stopped while the output was being flushed.
+    """
+    run = checkpoint.Checkpoint(write_path, [read_path], params={'factor': factor}, resume=resume,
+                                checkpointed=checkpointed)
+    writer = run.writer(write_path, index=False)
+    for i, chunk in enumerate(run.chunks(read_path, chunksize=chunksize)):
+        chunk = chunk.assign(value=chunk['value'] * factor)
+        if i == kill_after:
+            writer.write(chunk.iloc[:len(chunk) // 2])
+            raise Killed()
+        writer.write(chunk)
+    writer.close()
+
+
+def setup_module():
+    global df_input
+    rng = np.random.default_rng(0)
+    df_input = pd.DataFrame({'DunsNumber': np.sort(rng.integers(1, 300, 1000)), 'value': rng.integers(0, 10**6, 1000)})
+
+
+def write_input(filepath):
+    df_input.to_csv(filepath, index=False)
+
+
+def test_kill_and_resume(tmp_path):
+    write_input(tmp_path / 'in.csv')
+    rewrite(tmp_path / 'in.csv', tmp_path / 'full.csv')
+    # Without checkpointing there is no manifest at all
+    assert not os.path.exists('{}.checkpoint.json'.format(tmp_path / 'full.csv'))
+
+    for kill_after in [0, 3, 19]:
+        with pytest.raises(Killed):
+            rewrite(tmp_path / 'in.csv', tmp_path / 'out.csv', checkpointed=True, kill_after=kill_after)
+        manifest = checkpoint.Checkpoint(tmp_path / 'out.csv', [tmp_path / 'in.csv'], params={'factor': 2},
+                                         resume=True)
+        assert manifest.n_chunks == kill_after
+
+        rewrite(tmp_path / 'in.csv', tmp_path / 'out.csv', resume=True)
+        assert (tmp_path / 'out.csv').read_bytes() == (tmp_path / 'full.csv').read_bytes()
+        # The finished run leaves no manifest, so resuming it again starts over
+        assert not os.path.exists('{}.checkpoint.json'.format(tmp_path / 'out.csv'))
+
+    rewrite(tmp_path / 'in.csv', tmp_path / 'out.csv', resume=True)
+    assert (tmp_path / 'out.csv').read_bytes() == (tmp_path / 'full.csv').read_bytes()
+
+
+def test_resume_refuses_changes(tmp_path):
+    write_input(tmp_path / 'in.csv')
+    with pytest.raises(Killed):
+        rewrite(tmp_path / 'in.csv', tmp_path / 'out.csv', checkpointed=True, kill_after=2)
+
+    with pytest.raises(ValueError):
+        rewrite(tmp_path / 'in.csv', tmp_path / 'out.csv', resume=True, factor=3)
+
+    # An output cut shorter than what the manifest says was written
+    with open(tmp_path / 'out.csv', 'r+b') as f:
+        f.truncate(10)
+    with pytest.raises(ValueError):
+        rewrite(tmp_path / 'in.csv', tmp_path / 'out.csv', resume=True)
+
+    df_input.iloc[:-1].to_csv(tmp_path / 'in.csv', index=False)
+    with pytest.raises(ValueError):
+        rewrite(tmp_path / 'in.csv', tmp_path / 'out.csv', resume=True)
+
+
+def test_parquet_not_checkpointed(tmp_path):
+    write_input(tmp_path / 'in.csv')
+    with pytest.raises(ValueError):
+        checkpoint.Checkpoint(tmp_path / 'out.parquet', [tmp_path / 'in.csv'], checkpointed=True)
+    assert not checkpoint.Checkpoint(tmp_path / 'out.parquet', [tmp_path / 'in.csv']).enabled
+
+
+def test_seek_key(tmp_path):
+    # Tab separated and sorted on DunsNumber, with repeated keys, padded fields and a line too short to read
+    lines = ['Company\tDunsNumber\tCity']
+    for duns in [3, 3, 5, 8, 8, 8, 12, 20]:
+        lines.append('ACME\t {} \tSPRINGFIELD'.format(duns))
+    lines.insert(5, 'BROKEN')
+    filepath = tmp_path / 'raw.txt'
+    filepath.write_bytes(('\r\n'.join(lines) + '\r\n').encode('Windows-1252'))
+
+    data = filepath.read_bytes()
+    starts = [i + 1 for i, x in enumerate(data) if x == ord('\n')]
+    keys = [int(x.split('\t')[1]) if '\t' in x else None for x in lines[1:]]
+    for key in [0, 3, 4, 5, 8, 11, 12, 20, 99]:
+        offset = checkpoint.seek_key(filepath, key)
+        # Every line before the offset has a key up to key, and every line from it on a greater one
+        assert offset in starts
+        first = starts.index(offset)
+        assert all(x is None or x <= key for x in keys[:first])
+        assert all(x is None or x > key for x in keys[first:])
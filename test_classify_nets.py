@@ -0,0 +1,217 @@
+import json
+import re
+
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+import classify_nets
+from name_match import LiteralPrefilter, NameVocabulary
+from spell_values import aggregate_spells, year_columns
+
+# Initialize setup outputs
+config_file = Path(__file__).resolve().parent / 'config' / 'json_config_2018_08_08.json'
+config = None
+df_input = None
+df_output = None
+
+
+def make_inputs(n, seed=0):
+    """Synthetic classifier input: SICs around the configured codes and ranges, names built from the configured name
+    regexes, and employee and sales counts around the configured cutoffs"""
+    rng = np.random.default_rng(seed)
+    sics = sorted({x for cat in config.values() for key in ('sic_exclusive', 'sic_exclusive_2', 'sic_range',
+                                                             'sic_range_2') for x in cat.get(key, [])})
+    patterns = sorted({x for cat in config.values() for x in cat.get('name', [])})
+    names = [re.sub(r'[\\^$.|?*+()\[\]{}]', '', x) for x in rng.choice(patterns, 200)]
+    names = np.array(names + ['ACME CORP', 'JOES BAR & GRILL', 'THE PIZZA PLACE', None], dtype=object)
+
+    return pd.DataFrame({'BEH_SIC': rng.choice(sics, n) + rng.integers(-2, 3, n),
+                         'Company': rng.choice(names, n),
+                         'TradeName': rng.choice(np.r_[names, ['', '  ']], n),
+                         'Emp': rng.choice([np.nan, 1, 4, 5, 10, 24, 25, 26, 100, 249, 250, 300], n),
+                         'Sales': rng.choice([np.nan, 100, 1999999, 2000000, 5000000], n)},
+                        index=pd.Index(np.arange(n, dtype='int64') + 10**10, name='BEH_ID'))
+
+
+def setup_module():
+    global config
+    with open(config_file, 'r') as f:
+        config = json.load(f)
+
+    global df_input
+    df_input = make_inputs(3000)
+
+    global df_output
+    df_output = classify_nets.CompiledClassifier(config_file).classify(df_input.copy())
+
+
+def test_output_shape():
+    assert df_output.index.equals(df_input.index)
+    assert df_output.columns.tolist() == list(config)
+    assert df_output.values.sum() > 0
+
+
+def test_compiled_matches_classifier():
+    # The original per-category classifier, one pass over the frame for every category
+    classifier = classify_nets.Classifier(config_file, df_input.copy())
+    mismatches = [x for x in config if not (classifier.is_class_all(x).astype(int).values == df_output[x].values).all()]
+    assert mismatches == []
+
+
+def test_categories_subset():
+    some = list(config)[5:15]
+    subset = classify_nets.CompiledClassifier(config_file, categories=some).classify(df_input.copy())
+    assert subset.columns.tolist() == some
+    assert (subset.values == df_output[some].values).all()
+
+
+def test_prefilter_matches_regex():
+    names = [x for x in df_input['Company'].unique() if isinstance(x, str)]
+    names += ['MC DONALDS', 'THE BAR', 'BARBER SHOP', 'CAFE', 'café', 'PIZZA-HUT', '']
+    for cat in config.values():
+        if not cat.get('name'):
+            continue
+        prefilter = LiteralPrefilter(cat['name'])
+        regex = re.compile('|'.join(cat['name']))
+        assert [prefilter.search(x) for x in names] == [regex.search(x) is not None for x in names]
+
+
+def test_vocabulary_matches_regex():
+    pattern = '|'.join(config[list(config)[0]]['name'])
+    where = (df_input['BEH_SIC'] % 2 == 0).to_numpy()
+    truth = np.array([isinstance(x, str) and re.search(pattern, x) is not None for x in df_input['Company']])
+
+    vocabulary = NameVocabulary(df_input['Company'])
+    assert (vocabulary.match(pattern) == truth).all()
+    assert (vocabulary.match(pattern, where) == (truth & where)).all()
+
+
+def test_parallel_output_identical(tmp_path):
+    chunks = [df_input.iloc[i:i + 700] for i in range(0, len(df_input), 700)]
+    classify_nets.classify_chunks(iter(chunks), config_file, tmp_path / 'serial.csv', workers=1)
+    classify_nets.classify_chunks(iter(chunks), config_file, tmp_path / 'parallel.csv', workers=2, max_pending=2)
+
+    with open(tmp_path / 'serial.csv', 'rb') as f1, open(tmp_path / 'parallel.csv', 'rb') as f2:
+        assert f1.read() == f2.read()
+
+
+def test_make_BEHID_wide():
+    df_loc = pd.DataFrame({'BEH_ID': [10, 11, 20, 30], 'DunsNumber': [1, 1, 2, 3],
+                           'FirstYear': [1990, 1993, 1990, 1991], 'LastYear': [1992, 1994, 1994, 1994]})
+    wide = classify_nets.make_BEHID_wide(df_loc)
+
+    assert wide.index.tolist() == [1, 2, 3]
+    assert wide.columns.tolist() == [('BEH_ID', x) for x in range(1990, 1995)]
+    assert wide[('BEH_ID', 1993)].tolist() == [11, 20, 30]
+    # Only 1990 has a gap, so only it is float
+    assert wide[('BEH_ID', 1990)].dtype == 'float64' and np.isnan(wide[('BEH_ID', 1990)].iloc[2])
+    assert (wide.dtypes.iloc[1:] == 'int64').all()
+
+
+def make_normal(n, seed=0):
+    """Synthetic normalized spells, a few businesses with several each"""
+    rng = np.random.default_rng(seed)
+    first = rng.integers(1990, 2015, n)
+    return pd.DataFrame({'DunsNumber': np.sort(rng.integers(1, n // 3 + 2, n)), 'FirstYear': first,
+                         'LastYear': first + rng.integers(0, 25, n).clip(0, 2014 - first),
+                         'Address': rng.choice(['A', 'B', 'C'], n)},
+                        index=pd.Index(np.arange(n, dtype='int64') + 10**10, name='BEH_ID'))
+
+
+def test_normal_to_long():
+    df_normal = make_normal(200)
+    columns = df_normal.columns.tolist()
+    long = classify_nets.normal_to_long(df_normal, ['DunsNumber', 'Address'])
+
+    # One row for every year of every spell
+    expected = [(beh_id, year) for beh_id, first, last in zip(df_normal.index, df_normal['FirstYear'],
+                                                                df_normal['LastYear'])
+                for year in range(first, last + 1)]
+    assert long.index.tolist() == expected
+    assert (long['Address'].to_numpy() == df_normal['Address'].reindex(long.index.get_level_values(0)).to_numpy()).all()
+    # The input is left as it was
+    assert df_normal.columns.tolist() == columns
+
+
+def test_iter_normal_to_long():
+    df_normal = make_normal(200)
+    whole = classify_nets.normal_to_long(df_normal, ['DunsNumber'])
+    pieces = list(classify_nets.iter_normal_to_long(df_normal, ['DunsNumber'], batch_size=40))
+
+    assert pd.concat(pieces).equals(whole)
+    # No spell is split, and a piece only goes over batch_size when its one spell is longer
+    beh_ids = [set(x.index.get_level_values(0)) for x in pieces]
+    assert sum(len(x) for x in beh_ids) == len(df_normal)
+    assert all(len(x) <= 40 or len(y) == 1 for x, y in zip(pieces, beh_ids))
+
+    assert [len(x) for x in classify_nets.iter_normal_to_long(df_normal, ['DunsNumber'], batch_size=1)] == (
+        df_normal['LastYear'] - df_normal['FirstYear'] + 1).tolist()
+    assert list(classify_nets.iter_normal_to_long(df_normal.iloc[:0], ['DunsNumber'])) == []
+
+
+def test_sic_index():
+    rng = np.random.default_rng(2)
+    predicates = [('sic_range', ((100, 199), (150, 300))), ('sic_range', ((5000, 5000),)),
+                  ('sic_in', (120, 301, 5001)), ('sic_in', ())]
+    index = classify_nets.SicIndex(predicates + predicates[:1])
+    sic = np.r_[rng.integers(0, 6000, 2000), [99, 100, 199, 200, 300, 301, 5000, 5001]].astype('float64')
+    sic[:20] = np.nan
+    segments = index.segments(sic)
+
+    for kind, values in predicates:
+        pairs = values if kind == 'sic_range' else [(x, x) for x in values]
+        expected = np.zeros(len(sic), dtype=bool)
+        for lo, hi in pairs:
+            expected |= (sic >= lo) & (sic <= hi)
+        assert (index.mask((kind, values), segments) == expected).all()
+
+
+def write_raw_files(dirpath, n_duns, seed=0):
+    """Raw SIC, Emp, Sales and Company files, each missing a few businesses and the Emp one not sorted, and the
+    location spells of most businesses"""
+    rng = np.random.default_rng(seed)
+    duns = np.sort(rng.choice(10**7, n_duns, replace=False)) + 10**8
+    index = pd.Index(duns, name='DunsNumber')
+    raw = {}
+    for stub, high in [('SIC', 99999999), ('Emp', 50), ('Sales', 10**6)]:
+        values = rng.integers(1, high, (n_duns, 25)).astype('float64')
+        values[rng.random(values.shape) < 0.3] = np.nan
+        raw[stub] = pd.DataFrame(values, columns=year_columns(stub), index=index)
+    raw['Company'] = pd.DataFrame({'Company': [' CO {} '.format(x) for x in range(n_duns)],
+                                   'TradeName': ['TN{}'.format(x % 7) if x % 3 else None for x in range(n_duns)]},
+                                  index=index)
+    for stub, df in raw.items():
+        df = df[rng.random(n_duns) > 0.05]
+        if stub == 'Emp':
+            df = df.sample(frac=1, random_state=0)
+        df.to_csv(dirpath / '{}.txt'.format(stub), sep='\t')
+
+    rows = []
+    for x in duns[rng.random(n_duns) > 0.02]:
+        year, beh_loc = int(rng.integers(1990, 2010)), int(rng.integers(0, 3))
+        while beh_loc >= 0 and year <= 2014:
+            last = min(2014, year + int(rng.integers(0, 6)))
+            rows.append((beh_loc * 10**9 + 10**10 + x, x, year, last))
+            year, beh_loc = last + 1, beh_loc - 1
+    pd.DataFrame(rows, columns=['BEH_ID', 'DunsNumber', 'FirstYear', 'LastYear']).to_csv(dirpath / 'locations.csv',
+                                                                                        index=False)
+
+
+def test_classifier_inputs(tmp_path):
+    write_raw_files(tmp_path, 1000)
+    inputs = pd.concat(classify_nets.classifier_inputs(*[tmp_path / '{}.txt'.format(x) for x in
+                                                         ['SIC', 'Emp', 'Sales', 'Company']],
+                                                       tmp_path / 'locations.csv', chunksize=150))
+
+    # The same as reading every file whole and reducing the spells in one go
+    files = {x: pd.read_csv(tmp_path / '{}.txt'.format(x), sep='\t', index_col='DunsNumber')
+             for x in ['SIC', 'Emp', 'Sales', 'Company']}
+    spells = pd.read_csv(tmp_path / 'locations.csv', index_col='BEH_ID')
+    values = aggregate_spells(spells, pd.concat([files['SIC'], files['Emp'], files['Sales']], axis=1))
+    names = files['Company'].reindex(spells['DunsNumber']).apply(lambda x: x.str.strip())
+    names.index = spells.index
+    expected = pd.concat([names, values], axis=1)
+
+    assert inputs.index.is_unique and len(inputs) == len(expected)
+    assert inputs.loc[expected.index].astype(str).equals(expected.astype(str))
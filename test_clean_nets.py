@@ -0,0 +1,228 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import clean_nets
+
+# Initialize setup outputs
+cleaner = None
+df_long = None
+
+
+def make_long(n_duns, seed=0):
+    """Synthetic long location data: businesses moving between a few addresses, with gap years and missing values"""
+    rng = np.random.default_rng(seed)
+    locations = [('{} MAIN ST'.format(k), 'CITY{}'.format(k % 2), 10000 + k, np.nan if k == 3 else 61.0)
+                 for k in range(4)]
+    rows = []
+    for d in range(n_duns):
+        first = rng.integers(1990, 2014)
+        location = 0
+        for year in range(first, rng.integers(first, 2015) + 1):
+            if rng.random() < 0.15:
+                location = rng.integers(0, 4)
+            if rng.random() < 0.03:
+                continue
+            rows.append((10**6 + 7 * d, year) + locations[location])
+    df = pd.DataFrame(rows, columns=['DunsNumber', 'Year', 'Address', 'City', 'ZIP', 'FipsCounty'])
+    return df.set_index(['DunsNumber', 'Year']).sort_index()
+
+
+def reference_normalize(loc_df):
+    """Spells found one business at a time: a spell starts at the first year of each distinct location, and runs to
+    the year before the next one if the business's locations changed, to its final year otherwise"""
+    rows = []
+    for duns, group in loc_df.groupby(level=0):
+        years = group.index.get_level_values(1)
+        changed = group.nunique().sum() / group.shape[1] > 1
+        firsts = []
+        for year, row in zip(years, group.astype(object).where(group.notna(), None).itertuples(index=False)):
+            if row not in [x[1] for x in firsts]:
+                firsts.append((year, row))
+        for k, (year, row) in enumerate(firsts):
+            last_year = firsts[k + 1][0] - 1 if changed and k + 1 < len(firsts) else years[-1]
+            rows.append((duns, year, last_year) + tuple(row) + (len(firsts) - 1 - k,))
+
+    columns = ['DunsNumber', 'FirstYear', 'LastYear'] + loc_df.columns.tolist() + ['BEH_LOC']
+    return pd.DataFrame(rows, columns=columns).set_index(['DunsNumber', 'FirstYear'])
+
+
+def same_values(a, b):
+    """Equal, counting nulls as equal whatever their type"""
+    a, b = a.astype(object), b.astype(object)
+    return bool((a.isna() == b.isna()).all() and (a[a.notna()] == b[b.notna()]).all())
+
+
+def setup_module():
+    global cleaner
+    cleaner = clean_nets.Cleaner()
+
+    global df_long
+    df_long = make_long(300)
+
+
+def test_normalize_spot_check():
+    df = pd.DataFrame({'DunsNumber': [1, 1, 1, 1, 2, 2, 3, 3],
+                       'Year': [2000, 2001, 2002, 2003, 1999, 2000, 2005, 2006],
+                       'Address': ['A', 'A', 'B', 'A', 'X', 'X', 'M', 'M'],
+                       'City': ['C', 'C', 'C', 'C', 'Y', 'Y', np.nan, 'N']}).set_index(['DunsNumber', 'Year'])
+    normal = cleaner.normalize_df(df, beh_loc=True)
+
+    # Moving back to A isn't a new spell.  Business 3 only filled in its city, which doesn't count as moving
+    assert normal.index.tolist() == [(1, 2000), (1, 2002), (2, 1999), (3, 2005), (3, 2006)]
+    assert normal['LastYear'].tolist() == [2001, 2003, 2000, 2006, 2006]
+    assert normal['Address'].tolist() == ['A', 'B', 'X', 'M', 'M']
+    assert normal['BEH_LOC'].tolist() == [1, 0, 0, 1, 0]
+
+
+def test_normalize_matches_reference():
+    normal = cleaner.normalize_df(df_long, beh_loc=True)
+    reference = reference_normalize(df_long)
+
+    assert normal.index.equals(reference.index)
+    assert normal.columns.tolist() == reference.columns.tolist()
+    for col in reference.columns:
+        assert same_values(normal[col], reference[col]), col
+
+
+def test_normalize_empty():
+    normal = cleaner.normalize_df(df_long.iloc[:0])
+    assert len(normal) == 0
+    assert normal.columns.tolist() == ['LastYear'] + df_long.columns.tolist()
+
+
+def test_wide_to_long_matches_pandas():
+    long_df = df_long.reset_index()
+    long_df['yy'] = long_df['Year'].astype(str).str[-2:]
+    wide = long_df.pivot(index='DunsNumber', columns='yy', values=['Address', 'City', 'ZIP', 'FipsCounty'])
+    wide.columns = [x + y for x, y in wide.columns]
+    # A stub missing some years
+    wide = wide.drop(columns=[x for x in wide.columns if x.startswith('ZIP') and x[-2] == '0'])
+    stubs = ['Address', 'City', 'ZIP', 'FipsCounty']
+
+    new = cleaner.wide_to_long(wide, stubs)
+
+    # What it replaced: pd.wide_to_long on the full-year columns
+    old = wide.copy()
+    old.columns = cleaner.make_fullyear(old.columns)
+    old = pd.wide_to_long(old.reset_index(), stubs, i='DunsNumber', j='Year').sort_index().dropna(how='all')
+
+    assert new.index.tolist() == old.index.tolist()
+    assert new.columns.tolist() == stubs
+    for col in stubs:
+        assert same_values(new[col], old[col]), col
+
+
+def write_address_files(dirpath, shuffle_second=False):
+    """The raw 1990s and 2000s address files of df_long, tab delimited with two-digit year suffixes"""
+    long_df = df_long.reset_index()
+    long_df['State'] = 'NY'
+    long_df['CityCode'] = long_df['ZIP'] % 7
+    long_df['yy'] = long_df['Year'].astype(str).str[-2:]
+    stubs = ['Address', 'City', 'State', 'ZIP', 'CityCode', 'FipsCounty']
+    wide = long_df.pivot(index='DunsNumber', columns='yy', values=stubs)
+    wide.columns = [x + y for x, y in wide.columns]
+    wide = wide.reset_index()
+
+    cols_99 = ['DunsNumber'] + [x for x in wide.columns if x[-2:-1] == '9']
+    cols_14 = ['DunsNumber'] + [x for x in wide.columns if x[-2:-1] in ('0', '1')]
+    wide[cols_99].to_csv(dirpath / 'add99.txt', sep='\t', index=False)
+    second = wide.sample(frac=1, random_state=0) if shuffle_second else wide
+    second[cols_14].to_csv(dirpath / 'add14.txt', sep='\t', index=False)
+
+
+def test_create_locations_unsorted_input(tmp_path):
+    for name, shuffle in [('sorted', False), ('shuffled', True)]:
+        os.makedirs(str(tmp_path / name / 'out'))
+        write_address_files(tmp_path / name, shuffle_second=shuffle)
+        cleaner.create_locations(tmp_path / name / 'add99.txt', tmp_path / name / 'add14.txt',
+                                 tmp_path / name / 'out' / 'locations.csv', chunksize=100, check='off')
+
+    in_order = pd.read_csv(tmp_path / 'sorted' / 'out' / 'locations.csv').sort_values('BEH_ID', ignore_index=True)
+    shuffled = pd.read_csv(tmp_path / 'shuffled' / 'out' / 'locations.csv').sort_values('BEH_ID', ignore_index=True)
+    assert len(in_order) == len(reference_normalize(df_long))
+    assert shuffled.equals(in_order)
+    # Whether each input was sorted is remembered next to the output, not in the raw data folder
+    assert sorted(os.listdir(str(tmp_path / 'shuffled'))) == ['add14.txt', 'add99.txt', 'out']
+    assert len([x for x in os.listdir(str(tmp_path / 'shuffled' / 'out')) if x.endswith('.sorted.json')]) == 2
+
+
+def test_check_sums_writes_bad_rows(tmp_path):
+    # Business 2's spells overlap, so they sum to more years than it was active
+    normal = pd.DataFrame({'DunsNumber': [1, 2, 2], 'FirstYear': [2000, 2000, 2001], 'LastYear': [2003, 2002, 2003]},
+                          index=pd.Index([10, 20, 21], name='BEH_ID'))
+    long = pd.DataFrame({'Address': 'A'}, index=pd.MultiIndex.from_product([[1, 2], range(2000, 2004)],
+                                                                           names=['DunsNumber', 'Year']))
+
+    # Without a report the check raises, but the bad rows are written next to the checked file first
+    checker = clean_nets.Checker(normal, long, error_path=tmp_path / 'locations.csv')
+    with pytest.raises(ValueError):
+        checker.check_sums()
+    assert pd.read_csv(tmp_path / 'locations_bad_normal.csv')['BEH_ID'].tolist() == [20, 21]
+    assert pd.read_csv(tmp_path / 'locations_bad_long.csv')['DunsNumber'].unique().tolist() == [2]
+
+    # With one they go to the report, and checking carries on
+    report = clean_nets.ErrorReport(tmp_path / 'reported.csv')
+    clean_nets.Checker(normal, long, report).check_sums()
+    report.close()
+    assert report.count == 2
+    assert pd.read_csv(tmp_path / 'reported_bad_normal.csv')['BEH_ID'].tolist() == [20, 21]
+
+
+def test_create_locations_resume(tmp_path, monkeypatch):
+    write_address_files(tmp_path)
+    paths = [tmp_path / 'add99.txt', tmp_path / 'add14.txt']
+    cleaner.create_locations(*paths, tmp_path / 'full.csv', chunksize=100)
+
+    # Killed after committing two chunks, then resumed from the address lines after the last DunsNumber written
+    commit = clean_nets.Checkpoint.commit
+
+    def killed(self, offsets, **state):
+        if self.n_chunks == 2:
+            raise KeyboardInterrupt()
+        commit(self, offsets, **state)
+
+    monkeypatch.setattr(clean_nets.Checkpoint, 'commit', killed)
+    with pytest.raises(KeyboardInterrupt):
+        cleaner.create_locations(*paths, tmp_path / 'resumed.csv', chunksize=100, checkpointed=True)
+    monkeypatch.setattr(clean_nets.Checkpoint, 'commit', commit)
+    cleaner.create_locations(*paths, tmp_path / 'resumed.csv', chunksize=100, resume=True)
+
+    assert (tmp_path / 'resumed.csv').read_bytes() == (tmp_path / 'full.csv').read_bytes()
+    assert not os.path.exists('{}.checkpoint.json'.format(tmp_path / 'resumed.csv'))
+
+
+def test_checker_modes(tmp_path):
+    # Spells ending before they start, overlapping spells and duplicate BEH_IDs, 20 businesses each
+    duns = np.repeat(np.arange(1000) + 10**6, 2)
+    first = np.tile([2000, 2005], 1000)
+    last = first + 4
+    last[:40:2] = 1995
+    first[41:80:2] = 2003
+    beh_id = np.arange(len(duns)) + 10**10
+    beh_id[81:120:2] = beh_id[80:120:2]
+    normal = pd.DataFrame({'DunsNumber': duns, 'FirstYear': first, 'LastYear': last}, index=pd.Index(beh_id))
+    long = pd.DataFrame({'Address': 'A'}, index=pd.MultiIndex.from_arrays([duns, first], names=['DunsNumber', 'Year']))
+
+    counts = {}
+    for mode in clean_nets.Checker.modes:
+        report = clean_nets.ErrorReport(tmp_path / '{}.csv'.format(mode))
+        clean_nets.Checker(normal, long, report, mode=mode, fraction=0.25).check_all()
+        report.close()
+        counts[mode] = report.count
+        if report.count:
+            errors = pd.read_csv(report.errors.filepath)
+            counts[mode] = errors.groupby('check')['DunsNumber'].nunique().to_dict()
+
+    # Every business with a problem is found in full mode, and only the sampled ones in sample mode
+    assert counts['full'] == {'first_last': 20, 'sums': 40, 'index': 20}
+    sampled = set(normal['DunsNumber'][clean_nets.Checker.sample(normal['DunsNumber'], 0.25)])
+    expected = {'first_last': duns[:40:2], 'sums': duns[:80:2], 'index': duns[80:120:2]}
+    assert counts['sample'] == {k: len(sampled & set(v)) for k, v in expected.items()}
+    assert 0 < sum(counts['sample'].values()) < sum(counts['full'].values())
+    assert counts['off'] == 0
+
+    # The sample is the same businesses whatever chunk they are in
+    assert (clean_nets.Checker.sample(duns[::-1], 0.25) == clean_nets.Checker.sample(duns, 0.25)[::-1]).all()
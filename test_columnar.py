@@ -0,0 +1,103 @@
+import pandas as pd
+import pytest
+
+import columnar
+
+# Synthetic raw address file: padded fields, a line with too few fields and one with too many
+header = ['DunsNumber', 'Address99', 'City99', 'ZIP99', 'Extra']
+lines = ['1001\t 12 MAIN ST \tSPRINGFIELD  \t10001\tx',
+         '1002\t9 ELM AVE\t SHELBYVILLE\t10002\tx',
+         '1003\t1 OAK RD\tOGDENVILLE',
+         '1004\tTOO\tMANY\t10004\tx\ty',
+         '1005\t   \tCAPITAL CITY\t\tx',
+         '1006\t4 PINE ST\tNORTH HAVERBROOK\t10006\tx']
+
+
+def write_raw(filepath, n_copies=1):
+    with open(filepath, 'w', encoding='Windows-1252') as f:
+        f.write('\t'.join(header) + '\n')
+        for i in range(n_copies):
+            f.write('\n'.join(x.replace('100', str(100 + 10 * i), 1) for x in lines) + '\n')
+
+
+@pytest.fixture(params=['arrow', 'pandas'])
+def parser(request, monkeypatch):
+    """Run a test with pyarrow's parser and with the pandas fallback"""
+    if request.param == 'pandas':
+        monkeypatch.setattr(columnar, 'pv', None)
+    return request.param
+
+
+def test_pad_short_lines():
+    block = b'a,b,c\nd\n\ne,f\r\ng'
+    assert columnar.pad_short_lines(block, 3, ',') == b'a,b,c\nd,,\n\ne,f,\r\ng,,\n'
+
+
+def test_drop_long_lines():
+    assert columnar.drop_long_lines(b'a,b\nc,d,e\nf\n\ng,h,i,j', 2, ',') == (b'a,b\nf\n\n', 2)
+    assert columnar.drop_long_lines(b'a,b\n', 2, ',') == (b'a,b\n', 0)
+
+
+def test_raw_reader(tmp_path, parser):
+    write_raw(tmp_path / 'raw.txt')
+    reader = columnar.RawTextReader(tmp_path / 'raw.txt', ['DunsNumber', 'Address99', 'City99', 'ZIP99'])
+    df = pd.concat(reader)
+
+    # The line with too many fields is skipped and counted
+    assert df['DunsNumber'].tolist() == [1001, 1002, 1003, 1005, 1006]
+    assert reader.skipped == 1
+    # Fields are stripped, empty ones are null and ones of spaces empty, as str.strip after read_csv left them
+    assert df['Address99'].tolist()[:2] == ['12 MAIN ST', '9 ELM AVE']
+    assert df['City99'].tolist()[:2] == ['SPRINGFIELD', 'SHELBYVILLE']
+    assert df['Address99'].iloc[3] == '' and pd.isna(df['ZIP99'].iloc[3])
+    # The short line gets empty trailing fields rather than being dropped
+    assert df['City99'].iloc[2] == 'OGDENVILLE' and pd.isna(df['ZIP99'].iloc[2])
+    assert df['DunsNumber'].dtype == 'uint32'
+
+
+def test_raw_reader_chunks(tmp_path, parser):
+    # Ranges of a few lines each, so the lines are cut into ranges and chunks at different places
+    write_raw(tmp_path / 'raw.txt', n_copies=20)
+    whole = pd.concat(columnar.RawTextReader(tmp_path / 'raw.txt', ['DunsNumber', 'City99']))
+    reader = columnar.RawTextReader(tmp_path / 'raw.txt', ['DunsNumber', 'City99'], chunksize=7, block_size=100,
+                                    threads=1, index_col='DunsNumber')
+    chunks = list(reader)
+
+    assert [len(x) for x in chunks[:-1]] == [7] * (len(chunks) - 1)
+    assert pd.concat(chunks).reset_index().equals(whole.reset_index(drop=True))
+    assert reader.skipped == 20
+
+
+def test_raw_reader_start(tmp_path, parser):
+    write_raw(tmp_path / 'raw.txt')
+    with open(tmp_path / 'raw.txt', 'rb') as f:
+        f.readline()
+        f.readline()
+        start = f.tell()
+
+    df = pd.concat(columnar.RawTextReader(tmp_path / 'raw.txt', ['DunsNumber'], start=start))
+    assert df['DunsNumber'].tolist() == [1002, 1003, 1005, 1006]
+    assert list(columnar.RawTextReader(tmp_path / 'raw.txt', ['DunsNumber'], start=10**6)) == []
+
+
+def test_parquet_matches_csv(tmp_path):
+    df = pd.DataFrame({'BEH_ID': range(10**10, 10**10 + 300), 'DunsNumber': [x // 3 for x in range(300)],
+                       'adr_net_piz_c_2014': [x % 2 for x in range(300)],
+                       'Company': ['CO {}'.format(x) if x >= 100 else None for x in range(300)]})
+    for name in ['out.csv', 'out.parquet']:
+        # The first chunk's Company is all null, which mustn't decide the column's type
+        with columnar.ChunkWriter(tmp_path / name, row_group_size=64) as writer:
+            for i in range(0, 300, 100):
+                writer.write(df.iloc[i:i + 100])
+
+    assert columnar.read_header(tmp_path / 'out.parquet') == columnar.read_header(tmp_path / 'out.csv')
+    columns = ['BEH_ID', 'DunsNumber', 'adr_net_piz_c_2014', 'Company']
+    filters = [('adr_net_piz_c_2014', '==', 1), ('DunsNumber', '>=', 40)]
+    csv, parquet = [pd.concat(columnar.read_chunks(tmp_path / x, columns=columns, filters=filters, chunksize=50))
+                    .reset_index(drop=True) for x in ['out.csv', 'out.parquet']]
+
+    assert len(csv) == ((df['adr_net_piz_c_2014'] == 1) & (df['DunsNumber'] >= 40)).sum()
+    assert parquet[csv.columns].astype(str).equals(csv.astype(str))
+
+    columnar.select_columns(tmp_path / 'out.parquet', tmp_path / 'ids.parquet', ['BEH_ID'])
+    assert columnar.read_header(tmp_path / 'ids.parquet') == ['BEH_ID']
@@ -0,0 +1,113 @@
+import pipeline
+
+# Initialize setup outputs
+runs = []
+
+
+def upper(read_path, write_path, workers=1):
+    runs.append('upper')
+    with open(read_path, 'r') as f:
+        text = f.read()
+    with open(write_path, 'w') as f:
+        f.write(text.upper())
+
+
+def count(read_path, config_path, write_path, report_path):
+    """Writes the report only when there is a line with BAD in it"""
+    runs.append('count')
+    with open(read_path, 'r') as f:
+        lines = f.read().splitlines()
+    with open(config_path, 'r') as f:
+        suffix = f.read()
+    with open(write_path, 'w') as f:
+        f.write('{}{}'.format(len(lines), suffix))
+    bad = [x for x in lines if 'BAD' in x]
+    if bad:
+        with open(report_path, 'w') as f:
+            f.write('\n'.join(bad))
+
+
+def make_pipeline(tmp_path, workers=1):
+    data, upper_path = tmp_path / 'data.txt', tmp_path / 'upper.txt'
+    stages = [
+        pipeline.Stage('upper', upper, inputs=[data], outputs=[upper_path], neutral=['workers'],
+                       params=dict(read_path=data, write_path=upper_path, workers=workers)),
+        pipeline.Stage('count', count, inputs=[upper_path], outputs=[tmp_path / 'count.txt'],
+                       optional=[tmp_path / 'report.txt'], configs=[tmp_path / 'config.txt'],
+                       params=dict(read_path=upper_path, config_path=tmp_path / 'config.txt',
+                                   write_path=tmp_path / 'count.txt', report_path=tmp_path / 'report.txt')),
+    ]
+    return pipeline.Pipeline(stages, tmp_path / 'cache')
+
+
+def run(tmp_path, **kwargs):
+    del runs[:]
+    make_pipeline(tmp_path, **kwargs).run()
+    return list(runs)
+
+
+def test_unchanged_stages_are_restored(tmp_path):
+    (tmp_path / 'data.txt').write_text('a\nb\n')
+    (tmp_path / 'config.txt').write_text('!')
+
+    assert run(tmp_path) == ['upper', 'count']
+    assert (tmp_path / 'count.txt').read_text() == '2!'
+    assert run(tmp_path) == []
+
+    # Outputs deleted since are put back from the cache
+    (tmp_path / 'count.txt').unlink()
+    assert run(tmp_path) == []
+    assert (tmp_path / 'count.txt').read_text() == '2!'
+
+    # A parameter the outputs don't depend on doesn't count
+    assert run(tmp_path, workers=4) == []
+
+
+def test_changes_rerun_what_depends_on_them(tmp_path):
+    (tmp_path / 'data.txt').write_text('a\nb\n')
+    (tmp_path / 'config.txt').write_text('!')
+    run(tmp_path)
+
+    # A config only reruns the stage reading it
+    (tmp_path / 'config.txt').write_text('?')
+    assert run(tmp_path) == ['count']
+    assert (tmp_path / 'count.txt').read_text() == '2?'
+
+    # An input reruns its stage and the stages downstream
+    (tmp_path / 'data.txt').write_text('a\nb\nc\n')
+    assert run(tmp_path) == ['upper', 'count']
+    assert (tmp_path / 'count.txt').read_text() == '3?'
+
+    # Going back to earlier inputs is a cache hit
+    (tmp_path / 'data.txt').write_text('a\nb\n')
+    assert run(tmp_path) == []
+    assert (tmp_path / 'upper.txt').read_text() == 'A\nB\n'
+
+
+def test_optional_outputs(tmp_path):
+    (tmp_path / 'data.txt').write_text('a\nbad\n')
+    (tmp_path / 'config.txt').write_text('!')
+    run(tmp_path)
+    assert (tmp_path / 'report.txt').read_text() == 'BAD'
+
+    # A run without problems leaves no report from the one before
+    (tmp_path / 'data.txt').write_text('a\nb\n')
+    run(tmp_path)
+    assert not (tmp_path / 'report.txt').exists()
+
+    # And restoring the run that had them brings them back
+    (tmp_path / 'data.txt').write_text('a\nbad\n')
+    assert run(tmp_path) == []
+    assert (tmp_path / 'report.txt').read_text() == 'BAD'
+
+
+def test_nets_stages(tmp_path):
+    nets = pipeline.Pipeline(pipeline.nets_stages(tmp_path, pipeline.Path(pipeline.__file__).parent / 'config'),
+                             tmp_path / 'cache')
+
+    assert sorted(nets.stages) == ['classification', 'locations', 'phase_3', 'remove_main_hierarchy', 'sample']
+    assert nets.upstream['classification'] == ['locations']
+    assert nets.upstream['sample'] == ['remove_main_hierarchy']
+    # The checker's reports are outputs of the locations stage
+    assert [x.name for x in nets.stages['locations'].optional] == [
+        'NETS2014_Locations_errors.csv', 'NETS2014_Locations_bad_normal.csv', 'NETS2014_Locations_bad_long.csv']
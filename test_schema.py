@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+import schema
+from columnar import read_chunks
+
+# Synthetic net_vars rows
+columns = ['BEH_ID', 'DunsNumber', 'adr_net_piz_c_2014', 'adr_net_bar_c_2014', 'adr_net_caf_c_2014']
+lines = ['10000000001,1234,1,0,300',
+         '10000000002,1234,,1,2',
+         '10000000003,5678,0,0,5']
+
+
+def write_flags(filepath):
+    """Dummies with a blank, a plain 0/1 column and a column of counts"""
+    with open(filepath, 'w') as f:
+        f.write('\n'.join([','.join(columns)] + lines) + '\n')
+
+
+def test_read_dtypes():
+    dtypes = schema.read_dtypes(columns)
+
+    assert dtypes['BEH_ID'] == 'int64' and dtypes['DunsNumber'] == 'int64'
+    # Dummies may be blank, so they aren't parsed as a numpy integer
+    assert dtypes['adr_net_piz_c_2014'] == schema.FLAGS_READ
+
+
+def test_missing_dummy(tmp_path):
+    write_flags(tmp_path / 'flags.csv')
+    df = next(read_chunks(tmp_path / 'flags.csv', chunksize=10))
+
+    assert df['DunsNumber'].dtype == 'uint32'
+    # The blank stays null, and the rest of its column is narrowed around it
+    assert df['adr_net_piz_c_2014'].dtype == 'Int8'
+    assert df['adr_net_piz_c_2014'].isna().tolist() == [False, True, False]
+    assert df['adr_net_bar_c_2014'].dtype == 'int8'
+    # Counts aren't flags, they keep a type that holds them
+    assert df['adr_net_caf_c_2014'].tolist() == [300, 2, 5]
+
+
+def test_cast_keeps_values_that_dont_fit():
+    values = pd.Series([1, 300, np.nan])
+    assert schema.cast(values, 'int8', 'adr_net_piz_c_2014').tolist()[:2] == [1, 300]
+    assert schema.cast(pd.Series([1, 0, np.nan]), 'int8', 'adr_net_piz_c_2014').dtype == 'Int8'
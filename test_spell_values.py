@@ -0,0 +1,71 @@
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import spell_values
+from spell_values import YEARS
+
+# Initialize setup outputs
+values = None
+firstyear = None
+lastyear = None
+
+
+def brute_force(row, first, last, how):
+    """Reduction of one spell, a year at a time"""
+    seen = [(year, x) for year, x in zip(YEARS, row) if first <= year <= last and not np.isnan(x)]
+    if not seen:
+        return np.nan
+    if how == 'last':
+        return seen[-1][1]
+    if how == 'max':
+        return max(x for _, x in seen)
+    # Most common, ties going to the value seen in the most recent year
+    counts = Counter(x for _, x in seen)
+    return max(counts, key=lambda x: (counts[x], max(year for year, y in seen if y == x)))
+
+
+def setup_module():
+    # Few distinct values so modes have ties, and gaps
+    global values, firstyear, lastyear
+    rng = np.random.default_rng(0)
+    values = rng.choice([1.0, 2.0, 3.0, np.nan], (500, len(YEARS)), p=[0.3, 0.3, 0.2, 0.2])
+    firstyear = rng.integers(1990, 2015, 500)
+    lastyear = np.minimum(firstyear + rng.integers(0, 10, 500), 2014)
+
+
+@pytest.mark.parametrize('how', ['mode', 'last', 'max'])
+def test_reduce_spells(how):
+    result = spell_values.reduce_spells(values, firstyear, lastyear, how, batch_size=64)
+    expected = [brute_force(*x, how) for x in zip(values, firstyear, lastyear)]
+    assert np.allclose(result, expected, equal_nan=True)
+
+
+def test_reduce_spells_no_valid_years():
+    row = np.full((1, len(YEARS)), np.nan)
+    row[0, 0] = 5.0
+    # The only value is before the spell
+    assert np.isnan(spell_values.reduce_spells(row, np.array([2000]), np.array([2005]), 'mode')[0])
+
+
+def test_aggregate_spells():
+    wide = pd.DataFrame(values[:3], columns=spell_values.year_columns('SIC'), index=pd.Index([7, 8, 9]))
+    wide = wide.join(pd.DataFrame(values[3:6], columns=spell_values.year_columns('Emp'), index=wide.index))
+    spells = pd.DataFrame({'DunsNumber': [9, 7, 7, 4], 'FirstYear': [1990, 1990, 2000, 1990],
+                           'LastYear': [2014, 1999, 2014, 2014]},
+                          index=pd.Index([101, 102, 103, 104], name='BEH_ID'))
+
+    result = spell_values.aggregate_spells(spells, wide, how={'Emp': 'max'})
+    # No Sales columns, so no Sales
+    assert result.columns.tolist() == ['BEH_SIC', 'Emp']
+    assert result.index.equals(spells.index)
+
+    rows = [2, 0, 0]
+    for i, row in enumerate(rows):
+        first, last = spells['FirstYear'].iloc[i], spells['LastYear'].iloc[i]
+        assert np.allclose(result['BEH_SIC'].iloc[i], brute_force(values[row], first, last, 'mode'), equal_nan=True)
+        assert np.allclose(result['Emp'].iloc[i], brute_force(values[3 + row], first, last, 'max'), equal_nan=True)
+    # A business missing from the yearly files
+    assert result.iloc[3].isna().all()
@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import stream_join
+
+# Initialize setup outputs
+df_sorted = None
+
+
+def split(df, chunksize):
+    return [df.iloc[i:i + chunksize] for i in range(0, len(df), chunksize)]
+
+
+def counted(chunks, reads):
+    """chunks, counting in reads how many were read"""
+    for chunk in chunks:
+        reads.append(1)
+        yield chunk
+
+
+def setup_module():
+    # DunsNumbers repeating a few times each, as in the yearly files
+    global df_sorted
+    rng = np.random.default_rng(0)
+    duns = np.sort(rng.integers(10**6, 10**6 + 500, 2000))
+    df_sorted = pd.DataFrame({'value': np.arange(2000)}, index=pd.Index(duns, name='DunsNumber'))
+
+
+def test_aligned_chunks():
+    # Rows of one key split across chunk boundaries, and keys missing from either stream
+    left = df_sorted.iloc[::2]
+    right = df_sorted.iloc[1::3].rename(columns={'value': 'other'})
+    batches = list(stream_join.aligned_chunks(split(left, 77), split(right, 130)))
+
+    assert pd.concat([x[0] for x in batches]).equals(left)
+    assert pd.concat([x[1] for x in batches if len(x[1])]).equals(right)
+    # Every key lands in a single batch
+    keys = [set(a.index) | set(b.index) for a, b in batches]
+    assert sum(len(x) for x in keys) == len(set().union(*keys))
+
+
+def test_aligned_chunks_unsorted():
+    shuffled = df_sorted.sample(frac=1, random_state=0)
+    with pytest.raises(stream_join.UnsortedInputError):
+        list(stream_join.aligned_chunks(split(shuffled, 100), split(df_sorted, 100)))
+
+
+def test_external_sort(tmp_path):
+    shuffled = df_sorted.sample(frac=1, random_state=0)
+    merged = pd.concat(stream_join.external_sort(split(shuffled, 300), tmp_path, piece_size=50))
+
+    assert merged.index.is_monotonic_increasing
+    assert sorted(merged['value']) == sorted(df_sorted['value'])
+    assert (merged.index.to_numpy() == df_sorted.index.to_numpy()).all()
+    # The run files are gone
+    assert os.listdir(tmp_path) == []
+
+
+def test_prefetch():
+    assert pd.concat(stream_join.prefetch(iter(split(df_sorted, 100)))).equals(df_sorted)
+
+    def failing():
+        yield df_sorted
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        list(stream_join.prefetch(failing()))
+
+
+def test_sorted_chunks_unsorted_input(tmp_path):
+    filepath = tmp_path / 'in' / 'raw.txt'
+    os.makedirs(str(filepath.parent))
+    filepath.write_text('raw')
+    out_dir = tmp_path / 'out'
+    os.makedirs(str(out_dir))
+    shuffled = df_sorted.sample(frac=1, random_state=0)
+
+    reads = []
+    stream = stream_join.sorted_chunks(split(shuffled, 300), counted(split(shuffled, 300), reads), out_dir, filepath)
+    # Nothing is read before the first chunk is asked for
+    assert stream.is_sorted is None and reads == []
+
+    merged = pd.concat(stream)
+    assert stream.is_sorted is False
+    assert merged.index.is_monotonic_increasing and len(merged) == len(df_sorted)
+    # What it found is remembered next to the output, never next to the input
+    assert os.listdir(str(filepath.parent)) == ['raw.txt']
+    assert stream_join.read_marker(filepath, out_dir) is False
+
+    # So the next run doesn't read the keys again
+    reads = []
+    stream = stream_join.sorted_chunks(split(shuffled, 300), counted(split(shuffled, 300), reads), out_dir, filepath)
+    assert pd.concat(stream).equals(merged) and reads == []
+
+
+def test_sorted_chunks_assumed_sorted(tmp_path):
+    shuffled = df_sorted.sample(frac=1, random_state=0)
+    stream = stream_join.sorted_chunks(split(shuffled, 300), None, tmp_path, assume_sorted=True)
+    with pytest.raises(stream_join.UnsortedInputError):
+        list(stream)
+
+    stream = stream_join.sorted_chunks(split(df_sorted, 300), None, tmp_path, assume_sorted=True)
+    assert pd.concat(stream).equals(df_sorted) and stream.is_sorted